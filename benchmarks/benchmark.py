@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+'''
+Times each stage of a MIDAS to EVA conversion on synthetic runs.
+
+Example:
+    python benchmarks/benchmark.py --cycles 20000 --ions 50 --mcpp
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from midas2eva import MidasToEva
+from midas2eva.synthetic import writeSyntheticRun
+
+
+def residentMemory():
+    '''
+    Resident memory of this process now, in MB, or None where
+    /proc/self/statm cannot be read.
+    '''
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 1e6
+
+
+class MemorySampler(threading.Thread):
+    '''
+    MemorySampler samples the resident memory every 'interval' seconds
+    while one stage runs and keeps the largest value in 'peak', so each
+    stage gets its own peak rather than that of the process so far.
+    '''
+
+    def __init__(self, interval=0.005):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.first = residentMemory()
+        self.peak = self.first
+        self.done = threading.Event()
+
+    def sample(self):
+        memory = residentMemory()
+        if memory is not None:
+            self.peak = max(self.peak, memory)
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.done.set()
+        self.join()
+        self.sample()
+
+
+def timeStage(results, name, func, *args):
+    sampler = MemorySampler()
+    if sampler.first is not None:
+        sampler.start()
+    cpu = os.times()
+    wall = time.time()
+    func(*args)
+    wall = time.time() - wall
+    cpu = sum(os.times()[:2]) - sum(cpu[:2])
+    if sampler.first is not None:
+        sampler.stop()
+    results.append({'stage': name, 'wall': wall, 'cpu': cpu,
+                    'peakmb': sampler.peak,
+                    'addedmb': sampler.peak - sampler.first
+                    if sampler.first is not None else None})
+
+
+def formatMemory(megabytes):
+    return 'n/a' if megabytes is None else '%.1f' % megabytes
+
+
+def benchmarkRun(filename, outdir, binwidth, maxtof, stream):
+    '''
+    benchmarkRun(filename, outdir, binwidth, maxtof, stream) converts one
+    run stage by stage. Returns the list of stage timings and the number
+    of events decoded, from the 'events' counters of the run metrics.
+    '''
+    m2e = MidasToEva(filename)
+    results = []
+    timeStage(results, 'extractXML', m2e.extractXML)
+    timeStage(results, 'readRunParameters', m2e.readRunParameters)
+    if stream:
+        timeStage(results, 'streamEvaFile', m2e.streamEvaFile, binwidth,
+                  maxtof, outdir)
+        return results, m2e.metrics.record()['totals'].get('events', 0)
+
+    timeStage(results, 'collectMdumpData', m2e.collectMdumpData)
+    timeStage(results, 'reorganizeMdumpData', m2e.reorganizeMdumpData)
+    timeStage(results, 'binMdumpData', m2e.binMdumpData, binwidth, maxtof)
+    timeStage(results, 'writeEvaFile', m2e.writeEvaFile, m2e.mass,
+              m2e.charge, m2e.amplitude, m2e.trf, outdir)
+    timeStage(results, 'writePosData', m2e.writePosData, outdir)
+    return results, m2e.metrics.record()['totals'].get('events', 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+                                     formatter_class=
+                                     argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cycles', type=int, default=5000)
+    parser.add_argument('--ions', type=float, default=20,
+                        help='mean number of ions per cycle')
+    parser.add_argument('--cycles-per-event', type=int, default=10,
+                        dest='cyclesperevent')
+    parser.add_argument('--mcpp', action='store_true',
+                        help='add MCPP position banks')
+    parser.add_argument('--binwidth', type=float, default=0.1)
+    parser.add_argument('--maxtof', type=float, default=100)
+    parser.add_argument('--stream', action='store_true',
+                        help='time streamEvaFile instead of the stages')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'synthetic.mid')
+        numions = writeSyntheticRun(filename, args.cycles, args.ions,
+                                    cyclesperevent=args.cyclesperevent,
+                                    mcpp=args.mcpp, maxtof=args.maxtof)
+        filesize = os.path.getsize(filename)
+        print('Synthetic run: %d cycles, %d ions, %.1f MB'
+              % (args.cycles, numions, filesize / 1e6))
+
+        runs = []
+        for repeat in range(args.repeat):
+            results, numevents = benchmarkRun(filename, tmpdir + '/',
+                                              args.binwidth, args.maxtof,
+                                              args.stream)
+            runs.append(results)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    # report the fastest repeat of every stage, with the peak resident
+    # memory while it ran and how much that is above its start
+    print('%-22s %10s %10s %14s %10s %10s'
+          % ('stage', 'wall s', 'cpu s', 'events/s', 'peak MB', 'added MB'))
+    best = []
+    for stage in range(len(runs[0])):
+        result = min((run[stage] for run in runs),
+                     key=lambda result: result['wall'])
+        result['eventspersec'] = numevents / max(result['wall'], 1e-9)
+        best.append(result)
+        print('%-22s %10.4f %10.4f %14.0f %10s %10s'
+              % (result['stage'], result['wall'], result['cpu'],
+                 result['eventspersec'], formatMemory(result['peakmb']),
+                 formatMemory(result['addedmb'])))
+    total = sum(result['wall'] for result in best)
+    print('%-22s %10.4f %10s %14.0f' % ('total', total, '',
+                                        numevents / max(total, 1e-9)))
+
+    if args.json:
+        with open(args.json, 'w') as jsonfile:
+            json.dump({'cycles': args.cycles, 'ions': numions,
+                       'events': numevents, 'filesize': filesize,
+                       'stages': best}, jsonfile, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,310 @@
+import os
+import sys
+import json
+import time
+import glob
+import argparse
+import traceback
+from multiprocessing import Pool
+
+from midas2eva import MidasToEva, GATE_ERROR_MODES
+from cache import EventCache
+from metrics import RunMetrics
+from merge import mergeRuns, mergedPath
+
+
+def convertRun(filename, path, binwidth=0.1, maxtof=100, stream=False,
+               cachedir=None, split=1, onerror='raise', columnar=None,
+               pospath=None, incremental=False, metrics=None):
+    '''
+    convertRun(filename, path, binwidth, maxtof, stream, cachedir, split,
+    onerror, columnar, pospath, incremental, metrics) runs the full
+    conversion of one MIDAS file to an EVA file in the 'path' directory.
+    With 'stream' set the run is converted with streamEvaFile, and with
+    'split' above 1 the file is decoded and binned by that many processes
+    (see MidasToEva.binParallel).
+    'onerror' says what to do about bad TDC gates (see
+    MidasToEva.binMdumpData). With 'columnar' set to 'npy' or 'npz' the
+    binned data is also exported with MidasToEva.writeColumnar; this needs
+    the binned data, so it cannot be combined with 'stream'. With 'pospath'
+    the MCP positions are written there with MidasToEva.writePosData; runs
+    converted with 'stream' or 'split' have none. With 'incremental' a run
+    that is still being written is converted as far as it goes and picked
+    up from there the next time (see MidasToEva.convertIncremental).
+
+    With 'cachedir' the decoded events are kept in an EventCache there, and
+    a run that is already in the cache is only rebinned. The stages are
+    recorded in 'metrics', a RunMetrics object, if one is given.
+    '''
+    m2e = MidasToEva(filename, metrics)
+    if not m2e.status:
+        raise IOError(filename + " is not a valid MIDAS file.")
+
+    path = os.path.join(path, '')
+    if incremental:
+        m2e.convertIncremental(binwidth, maxtof, path, onerror)
+        m2e.recordParameters()
+        if columnar is not None:
+            m2e.writeColumnar(path, npz=columnar == 'npz')
+        return m2e
+
+    cache = None
+    cached = False
+    if cachedir is not None:
+        cache = EventCache(cachedir)
+        cached = m2e.loadEventCache(cache)
+
+    if not cached:
+        m2e.extractXML()
+    m2e.readRunParameters()
+    m2e.recordParameters()
+
+    if stream and not cached:
+        checkWritten(m2e.streamEvaFile(binwidth, maxtof, path, onerror),
+                     filename, path)
+        return m2e
+
+    if split > 1 and cache is None:
+        m2e.binParallel(binwidth, maxtof, split, onerror)
+    else:
+        if not cached:
+            m2e.collectMdumpData()
+            m2e.reorganizeMdumpData()
+            if cache is not None:
+                m2e.storeEventCache(cache)
+        m2e.binMdumpData(binwidth, maxtof, onerror)
+    checkWritten(m2e.writeEvaFile(m2e.mass, m2e.charge, m2e.amplitude,
+                                  m2e.trf, path), filename, path)
+    if columnar is not None:
+        m2e.writeColumnar(path, npz=columnar == 'npz')
+    if pospath is not None and len(getattr(m2e, 'posdata', [])):
+        checkWritten(m2e.writePosData(os.path.join(pospath, '')), filename,
+                     pospath)
+    return m2e
+
+
+def checkWritten(written, filename, path):
+    '''
+    checkWritten(written, filename, path) raises IOError if a MidasToEva
+    writer returned None for 'written', i.e. could not write the output of
+    run 'filename' to the 'path' directory. The writers only print a
+    warning, which would otherwise let convertRun report the run as done.
+    '''
+    if written is None:
+        raise IOError('Could not write the output of ' + filename + ' to ' +
+                      path)
+
+
+def convertWorker(args):
+    '''
+    convertWorker(args) converts one run for runBatch and never raises:
+    any error is returned in the result so the rest of the batch carries
+    on. Returns (filename, error, seconds, metrics); 'error' is None on
+    success and 'metrics' is the RunMetrics record of the run.
+
+    If the last of 'args', 'profiledir', is set every stage is profiled and
+    the statistics are written there (see RunMetrics.dumpProfiles).
+    '''
+    filename, profiledir = args[0], args[-1]
+    metrics = RunMetrics(filename, profile=profiledir is not None)
+    error = None
+    start = time.time()
+    try:
+        convertRun(*args[:-1], metrics=metrics)
+    except Exception as err:
+        error = type(err).__name__ + ': ' + str(err)
+        if not isinstance(err, (IOError, OSError)):
+            error += '\n' + traceback.format_exc()
+    seconds = time.time() - start
+
+    if profiledir is not None:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        metrics.dumpProfiles(os.path.join(profiledir, name))
+    return (filename, error, seconds,
+            metrics.record(error=error, seconds=seconds))
+
+
+def collectRuns(patterns):
+    '''
+    collectRuns(patterns) expands a list of files, directories and glob
+    patterns into a sorted list of .mid files.
+    '''
+    runs = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.mid')
+        for filename in glob.glob(pattern):
+            if filename.endswith('.mid') and os.path.isfile(filename):
+                runs.add(filename)
+    return sorted(runs)
+
+
+def runBatch(runs, path, binwidth=0.1, maxtof=100, stream=False, jobs=1,
+             cachedir=None, profiledir=None, split=1, onerror='raise',
+             columnar=None, pospath=None, incremental=False):
+    '''
+    runBatch(runs, path, binwidth, maxtof, stream, jobs, cachedir,
+    profiledir, split, onerror, columnar, pospath, incremental) converts
+    every run in 'runs' with 'jobs' worker processes. Returns the list of
+    convertWorker results in completion order.
+
+    With 'split' above 1 each run is itself spread over 'split' processes,
+    and the runs are converted one after the other.
+    '''
+    tasks = [(run, path, binwidth, maxtof, stream, cachedir, split,
+              onerror, columnar, pospath, incremental, profiledir)
+             for run in runs]
+    if profiledir is not None and not os.path.isdir(profiledir):
+        os.makedirs(profiledir)
+    if jobs <= 1 or split > 1:
+        return [convertWorker(task) for task in tasks]
+
+    pool = Pool(processes=jobs)
+    try:
+        results = list(pool.imap_unordered(convertWorker, tasks))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+
+def printSummary(results, elapsed, out=sys.stdout):
+    failed = [result for result in results if result[1] is not None]
+    out.write('\n' + '=' * 60 + '\n')
+    out.write('Converted %d of %d runs in %.1f s\n'
+              % (len(results) - len(failed), len(results), elapsed))
+    for result in sorted(failed):
+        filename, error = result[:2]
+        out.write('FAILED ' + filename + ': ' + error.rstrip() + '\n')
+
+
+def writeMetrics(results, filename):
+    '''
+    writeMetrics(results, filename) appends the metrics record of every run
+    in 'results' to 'filename' as one line of JSON per run.
+    '''
+    with open(filename, 'a') as metricsfile:
+        for result in results:
+            metricsfile.write(json.dumps(result[3]) + '\n')
+
+
+def mergeBatch(runs, path, binwidth=0.1, maxtof=100, onerror='raise',
+               metricsfile=None, out=sys.stdout):
+    '''
+    mergeBatch(runs, path, binwidth, maxtof, onerror, metricsfile) merges
+    'runs' into one EVA file in 'path' with merge.mergeRuns and reports
+    the outcome like runBatch and printSummary do for separate runs.
+    Returns the exit status.
+    '''
+    output = mergedPath(runs, path)
+    metrics = RunMetrics(output)
+    error = None
+    start = time.time()
+    try:
+        mergeRuns(runs, path, binwidth, maxtof, onerror, output, metrics)
+    except Exception as err:
+        error = type(err).__name__ + ': ' + str(err)
+    seconds = time.time() - start
+
+    if error is None:
+        out.write('Merged %d runs into %s in %.1f s\n'
+                  % (len(runs), output, seconds))
+    else:
+        out.write('FAILED ' + output + ': ' + error.rstrip() + '\n')
+    if metricsfile is not None:
+        writeMetrics([(output, error, seconds,
+                       metrics.record(error=error, seconds=seconds))],
+                     metricsfile)
+    if error is not None:
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Convert MIDAS .mid runs into EVA files.')
+    parser.add_argument('runs', nargs='+',
+                        help='.mid files, directories or glob patterns')
+    parser.add_argument('-o', '--output', default='.',
+                        help='directory for the EVA files (default: .)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes (default: 1)')
+    parser.add_argument('--split', type=int, default=1,
+                        help='decode each run in this many processes; the '
+                             'runs are then converted one at a time '
+                             '(default: 1)')
+    parser.add_argument('--binwidth', type=float, default=0.1,
+                        help='TOF bin width in us (default: 0.1)')
+    parser.add_argument('--maxtof', type=float, default=100,
+                        help='maximum TOF in us (default: 100)')
+    parser.add_argument('--stream', action='store_true',
+                        help='convert with the constant memory '
+                             'streaming writer')
+    parser.add_argument('--cache-dir', dest='cachedir', default=None,
+                        help='keep decoded events in this directory so '
+                             'runs can be rebinned quickly')
+    parser.add_argument('--on-gate-error', dest='onerror',
+                        choices=GATE_ERROR_MODES, default='raise',
+                        help='fail the run on a bad TDC gate (raise), or '
+                             'carry on and drop or only flag the bad '
+                             'cycles (default: raise)')
+    parser.add_argument('--columnar', choices=('npy', 'npz'), default=None,
+                        help='also export the binned data as a directory of '
+                             '.npy files or as one .npz file')
+    parser.add_argument('--pos-output', dest='posoutput', default=None,
+                        help='also write the MCP positions as text to this '
+                             'directory')
+    parser.add_argument('--incremental', action='store_true',
+                        help='convert runs that are still being written as '
+                             'far as they go, and carry on from a '
+                             'checkpoint on the next call')
+    parser.add_argument('--merge', action='store_true',
+                        help='merge the runs, which must share their scan '
+                             'settings, into a single EVA file')
+    parser.add_argument('--metrics', default=None,
+                        help='append a JSON line with the stage timings '
+                             'and counters of each run to this file')
+    parser.add_argument('--profile', dest='profiledir', default=None,
+                        help='profile every stage and write the cProfile '
+                             'statistics to this directory')
+    args = parser.parse_args(argv)
+    if args.stream and args.columnar:
+        parser.error('--columnar cannot be used with --stream')
+    if args.incremental and (args.stream or args.split > 1 or
+                             args.cachedir is not None):
+        parser.error('--incremental cannot be used with --stream, --split '
+                     'or --cache-dir')
+    if args.merge and (args.stream or args.split > 1 or args.incremental or
+                       args.cachedir is not None or args.columnar or
+                       args.posoutput is not None):
+        parser.error('--merge cannot be used with --stream, --split, '
+                     '--incremental, --cache-dir, --columnar or --pos-output')
+
+    runs = collectRuns(args.runs)
+    if not runs:
+        print('No MIDAS files found.')
+        return 1
+
+    if args.merge:
+        return mergeBatch(runs, args.output, args.binwidth, args.maxtof,
+                          args.onerror, args.metrics)
+
+    start = time.time()
+    results = runBatch(runs, args.output, args.binwidth, args.maxtof,
+                       args.stream, args.jobs, args.cachedir,
+                       args.profiledir, args.split, args.onerror,
+                       args.columnar, args.posoutput, args.incremental)
+    printSummary(results, time.time() - start)
+    if args.metrics is not None:
+        writeMetrics(results, args.metrics)
+
+    if any(result[1] is not None for result in results):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,313 @@
+from collections import namedtuple
+
+import numpy as np
+
+from events import EVENT_OPEN, EVENT_CLOSE, EVENT_OUTOFGATE, TOF_TICK
+
+# A bad TDC gate: 'cycle' is the row of the cycle its close ends (counted
+# from 0) and 'kind' the name of the exception the gate checks raise.
+GateDefect = namedtuple('GateDefect', ['cycle', 'kind', 'startcounter',
+                                       'endcounter'])
+
+
+def tofBins(ticks, binwidth, maxtof, numchannels):
+    '''
+    tofBins(ticks, binwidth, maxtof, numchannels) converts TOF ticks into
+    channel numbers. Returns (bins, keep) where 'keep' masks the ions below
+    'maxtof' (in us) that land inside the 'numchannels' channels.
+    '''
+    tof = np.asarray(ticks, dtype=np.float64) * TOF_TICK
+    keep = tof < maxtof
+    bins = np.floor(tof / binwidth).astype(np.int64)
+    keep &= (bins >= 0) & (bins < numchannels)
+    return bins, keep
+
+
+def ionMask(types):
+    '''
+    ionMask(types) masks the events that are ions inside the TDC gate, i.e.
+    everything but the gate open, gate close and out-of-gate events.
+    '''
+    return ((types != EVENT_OPEN) & (types != EVENT_CLOSE)
+            & (types != EVENT_OUTOFGATE))
+
+
+def histogramCycles(table, numchannels, binwidth, maxtof):
+    '''
+    histogramCycles(table, numchannels, binwidth, maxtof) bins the ions in
+    an event table into a (closes + 1) x numchannels count matrix.
+
+    Row k holds the ions seen after the k-th TDCClose event and before the
+    next one, so each TDCClose ends a row. The last row holds the ions after
+    the last TDCClose, i.e. those of a cycle that is still open.
+    '''
+    types = table['type']
+    closeidx = np.flatnonzero(types == EVENT_CLOSE)
+    numrows = len(closeidx) + 1
+
+    ionidx = np.flatnonzero(ionMask(types))
+    bins, keep = tofBins(table['tof'][ionidx], binwidth, maxtof,
+                         numchannels)
+    rows = np.searchsorted(closeidx, ionidx[keep])
+
+    hist = np.bincount(rows * numchannels + bins[keep],
+                       minlength=numrows * numchannels)
+    return hist.astype(np.uint32).reshape(numrows, numchannels)
+
+
+def gateCounters(table, startcounter=-1):
+    '''
+    gateCounters(table, startcounter) pairs every TDCClose event with the
+    last TDCOpen event before it. Returns (startcounters, endcounters), the
+    gate counters of the open and close events for each close.
+
+    A close with no open before it in the table takes 'startcounter', the
+    counter of an open carried over from earlier data (-1 for none).
+    '''
+    types = table['type']
+    counters = table['cycle'].astype(np.int64)
+    positions = np.arange(len(types))
+
+    lastopen = np.where(types == EVENT_OPEN, positions, -1)
+    lastopen = np.maximum.accumulate(lastopen) if len(types) else lastopen
+
+    closeidx = np.flatnonzero(types == EVENT_CLOSE)
+    openidx = lastopen[closeidx]
+    startcounters = np.where(openidx >= 0,
+                             counters[np.maximum(openidx, 0)], startcounter)
+    return startcounters, counters[closeidx]
+
+
+def firstGateError(startcounters, endcounters, cyclecounter=0):
+    '''
+    firstGateError(startcounters, endcounters, cyclecounter) returns the
+    index of the first close whose gate counters are out of sync, or whose
+    counter does not follow 'cyclecounter' (mod 1024). Returns None if all
+    of them are correct.
+    '''
+    expected = (cyclecounter + np.arange(1, len(endcounters) + 1)) % 1024
+    bad = np.flatnonzero((startcounters != endcounters)
+                         | (startcounters != expected))
+    if len(bad) == 0:
+        return None
+    return int(bad[0])
+
+
+def newerCounters(startcounters, endcounters):
+    '''
+    newerCounters(startcounters, endcounters) returns, for each gate from
+    gateCounters, the newer of its open and close counters (mod 1024), the
+    counter the gate after it is expected to follow.
+    '''
+    startcounters = np.asarray(startcounters, dtype=np.int64)
+    endcounters = np.asarray(endcounters, dtype=np.int64)
+    ahead = (endcounters - startcounters) % 1024
+    return np.where((ahead > 0) & (ahead < 512), endcounters, startcounters)
+
+
+def findGateDefects(startcounters, endcounters, lastcounter=0):
+    '''
+    findGateDefects(startcounters, endcounters, lastcounter) checks all the
+    gates from gateCounters at once and returns a list with a GateDefect
+    for every bad one, in order.
+
+    A gate whose open and close counters differ is a 'MissingTDCOpen' or
+    'MissingTDCClose', like checkStartEndGateCounters. A counter that does
+    not follow the gate before it (mod 1024) is a 'MissingEvent'.
+
+    Each gate is compared with the gate before it rather than with its
+    position in the run, so one skipped cycle is reported once instead of
+    for every cycle after it. The newer of the open and close counters of
+    a bad gate is taken as its cycle. 'lastcounter' is the counter of the
+    gate before the first one.
+    '''
+    startcounters = np.asarray(startcounters, dtype=np.int64)
+    endcounters = np.asarray(endcounters, dtype=np.int64)
+    newer = newerCounters(startcounters, endcounters)
+    previous = np.concatenate(([lastcounter], newer[:-1]))
+    expected = (previous + 1) % 1024
+
+    defects = []
+    bad = np.flatnonzero((startcounters != endcounters)
+                         | (startcounters != expected))
+    for cycle in bad:
+        start, end = int(startcounters[cycle]), int(endcounters[cycle])
+        if start < end:
+            kind = 'MissingTDCOpen'
+        elif start > end:
+            kind = 'MissingTDCClose'
+        else:
+            kind = 'MissingEvent'
+        defects.append(GateDefect(int(cycle), kind, start, end))
+    return defects
+
+
+def completeGates(table, numchannels, binwidth, maxtof):
+    '''
+    completeGates(table, numchannels, binwidth, maxtof) bins only the
+    cycles whose TDCOpen and TDCClose are both in the table and carry the
+    same gate counter, for a piece of the event table read on its own.
+    Returns (hist, counters): their count matrix and gate counters.
+    '''
+    startcounters, endcounters = gateCounters(table)
+    hist = histogramCycles(table, numchannels, binwidth, maxtof)[:-1]
+    complete = startcounters == endcounters
+    return hist[complete], endcounters[complete]
+
+
+def unwrapCounters(counters, lastcycle=-1):
+    '''
+    unwrapCounters(counters, lastcycle) turns gate counters, which count
+    cycles from 1 mod 1024, into cycle rows counted from 0. Each gate is
+    taken as the first cycle after the one before it with its counter,
+    starting after cycle 'lastcycle', so consecutive gates must be fewer
+    than 1024 cycles apart.
+    '''
+    counters = np.asarray(counters, dtype=np.int64)
+    previous = np.concatenate(([lastcycle + 1], counters[:-1]))
+    steps = (counters - previous - 1) % 1024 + 1
+    return lastcycle + np.cumsum(steps)
+
+
+class CycleBinner:
+    '''
+    CycleBinner bins an event table that arrives in pieces, e.g. one batch
+    of MIDAS events at a time. The open cycle, the cycle counter, the
+    counter of the last TDCOpen event and the counter the next gate must
+    follow are carried from one piece to the next, so the result does not
+    depend on where the table is split.
+
+    'checkgates' is called as checkgates(startcounter, endcounter,
+    cyclecounter) for the first bad gate in a piece; it is expected to
+    raise. If 'checkgates' is None every bad gate is instead listed in
+    'defects' (see findGateDefects) and binning carries on.
+
+    'numions' counts the ions fed in and 'numbinned' those that landed in
+    a channel; the rest were cut by 'maxtof'.
+    '''
+
+    def __init__(self, numchannels, binwidth, maxtof, checkgates):
+        self.numchannels = numchannels
+        self.binwidth = binwidth
+        self.maxtof = maxtof
+        self.checkgates = checkgates
+
+        self.cyclecounter = 0
+        self.startcounter = -1
+        self.lastcounter = 0
+        self.defects = []
+        self.pending = np.zeros(numchannels, dtype=np.uint32)
+        self.numions = 0
+        self.numbinned = 0
+
+    def feed(self, table):
+        '''
+        feed(table) checks and bins the next piece of the event table.
+        Returns the count matrix of the cycles that closed in this piece.
+        '''
+        startcounters, endcounters = gateCounters(table, self.startcounter)
+        if self.checkgates is None:
+            for defect in findGateDefects(startcounters, endcounters,
+                                          self.lastcounter):
+                self.defects.append(defect._replace(
+                    cycle=self.cyclecounter + defect.cycle))
+        else:
+            cycle = firstGateError(startcounters, endcounters,
+                                   self.cyclecounter)
+            if cycle is not None:
+                self.checkgates(startcounters[cycle], endcounters[cycle],
+                                self.cyclecounter + cycle)
+        if len(startcounters):
+            self.lastcounter = int(newerCounters(startcounters[-1:],
+                                                 endcounters[-1:])[0])
+
+        hist = histogramCycles(table, self.numchannels, self.binwidth,
+                               self.maxtof)
+        self.numions += int(np.count_nonzero(ionMask(table['type'])))
+        self.numbinned += int(hist.sum())
+        hist[0] += self.pending
+        self.pending = hist[-1].copy()
+
+        opencounters = table['cycle'][table['type'] == EVENT_OPEN]
+        if len(opencounters):
+            self.startcounter = int(opencounters[-1])
+        self.cyclecounter += len(endcounters)
+        return hist[:-1]
+
+    def state(self):
+        '''
+        state() returns what the binner carries from one piece of the table
+        to the next, apart from the 'pending' counts of the open cycle, as
+        a dict that can be written as JSON. See restore.
+        '''
+        return {'cyclecounter': self.cyclecounter,
+                'startcounter': self.startcounter,
+                'lastcounter': self.lastcounter,
+                'numions': self.numions,
+                'numbinned': self.numbinned,
+                'defects': [list(defect) for defect in self.defects]}
+
+    def restore(self, state, pending):
+        '''
+        restore(state, pending) picks up where the binner that gave
+        'state' and 'pending' left off.
+        '''
+        for name in ('cyclecounter', 'startcounter', 'lastcounter',
+                     'numions', 'numbinned'):
+            setattr(self, name, int(state[name]))
+        self.defects = [GateDefect(*defect) for defect in state['defects']]
+        self.pending = np.array(pending, dtype=np.uint32)
+
+
+def foldCycles(hist, numsteps, firstcycle=0, skip=()):
+    '''
+    foldCycles(hist, numsteps, firstcycle, skip) sums the rows of a cycles x
+    channels count matrix by frequency step. Row k of 'hist' is cycle
+    firstcycle + k, and cycle c was taken at step c % numsteps, as the
+    frequency scan is repeated cycle after cycle. Cycles listed in 'skip'
+    are left out. Returns a numsteps x channels int64 matrix.
+
+    For rows that are not consecutive cycles, e.g. a sample of the run,
+    'firstcycle' can instead be an array with the cycle of every row.
+    '''
+    hist = np.asarray(hist)
+    numcycles, numchannels = hist.shape
+    if np.ndim(firstcycle):
+        cycles = np.asarray(firstcycle, dtype=np.int64)
+        keep = ~np.in1d(cycles, np.asarray(skip, dtype=np.int64))
+        spectra = np.zeros((numsteps, numchannels), dtype=np.int64)
+        np.add.at(spectra, cycles[keep] % numsteps, hist[keep])
+        return spectra
+    skip = [cycle - firstcycle for cycle in skip
+            if 0 <= cycle - firstcycle < numcycles]
+    if skip:
+        hist = hist.copy()
+        hist[skip] = 0
+
+    spectra = np.zeros((numsteps, numchannels), dtype=np.int64)
+    # cycles up to the first one at step 0, then whole scans, then the rest
+    lead = firstcycle % numsteps
+    first = min((numsteps - lead) % numsteps, numcycles)
+    spectra[lead:lead + first] += hist[:first]
+    rest = hist[first:]
+    numfull = len(rest) // numsteps * numsteps
+    if numfull:
+        spectra += rest[:numfull].reshape(-1, numsteps, numchannels).sum(
+            axis=0, dtype=np.int64)
+    spectra[:len(rest) - numfull] += rest[numfull:]
+    return spectra
+
+
+def stepSummary(spectra, binwidth):
+    '''
+    stepSummary(spectra, binwidth) returns (ions, meantof) for each row of
+    a steps x channels matrix from foldCycles: the number of ions and their
+    mean TOF in us, taking each ion at the centre of its channel. Steps
+    without ions have a mean TOF of NaN.
+    '''
+    spectra = np.asarray(spectra)
+    ions = spectra.sum(axis=1)
+    centres = (np.arange(spectra.shape[1]) + 0.5) * binwidth
+    with np.errstate(invalid='ignore', divide='ignore'):
+        meantof = spectra.dot(centres) / ions
+    return ions, meantof
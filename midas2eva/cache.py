@@ -0,0 +1,125 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+
+CACHE_DIR = os.path.expanduser('~/.cache/midas2eva')
+# Total size of the cache before the least recently used entries go
+CACHE_MAXBYTES = 4 << 30
+# Bytes hashed at each end of the MIDAS file for its fingerprint
+FINGERPRINT_BLOCK = 1 << 20
+
+
+def fileFingerprint(filename, blocksize=FINGERPRINT_BLOCK):
+    '''
+    fileFingerprint(filename, blocksize) returns a hex digest of the file
+    size, mtime and the content of its first and last 'blocksize' bytes.
+    Those blocks hold the begin- and end-of-run ODB dumps, so a rewritten or
+    grown run gets a new fingerprint without hashing gigabytes of banks.
+    '''
+    stat = os.stat(filename)
+    digest = hashlib.sha1('%d:%r:' % (stat.st_size, stat.st_mtime))
+    datafile = open(filename, 'rb')
+    try:
+        digest.update(datafile.read(blocksize))
+        if stat.st_size > blocksize:
+            datafile.seek(max(stat.st_size - blocksize, blocksize))
+            digest.update(datafile.read())
+    finally:
+        datafile.close()
+    return digest.hexdigest()
+
+
+class EventCache:
+    '''
+    EventCache keeps the decoded event table of a run, its error and MCP
+    position words and the ODB keys the get* functions read, in a directory
+    per run under 'cachedir'.
+
+    Entries are keyed by fileFingerprint, so a changed file simply misses
+    the cache. The arrays are stored as .npy files and loaded memory-mapped.
+    Once the cache grows past 'maxbytes' the least recently used entries
+    are removed.
+    '''
+
+    def __init__(self, cachedir=CACHE_DIR, maxbytes=CACHE_MAXBYTES):
+        self.cachedir = cachedir
+        self.maxbytes = maxbytes
+
+    def entryPath(self, filename):
+        return os.path.join(self.cachedir, fileFingerprint(filename))
+
+    def load(self, filename):
+        '''
+        load(filename) returns the cached entry for 'filename' as a dict
+        with the arrays 'events', 'errors' and 'positions' and the dict
+        'odb', or None if there is no entry.
+        '''
+        path = self.entryPath(filename)
+        try:
+            with open(os.path.join(path, 'odb.json')) as odbfile:
+                entry = {'odb': json.load(odbfile)}
+            for name in ('events', 'errors', 'positions'):
+                entry[name] = np.load(os.path.join(path, name + '.npy'),
+                                      mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return None
+        # the directory mtime records the last use for the LRU eviction
+        os.utime(path, None)
+        return entry
+
+    def store(self, filename, events, errors, positions, odb):
+        '''
+        store(filename, events, errors, positions, odb) writes a cache entry
+        for 'filename' and then trims the cache to its size limit.
+        '''
+        if not os.path.isdir(self.cachedir):
+            os.makedirs(self.cachedir)
+        path = self.entryPath(filename)
+        tmppath = tempfile.mkdtemp(dir=self.cachedir, prefix='.tmp')
+        try:
+            np.save(os.path.join(tmppath, 'events.npy'), events)
+            np.save(os.path.join(tmppath, 'errors.npy'), errors)
+            np.save(os.path.join(tmppath, 'positions.npy'), positions)
+            with open(os.path.join(tmppath, 'odb.json'), 'w') as odbfile:
+                json.dump(odb, odbfile)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.rename(tmppath, path)
+        except:
+            shutil.rmtree(tmppath, ignore_errors=True)
+            raise
+        self.evict()
+
+    def entries(self):
+        '''
+        entries() lists (last use, size in bytes, path) for each entry,
+        least recently used first.
+        '''
+        entries = []
+        if not os.path.isdir(self.cachedir):
+            return entries
+        for name in os.listdir(self.cachedir):
+            path = os.path.join(self.cachedir, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, member))
+                       for member in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, path))
+        return sorted(entries)
+
+    def evict(self):
+        '''
+        evict() removes the least recently used entries until the cache
+        fits into 'maxbytes'.
+        '''
+        entries = self.entries()
+        total = sum(size for lastuse, size, path in entries)
+        for lastuse, size, path in entries:
+            if total <= self.maxbytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,249 @@
+import os
+import sys
+import sqlite3
+import argparse
+from collections import OrderedDict
+
+from midas2eva import MidasToEva, ODB_KEYS
+from midasfile import MidasFile, MidasFileError
+from batch import collectRuns
+
+# Run parameters kept in the catalogue: (attribute, get* method, SQL type).
+# Each column is named after the attribute in lower case.
+CATALOGUE_PARAMETERS = [('mass', 'getElem', 'TEXT'),
+                        ('charge', 'getZ', 'INTEGER'),
+                        ('amplitude', 'getAmplitude', 'REAL'),
+                        ('trf', 'getRFTime', 'REAL'),
+                        ('startfreq', 'getStartFreq', 'REAL'),
+                        ('stopfreq', 'getStopFreq', 'REAL'),
+                        ('numfreqsteps', 'getNumFreqSteps', 'REAL'),
+                        ('numcycles', 'getNumCycles', 'REAL'),
+                        ('starttime', 'getStartTime', 'REAL'),
+                        ('endtime', 'getEndTime', 'REAL'),
+                        ('tdcTime', 'setTdcGateWidth', 'REAL')]
+
+# Columns describing the file itself: its size and mtime, which tell when
+# a run has to be read again, whether the run has ended, and the number of
+# data events and MPET words in it
+FILE_COLUMNS = [('filename', 'TEXT PRIMARY KEY'),
+                ('size', 'INTEGER'),
+                ('mtime', 'REAL'),
+                ('ended', 'INTEGER'),
+                ('events', 'INTEGER'),
+                ('words', 'INTEGER')]
+
+CATALOGUE_COLUMNS = OrderedDict(
+    FILE_COLUMNS + [(name.lower(), sqltype)
+                    for name, method, sqltype in CATALOGUE_PARAMETERS])
+
+
+def readRunMetadata(filename):
+    '''
+    readRunMetadata(filename) returns the catalogue row of a run as an
+    OrderedDict keyed by CATALOGUE_COLUMNS. The parameters are read from
+    the ODB dumps with the get* methods, and the events and words are
+    counted from the event and bank headers, so the data itself is never
+    read. A parameter that cannot be read is None.
+    '''
+    row = OrderedDict((column, None) for column in CATALOGUE_COLUMNS)
+    row['filename'] = os.path.abspath(filename)
+    row['size'] = os.path.getsize(filename)
+    row['mtime'] = os.path.getmtime(filename)
+
+    reader = MidasFile(filename)
+    row['ended'] = int(reader.hasEndOfRun())
+    row['events'] = 0
+    row['words'] = 0
+    try:
+        for offset, numwords in reader.iterBankSizes(('MPET',)):
+            row['events'] += 1
+            row['words'] += numwords
+    except MidasFileError as err:
+        print 'WARNING: ' + str(err)
+
+    m2e = MidasToEva(filename)
+    m2e.extractXML(keys=ODB_KEYS)
+    if not m2e.status:
+        return row
+    for name, method, sqltype in CATALOGUE_PARAMETERS:
+        try:
+            getattr(m2e, method)()
+        except Exception:
+            # a key missing from the ODB of this run
+            continue
+        row[name.lower()] = getattr(m2e, name)
+    return row
+
+
+class RunCatalogue:
+    '''
+    RunCatalogue keeps the metadata of MIDAS runs (see readRunMetadata) in
+    an SQLite database, so runs can be selected by their parameters
+    without opening the .mid files again.
+
+    update() only reads the runs that are new or whose size or mtime has
+    changed since they were catalogued.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS runs (' +
+            ', '.join(column + ' ' + sqltype for column, sqltype
+                      in CATALOGUE_COLUMNS.items()) + ')')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def isCurrent(self, filename):
+        '''
+        isCurrent(filename) tells whether the catalogue row of a run was
+        read from the file as it is now, going by its size and mtime.
+        '''
+        row = self.connection.execute(
+            'SELECT size, mtime FROM runs WHERE filename = ?',
+            (os.path.abspath(filename),)).fetchone()
+        return (row is not None and
+                row['size'] == os.path.getsize(filename) and
+                row['mtime'] == os.path.getmtime(filename))
+
+    def update(self, runs):
+        '''
+        update(runs) catalogues the runs in the list of .mid files 'runs'
+        that are new or have changed. Each run is committed as soon as it
+        has been read, so an interrupted update loses nothing. Returns the
+        runs that were read.
+        '''
+        updated = []
+        for filename in runs:
+            if self.isCurrent(filename):
+                continue
+            row = readRunMetadata(filename)
+            with self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO runs (' + ', '.join(row) +
+                    ') VALUES (' + ', '.join('?' * len(row)) + ')',
+                    list(row.values()))
+            updated.append(filename)
+        return updated
+
+    def prune(self):
+        '''
+        prune() removes the runs whose files no longer exist and returns
+        their names.
+        '''
+        gone = [row['filename'] for row in
+                self.connection.execute('SELECT filename FROM runs')
+                if not os.path.isfile(row['filename'])]
+        with self.connection:
+            self.connection.executemany('DELETE FROM runs WHERE filename = ?',
+                                        [(filename,) for filename in gone])
+        return gone
+
+    def query(self, where=None, params=(), **equal):
+        '''
+        query(where, params, **equal) returns the catalogue rows, as
+        OrderedDicts, of the runs whose columns equal the values in
+        'equal', e.g. query(mass='1K39', trf=0.1), and that match the SQL
+        condition 'where' with the placeholder values 'params', e.g.
+        query('starttime >= ?', [1381000000]). Rows are in order of run
+        start time.
+        '''
+        conditions = []
+        values = []
+        for column, value in sorted(equal.items()):
+            if column not in CATALOGUE_COLUMNS:
+                raise ValueError('Unknown catalogue column ' + column)
+            conditions.append(column + ' = ?')
+            values.append(value)
+        if where is not None:
+            conditions.append('(' + where + ')')
+            values.extend(params)
+
+        sql = 'SELECT * FROM runs'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY starttime, filename'
+        return [OrderedDict(zip(row.keys(), row))
+                for row in self.connection.execute(sql, values)]
+
+
+def parseCondition(text):
+    '''
+    parseCondition(text) splits a 'column=value' argument of the query
+    command into (column, value), with the value converted to the type of
+    the column.
+    '''
+    column, sep, value = text.partition('=')
+    column = column.strip().lower()
+    if not sep or column not in CATALOGUE_COLUMNS:
+        raise ValueError('Expected column=value with one of ' +
+                         ', '.join(CATALOGUE_COLUMNS) + ', not ' + text)
+    sqltype = CATALOGUE_COLUMNS[column]
+    if sqltype.startswith('INTEGER'):
+        return column, int(value)
+    if sqltype.startswith('REAL'):
+        return column, float(value)
+    return column, value.strip()
+
+
+def main(argv=None, out=sys.stdout):
+    parser = argparse.ArgumentParser(
+        description='Catalogue the ODB metadata of MIDAS runs in an SQLite '
+                    'database and select runs from it.')
+    parser.add_argument('database', help='SQLite catalogue file')
+    commands = parser.add_subparsers(dest='command')
+    update = commands.add_parser('update', help='add new and changed runs')
+    update.add_argument('runs', nargs='+',
+                        help='.mid files, directories or glob patterns')
+    update.add_argument('--prune', action='store_true',
+                        help='also drop runs whose files are gone')
+    query = commands.add_parser('query', help='list the matching runs')
+    query.add_argument('conditions', nargs='*', metavar='column=value',
+                       help='e.g. mass=1K39 trf=0.1')
+    query.add_argument('--where', default=None,
+                       help='extra SQL condition, e.g. "starttime > 1381e6"')
+    query.add_argument('--columns', default='filename',
+                       help='comma separated columns to print '
+                            '(default: filename)')
+    args = parser.parse_args(argv)
+
+    with RunCatalogue(args.database) as catalogue:
+        if args.command == 'update':
+            runs = collectRuns(args.runs)
+            updated = catalogue.update(runs)
+            out.write('Catalogued %d of %d runs, %d unchanged\n'
+                      % (len(updated), len(runs), len(runs) - len(updated)))
+            if args.prune:
+                for filename in catalogue.prune():
+                    out.write('Removed ' + filename + '\n')
+            return 0
+
+        columns = [column.strip().lower()
+                   for column in args.columns.split(',')]
+        try:
+            equal = dict(parseCondition(text) for text in args.conditions)
+            unknown = [column for column in columns
+                       if column not in CATALOGUE_COLUMNS]
+            if unknown:
+                raise ValueError('Unknown catalogue column ' + unknown[0])
+            rows = catalogue.query(args.where, **equal)
+        except (ValueError, sqlite3.Error) as err:
+            parser.error(str(err))
+        for row in rows:
+            out.write('\t'.join(str(row[column]) for column in columns)
+                      + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
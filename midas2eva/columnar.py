@@ -0,0 +1,82 @@
+import os
+import json
+import shutil
+import tempfile
+
+import numpy as np
+
+# Bumped whenever the layout of the export changes
+COLUMNAR_VERSION = 1
+METADATA_NAME = 'metadata.json'
+
+
+def compactCounts(hist):
+    '''
+    compactCounts(hist) returns the count matrix in the smallest unsigned
+    integer type that holds its largest count.
+    '''
+    hist = np.asarray(hist)
+    largest = int(hist.max()) if hist.size else 0
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if largest <= np.iinfo(dtype).max:
+            return hist.astype(dtype, copy=False)
+    return hist
+
+
+def writeColumnar(path, arrays, metadata):
+    '''
+    writeColumnar(path, arrays, metadata) saves a dict of named arrays and a
+    dict of metadata that can be written as JSON.
+
+    If 'path' ends in '.npz' everything goes into one compressed .npz
+    file. Otherwise 'path' becomes a directory with one .npy file per array
+    and a metadata.json, which loadColumnar can memory-map. The directory is
+    written under a temporary name and renamed when complete, so a reader
+    never sees half an export.
+    '''
+    metadata = dict(metadata, version=COLUMNAR_VERSION)
+    if path.endswith('.npz'):
+        np.savez_compressed(path, metadata=np.array(json.dumps(metadata)),
+                            **arrays)
+        return
+
+    parent = os.path.dirname(os.path.abspath(path))
+    tmppath = tempfile.mkdtemp(dir=parent, prefix='.tmp')
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmppath, name + '.npy'), array)
+        with open(os.path.join(tmppath, METADATA_NAME), 'w') as metafile:
+            json.dump(metadata, metafile, indent=1, sort_keys=True)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tmppath, path)
+    except:
+        shutil.rmtree(tmppath, ignore_errors=True)
+        raise
+
+
+def loadColumnar(path, mmap_mode='r'):
+    '''
+    loadColumnar(path, mmap_mode) loads an export written by writeColumnar.
+    Returns (arrays, metadata). The arrays of a directory export are
+    memory-mapped with 'mmap_mode' (None reads them into memory); those of
+    an .npz file are always read.
+    '''
+    if path.endswith('.npz'):
+        data = np.load(path)
+        try:
+            arrays = dict((name, data[name]) for name in data.files
+                          if name != 'metadata')
+            metadata = json.loads(str(data['metadata']))
+        finally:
+            data.close()
+        return arrays, metadata
+
+    arrays = {}
+    for name in os.listdir(path):
+        if name.endswith('.npy'):
+            arrays[name[:-4]] = np.load(os.path.join(path, name),
+                                        mmap_mode=mmap_mode)
+    with open(os.path.join(path, METADATA_NAME)) as metafile:
+        metadata = json.load(metafile)
+    return arrays, metadata
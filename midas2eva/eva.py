@@ -0,0 +1,488 @@
+import mmap
+from struct import Struct
+from collections import OrderedDict
+
+import numpy as np
+
+from binning import histogramCycles
+
+RECORD_LENGTH = Struct('h')
+RECORD_TIMESTAMP = Struct('i')
+HEADER_POINTERS = Struct('ii')
+SCAN_COUNT = Struct('i')
+SCAN_VALUE = Struct('d')
+
+# Number of cycle records packed into one buffer before it is written out
+CHUNK_CYCLES = 4096
+
+
+def isDenseRecord(nonzero, numchannels):
+    '''
+    isDenseRecord(nonzero, numchannels) returns True (elementwise) for the
+    cycles that are written as dense records: those with fewer than half of
+    their channels empty. All other cycles are written as packed
+    (channel, count) pairs.
+    '''
+    return (numchannels - nonzero) < numchannels // 2
+
+
+def packCycleRecords(hist, timestamps):
+    '''
+    packCycleRecords(hist, timestamps) packs the rows of a cycles x channels
+    count matrix into EVA cycle records and returns them as a string.
+
+    Each record is a short length field, an int timestamp and then either
+    one short count per channel (dense) or a (channel, count) pair of shorts
+    for each nonzero channel (packed). Everything is in native byte order.
+    '''
+    hist = np.asarray(hist)
+    numcycles, numchannels = hist.shape
+    if numcycles == 0:
+        return ''
+    if hist.max() > np.iinfo(np.int16).max:
+        raise ValueError('Cycle channel count does not fit into a short.')
+
+    nonzero = np.count_nonzero(hist, axis=1)
+    dense = isDenseRecord(nonzero, numchannels)
+    lengths = np.where(dense, numchannels * 2 + 4, nonzero * 4 + 4)
+
+    # Work in shorts: every field is one or two shorts wide
+    sizes = 1 + lengths // 2
+    offsets = np.cumsum(sizes) - sizes
+    buf = np.zeros(int(sizes.sum()), dtype=np.int16)
+
+    buf[offsets] = lengths
+    timestamps = np.trunc(timestamps).astype(np.int32).view(np.int16)
+    buf[offsets + 1] = timestamps[0::2]
+    buf[offsets + 2] = timestamps[1::2]
+
+    if dense.any():
+        positions = offsets[dense][:, None] + 3 + np.arange(numchannels)
+        buf[positions] = hist[dense]
+
+    if not dense.all():
+        packed = hist[~dense]
+        rows, channels = np.nonzero(packed)
+        rowstart = np.cumsum(nonzero[~dense]) - nonzero[~dense]
+        rank = np.arange(len(rows)) - rowstart[rows]
+        positions = offsets[~dense][rows] + 3 + 2 * rank
+        buf[positions] = channels
+        buf[positions + 1] = packed[rows, channels]
+
+    return buf.tobytes()
+
+
+def writeCycleRecords(datafile, hist, timestamps, chunkcycles=CHUNK_CYCLES):
+    '''
+    writeCycleRecords(datafile, hist, timestamps, chunkcycles) writes the
+    EVA cycle records for every row of 'hist' to 'datafile', packing
+    'chunkcycles' records into each write. Returns the number of bytes
+    written.
+    '''
+    written = 0
+    for start in xrange(0, len(hist), chunkcycles):
+        stop = start + chunkcycles
+        data = packCycleRecords(hist[start:stop], timestamps[start:stop])
+        datafile.write(data)
+        written += len(data)
+    return written
+
+
+def patchTimestamps(datafile, datastart, timestamps):
+    '''
+    patchTimestamps(datafile, datastart, timestamps) overwrites the
+    timestamps of the cycle records starting at 'datastart', following the
+    record length fields. 'datafile' must be open for reading and writing;
+    'timestamps' may be any iterable, so the records can be walked without
+    holding one timestamp per cycle in memory.
+    '''
+    position = datastart
+    for timestamp in timestamps:
+        datafile.seek(position)
+        length = RECORD_LENGTH.unpack(datafile.read(RECORD_LENGTH.size))[0]
+        datafile.seek(position + RECORD_LENGTH.size)
+        datafile.write(RECORD_TIMESTAMP.pack(int(timestamp)))
+        position += RECORD_LENGTH.size + length
+    datafile.seek(0, 2)
+
+
+def recordSizes(hist):
+    '''
+    recordSizes(hist) returns the number of bytes the cycle record of each
+    row of 'hist' takes, length field included (see packCycleRecords).
+    '''
+    hist = np.asarray(hist)
+    numchannels = hist.shape[1]
+    nonzero = np.count_nonzero(hist, axis=1)
+    lengths = np.where(isDenseRecord(nonzero, numchannels),
+                       numchannels * 2 + 4, nonzero * 4 + 4)
+    return RECORD_LENGTH.size + lengths.astype(np.int64)
+
+
+def setRecordTimestamps(filename, offsets, timestamps):
+    '''
+    setRecordTimestamps(filename, offsets, timestamps) overwrites the
+    timestamps of the cycle records at the byte 'offsets' of the file in
+    one go, through a writable memory map. Unlike patchTimestamps it needs
+    the offsets of the records, but does not walk them.
+    '''
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if len(offsets) == 0:
+        return
+    values = np.trunc(timestamps).astype(RECORD_TIMESTAMP.format)
+    data = np.memmap(filename, dtype=np.uint8, mode='r+')
+    try:
+        positions = (offsets[:, None] + RECORD_LENGTH.size +
+                     np.arange(RECORD_TIMESTAMP.size))
+        data[positions] = values.view(np.uint8).reshape(len(offsets), -1)
+        data.flush()
+    finally:
+        del data
+
+
+def appendCycleRecords(filename, header, hist, datasize=0):
+    '''
+    appendCycleRecords(filename, header, hist, datasize) adds the cycle
+    records of 'hist' to an EVA file that already holds 'datasize' bytes of
+    records, which are kept; anything after them is cut off. 'header' is
+    the text header and frequency table up to the records, as written by
+    MidasToEva.writeEvaHeader. If the file starts with another header it
+    is rewritten with 'header' in front of the records it keeps.
+
+    The timestamps of the new records are left at zero, see
+    setRecordTimestamps. Returns (datastart, sizes): the offset of the
+    first record and the byte sizes of the new records.
+    '''
+    try:
+        datafile = open(filename, 'r+b')
+    except IOError:
+        datafile = open(filename, 'w+b')
+        datasize = 0
+    try:
+        oldheader = datafile.read(len(header))
+        if oldheader != header:
+            records = ''
+            if datasize and len(oldheader) >= HEADER_POINTERS.size:
+                datastart = HEADER_POINTERS.unpack_from(oldheader)[1]
+                datafile.seek(datastart)
+                records = datafile.read(datasize)
+            datafile.seek(0)
+            datafile.truncate()
+            datafile.write(header + records)
+            datasize = len(records)
+        datafile.truncate(len(header) + datasize)
+        datafile.seek(0, 2)
+        writeCycleRecords(datafile, hist, np.zeros(len(hist)))
+    finally:
+        datafile.close()
+    return len(header), recordSizes(hist)
+
+
+class EvaFileError(Exception):
+    def __init__(self, filename, offset, reason):
+        self.filename = filename
+        self.offset = offset
+        self.reason = reason
+
+    def __str__(self):
+        return ("Corrupt EVA file " + self.filename + " at byte "
+                + str(self.offset) + ": " + self.reason)
+
+
+def parseHeaderSections(text):
+    '''
+    parseHeaderSections(text) splits the text header of an EVA file into
+    its [Section]s. Returns an OrderedDict mapping each section name to an
+    OrderedDict of its 'Key=value' fields, both stripped of blanks.
+    '''
+    sections = OrderedDict()
+    fields = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('[') and line.endswith(']'):
+            fields = sections.setdefault(line[1:-1], OrderedDict())
+        elif fields is not None and '=' in line:
+            for field in line.split(','):
+                if '=' in field:
+                    key, value = field.split('=', 1)
+                    fields[key.strip()] = value.strip()
+    return sections
+
+
+def isPackedRecord(shorts, numchannels):
+    '''
+    isPackedRecord(shorts, numchannels) decides whether the payload of a
+    record with the dense length holds (channel, count) pairs.
+
+    With an even number of channels a packed record with exactly half of
+    them nonzero has the same length as a dense record. It is read as
+    packed if its channels are distinct and in range and its counts are
+    positive; a dense record only looks like that if half of its counts
+    differ from each other, which TOF spectra practically never do.
+    '''
+    if numchannels % 2:
+        return False
+    channels, counts = shorts[0::2], shorts[1::2]
+    return bool((channels >= 0).all() and (channels < numchannels).all()
+                and (counts > 0).all()
+                and len(np.unique(channels)) == len(channels))
+
+
+class EvaFile:
+    '''
+    EvaFile reads an EVA file as written by MidasToEva.writeEvaFile,
+    through a read-only mmap.
+
+    The text header is split into 'sections' (see parseHeaderSections), the
+    frequency table of [SCAN0] is in 'frequencies' and the values of
+    [SCAN1] in 'scan1', both as float64 views of the file. Walking the
+    record length fields once gives the byte 'offsets' of the cycle
+    records and whether each one is 'dense'.
+
+    record(i) returns the channels and counts of one cycle as views into
+    the file; countMatrix() builds the full cycles x channels matrix. The
+    views are only valid until close().
+    '''
+
+    def __init__(self, filename, numchannels=None):
+        self.filename = filename
+        datafile = open(filename, 'rb')
+        try:
+            self.data = mmap.mmap(datafile.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        finally:
+            datafile.close()
+        try:
+            self.readHeader(numchannels)
+            self.readRecords()
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def error(self, offset, reason):
+        return EvaFileError(self.filename, offset, reason)
+
+    def readHeader(self, numchannels=None):
+        '''
+        readHeader(numchannels) follows the header length and data start
+        pointers at the top of the file and reads the text header and the
+        scan tables. The number of channels is taken from the [MCA]
+        section unless 'numchannels' is given.
+        '''
+        size = len(self.data)
+        if size < HEADER_POINTERS.size:
+            raise self.error(0, 'file too short for a header')
+        self.headerlength, self.datastart = HEADER_POINTERS.unpack_from(
+            self.data)
+        textend = HEADER_POINTERS.size + self.headerlength
+        if not textend + SCAN_COUNT.size <= self.datastart <= size:
+            raise self.error(0, 'header pointers out of range')
+
+        self.header = self.data[HEADER_POINTERS.size:textend]
+        self.sections = parseHeaderSections(self.header)
+
+        mca = self.sections.get('MCA', {})
+        if numchannels is None:
+            try:
+                numchannels = int(mca['Channels'])
+            except (KeyError, ValueError):
+                raise self.error(HEADER_POINTERS.size,
+                                 'no channel count in [MCA]')
+        self.numchannels = numchannels
+        try:
+            self.binwidth = float(mca.get('TimePerChannel', '')
+                                  .rstrip('s').rstrip('\xb5'))
+        except ValueError:
+            self.binwidth = None
+
+        # [SCAN0] count and frequencies, then [SCAN1] count and values. The
+        # SCAN0 count is the number of frequency steps, which is not the
+        # length of a 'Quad FreqList' table, so the table runs up to the
+        # SCAN1 table just before the data start.
+        self.numfreqsteps = SCAN_COUNT.unpack_from(self.data, textend)[0]
+        scan0 = textend + SCAN_COUNT.size
+        scan1 = scan0 + SCAN_VALUE.size * self.numfreqsteps
+        if not self.isScanTable(scan1):
+            # a single SCAN1 value, as writeEvaHeader writes it
+            scan1 = self.datastart - SCAN_COUNT.size - SCAN_VALUE.size
+            if scan1 < scan0 or (scan1 - scan0) % SCAN_VALUE.size:
+                raise self.error(scan0, 'cannot find the scan tables')
+        self.frequencies = np.frombuffer(
+            self.data, dtype=np.float64,
+            count=(scan1 - scan0) // SCAN_VALUE.size, offset=scan0)
+        numscan1 = SCAN_COUNT.unpack_from(self.data, scan1)[0]
+        self.scan1 = np.frombuffer(self.data, dtype=np.float64,
+                                   count=numscan1,
+                                   offset=scan1 + SCAN_COUNT.size)
+
+    def isScanTable(self, offset):
+        '''
+        isScanTable(offset) tells if a scan table at 'offset' would end
+        right at the data start.
+        '''
+        if not 0 <= offset <= self.datastart - SCAN_COUNT.size:
+            return False
+        count = SCAN_COUNT.unpack_from(self.data, offset)[0]
+        return (offset + SCAN_COUNT.size + count * SCAN_VALUE.size
+                == self.datastart)
+
+    def readRecords(self):
+        '''
+        readRecords() walks the cycle records from the data start to the end
+        of the file, filling 'offsets' and 'dense'.
+        '''
+        size = len(self.data)
+        denselength = self.numchannels * 2 + 4
+        offsets = []
+        dense = []
+        position = self.datastart
+        while position < size:
+            if position + RECORD_LENGTH.size + RECORD_TIMESTAMP.size > size:
+                raise self.error(position, 'record header cut short')
+            length = RECORD_LENGTH.unpack_from(self.data, position)[0]
+            if length < 4 or length % 2 or \
+                    position + RECORD_LENGTH.size + length > size:
+                raise self.error(position, 'bad record length ' +
+                                 str(length))
+            isdense = length == denselength
+            if isdense and length % 4 == 0:
+                payload = np.frombuffer(
+                    self.data, dtype=np.int16,
+                    count=self.numchannels,
+                    offset=position + RECORD_LENGTH.size +
+                    RECORD_TIMESTAMP.size)
+                isdense = not isPackedRecord(payload, self.numchannels)
+            elif not isdense and length % 4:
+                raise self.error(position, 'bad record length ' +
+                                 str(length))
+            offsets.append(position)
+            dense.append(isdense)
+            position += RECORD_LENGTH.size + length
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.dense = np.array(dense, dtype=bool)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def shorts(self):
+        '''
+        shorts() returns the cycle records as one int16 view, and the
+        position of each record's length field in it.
+        '''
+        shorts = np.frombuffer(self.data, dtype=np.int16,
+                               count=(len(self.data) - self.datastart) // 2,
+                               offset=self.datastart)
+        return shorts, (self.offsets - self.datastart) // 2
+
+    def timestamps(self):
+        '''
+        timestamps() returns the timestamp of every cycle record.
+        '''
+        shorts, starts = self.shorts()
+        halves = np.empty((len(starts), 2), dtype=np.int16)
+        halves[:, 0] = shorts[starts + 1]
+        halves[:, 1] = shorts[starts + 2]
+        return halves.view(np.int32).ravel()
+
+    def record(self, i):
+        '''
+        record(i) returns (timestamp, channels, counts) of cycle record 'i'.
+        'counts' is an int16 view into the file; so is 'channels' for a
+        packed record, while a dense record gets every channel number.
+        '''
+        offset = int(self.offsets[i])
+        length = RECORD_LENGTH.unpack_from(self.data, offset)[0]
+        timestamp = RECORD_TIMESTAMP.unpack_from(
+            self.data, offset + RECORD_LENGTH.size)[0]
+        payload = np.frombuffer(
+            self.data, dtype=np.int16, count=(length - 4) // 2,
+            offset=offset + RECORD_LENGTH.size + RECORD_TIMESTAMP.size)
+        if self.dense[i]:
+            return timestamp, np.arange(self.numchannels), payload
+        return timestamp, payload[0::2], payload[1::2]
+
+    def countMatrix(self):
+        '''
+        countMatrix() returns the counts of all cycle records as a cycles x
+        numchannels uint32 matrix, the 'bindata' the file was written from.
+        '''
+        numchannels = self.numchannels
+        hist = np.zeros((len(self.offsets), numchannels), dtype=np.uint32)
+        shorts, starts = self.shorts()
+
+        dense = np.flatnonzero(self.dense)
+        if len(dense):
+            hist[dense] = shorts[starts[dense][:, None] + 3
+                                 + np.arange(numchannels)]
+
+        packed = np.flatnonzero(~self.dense)
+        if len(packed):
+            numpairs = (shorts[starts[packed]] - 4) // 4
+            rows = np.repeat(packed, numpairs)
+            rank = (np.arange(len(rows))
+                    - np.repeat(np.cumsum(numpairs) - numpairs, numpairs))
+            positions = starts[rows] + 3 + 2 * rank
+            channels = shorts[positions]
+            bad = np.flatnonzero((channels < 0) | (channels >= numchannels))
+            if len(bad):
+                raise self.error(int(self.offsets[rows[bad[0]]]),
+                                 'channel out of range')
+            hist[rows, channels] = shorts[positions + 1]
+        return hist
+
+
+def verifyEvaFile(filename, table, starttime=None, endtime=None,
+                  maxtof=None):
+    '''
+    verifyEvaFile(filename, table, starttime, endtime, maxtof) checks an EVA
+    file against the event table it was converted from (see
+    reorganizeMdumpData). The table is binned again with the channel count
+    and width from the [MCA] section, up to 'maxtof' (by default the end of
+    the last channel), and compared cycle by cycle. With 'starttime' and
+    'endtime' the record timestamps are checked too.
+
+    Returns a list of the problems found; an empty list means the file
+    matches its source.
+    '''
+    problems = []
+    try:
+        evafile = EvaFile(filename)
+    except (EvaFileError, IOError, ValueError) as err:
+        return [str(err)]
+    try:
+        if evafile.binwidth is None:
+            return ['no channel width in [MCA]']
+        numchannels = evafile.numchannels
+        if maxtof is None:
+            maxtof = numchannels * evafile.binwidth
+        expected = histogramCycles(table, numchannels, evafile.binwidth,
+                                   maxtof)[:-1]
+        if len(evafile) != len(expected):
+            problems.append('%d cycle records, expected %d'
+                            % (len(evafile), len(expected)))
+        else:
+            hist = evafile.countMatrix()
+            for cycle in np.flatnonzero((hist != expected).any(axis=1)):
+                problems.append('cycle %d counts differ' % cycle)
+
+            if starttime is not None and endtime is not None and \
+                    len(expected):
+                dtime = (endtime - starttime) / float(len(expected))
+                timestamps = np.trunc(starttime + np.arange(len(expected))
+                                      * dtime).astype(np.int32)
+                for cycle in np.flatnonzero(evafile.timestamps()
+                                            != timestamps):
+                    problems.append('cycle %d timestamp differs' % cycle)
+    finally:
+        evafile.close()
+    return problems
+
@@ -0,0 +1,129 @@
+import numpy as np
+
+# One row per MPET event (a pair of 32-bit words). 'tof' is kept in raw TDC
+# ticks; multiply by TOF_TICK to get microseconds.
+EVENT_DTYPE = np.dtype([('type', np.uint8),
+                        ('cycle', np.uint16),
+                        ('tof', np.uint32)])
+
+# TDC tick length in us
+TOF_TICK = 0.01
+
+# Event types flagged by the DAQ as errors, and the type they stand in for
+EVENT_OPEN = 8
+EVENT_CLOSE = 1
+EVENT_OUTOFGATE = 4
+ERROR_TYPES = {0xa: EVENT_OPEN, 0x6: EVENT_OUTOFGATE, 0x3: EVENT_CLOSE}
+
+
+# Why an EventFilter rejected an event, the keys of its 'rejected' counts
+REJECT_REASONS = ('tof', 'outofgate')
+
+
+def eventTypes(firstwords):
+    '''
+    eventTypes(firstwords) reads the event type from the top nibble of the
+    first word of each MPET event. Returns (types, errmask) where error
+    types have been replaced by the type they stand in for and 'errmask'
+    marks them.
+    '''
+    types = (np.asarray(firstwords, dtype=np.uint32) >> 28).astype(np.uint8)
+    errmask = np.zeros(len(types), dtype=bool)
+    for errtype, goodtype in ERROR_TYPES.items():
+        ismatch = types == errtype
+        types[ismatch] = goodtype
+        errmask |= ismatch
+    return types, errmask
+
+
+def errorWords(words):
+    '''
+    errorWords(words) returns the first word of every MPET event in the raw
+    words that is flagged with an error type, whether or not the event
+    gets past an EventFilter.
+    '''
+    words = np.asarray(words, dtype=np.uint32)
+    firstwords = words[0:len(words) // 2 * 2:2]
+    return firstwords[eventTypes(firstwords)[1]]
+
+
+def tofTicks(maxtof, mintof=0.0):
+    '''
+    tofTicks(maxtof, mintof) converts a TOF window in us into the window in
+    TDC ticks for an EventFilter, rounded outwards so that it keeps every
+    ion that binning from 'mintof' to below 'maxtof' would use.
+    '''
+    return (int(np.floor(mintof / TOF_TICK)), int(maxtof / TOF_TICK) + 1)
+
+
+class EventFilter:
+    '''
+    EventFilter picks the MPET events that decodeEvents puts in the event
+    table, so the rest are never copied out of the raw words. Ions are
+    kept if their TOF is 'mintof' or more and, if 'maxtof' is given, below
+    'maxtof', both in TDC ticks. Out-of-gate ions are dropped unless
+    'outofgate' is set. TDCOpen and TDCClose events are always kept, so the
+    gate checks are not affected.
+
+    'rejected' counts the events dropped for each of REJECT_REASONS over
+    all the words filtered so far.
+    '''
+
+    def __init__(self, mintof=0, maxtof=None, outofgate=False):
+        self.mintof = mintof
+        self.maxtof = maxtof
+        self.outofgate = outofgate
+        self.rejected = dict((reason, 0) for reason in REJECT_REASONS)
+
+    def select(self, types, tofs):
+        '''
+        select(types, tofs) masks the events to keep, given their types
+        (see eventTypes) and TOFs in ticks, and counts the others.
+        '''
+        isgate = (types == EVENT_OPEN) | (types == EVENT_CLOSE)
+        keep = ~isgate
+        if not self.outofgate:
+            outofgate = types == EVENT_OUTOFGATE
+            self.rejected['outofgate'] += int(np.count_nonzero(outofgate))
+            keep &= ~outofgate
+        intime = tofs >= self.mintof
+        if self.maxtof is not None:
+            intime &= tofs < self.maxtof
+        badtof = keep & ~intime
+        self.rejected['tof'] += int(np.count_nonzero(badtof))
+        keep &= ~badtof
+        return keep | isgate
+
+
+def decodeEvents(words, eventfilter=None):
+    '''
+    decodeEvents(words, eventfilter) decodes raw MPET bank words into an
+    event table.
+
+    Words come in pairs: the first holds the event type in its top nibble
+    and the 12-bit cycle counter in bits 16-27, the second holds the TOF in
+    TDC ticks. A trailing unpaired word is ignored.
+
+    Returns (table, errmask) where 'table' is an array of EVENT_DTYPE and
+    'errmask' marks the events whose type was remapped from an error type.
+    With an EventFilter the events it rejects are left out of both; every
+    complete pair is still read, so the words after the last one are the
+    unfinished event either way.
+    '''
+    words = np.asarray(words, dtype=np.uint32)
+    numevents = len(words) // 2
+    firstwords = words[0:2 * numevents:2]
+    tofs = words[1:2 * numevents:2]
+    evtype, errmask = eventTypes(firstwords)
+    if eventfilter is not None:
+        keep = eventfilter.select(evtype, tofs)
+        firstwords = firstwords[keep]
+        tofs = tofs[keep]
+        evtype = evtype[keep]
+        errmask = errmask[keep]
+
+    table = np.empty(len(evtype), dtype=EVENT_DTYPE)
+    table['type'] = evtype
+    table['cycle'] = (firstwords >> 16) & 0xfff
+    table['tof'] = tofs
+    return table, errmask
@@ -0,0 +1,88 @@
+import os
+import hashlib
+
+import numpy as np
+
+from columnar import loadColumnar
+
+# Bytes at the start of the run hashed to recognise it again. They hold the
+# begin-of-run event, which does not change while the run grows.
+PREFIX_BLOCK = 1 << 16
+
+
+def prefixDigest(filename, length=PREFIX_BLOCK):
+    '''
+    prefixDigest(filename, length) returns a hex digest of the first
+    'length' bytes of the file.
+    '''
+    datafile = open(filename, 'rb')
+    try:
+        return hashlib.sha1(datafile.read(length)).hexdigest()
+    finally:
+        datafile.close()
+
+
+def checkpointKey(filename, offset):
+    '''
+    checkpointKey(filename, offset) returns the (prefixsize, prefixdigest)
+    that a checkpoint taken at byte 'offset' of the file is stored with.
+    Only bytes before 'offset' are hashed, as those are already final.
+    '''
+    length = min(offset, PREFIX_BLOCK)
+    return length, prefixDigest(filename, length)
+
+
+def loadCheckpoint(path, filename, settings, outputs=None):
+    '''
+    loadCheckpoint(path, filename, settings, outputs) loads the checkpoint
+    in 'path' (see MidasToEva.convertIncremental) as (arrays, metadata).
+    Returns None if there is none, or if it was taken with other
+    'settings', of another file, or of a longer file than 'filename' is
+    now. 'outputs' maps names to the files the conversion appends to; the
+    checkpoint is also dropped if one of them is shorter than the size
+    recorded under its name in metadata['sizes'].
+    '''
+    if not os.path.isdir(path):
+        return None
+    try:
+        arrays, metadata = loadColumnar(path, mmap_mode=None)
+    except (IOError, OSError, ValueError):
+        return None
+
+    for name, value in settings.items():
+        if metadata.get(name) != value:
+            return None
+    offset = metadata['offset']
+    if os.path.getsize(filename) < offset:
+        return None
+    if [metadata['prefixsize'], metadata['prefixdigest']] != \
+            list(checkpointKey(filename, offset)):
+        return None
+    for name, output in (outputs or {}).items():
+        if not os.path.isfile(output) or \
+                os.path.getsize(output) < metadata['sizes'][name]:
+            return None
+    return arrays, metadata
+
+
+def appendRows(filename, rows, numrows):
+    '''
+    appendRows(filename, rows, numrows) keeps the first 'numrows' rows of
+    the raw uint32 matrix in 'filename', appends 'rows' and returns the
+    whole matrix memory-mapped read-only.
+    '''
+    rows = np.ascontiguousarray(rows, dtype=np.uint32)
+    numcolumns = rows.shape[1]
+    datafile = open(filename, 'r+b' if os.path.isfile(filename) else 'w+b')
+    try:
+        datafile.truncate(numrows * rows.itemsize * numcolumns)
+        datafile.seek(0, 2)
+        datafile.write(rows.tobytes())
+    finally:
+        datafile.close()
+
+    numrows += len(rows)
+    if numrows == 0 or numcolumns == 0:
+        return np.zeros((numrows, numcolumns), dtype=np.uint32)
+    return np.memmap(filename, dtype=np.uint32, mode='r',
+                     shape=(numrows, numcolumns))
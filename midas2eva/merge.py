@@ -0,0 +1,155 @@
+import os
+from os.path import basename
+
+import numpy as np
+
+from midas2eva import MidasToEva, ODB_KEYS
+from eva import writeCycleRecords, patchTimestamps
+from metrics import RunMetrics
+
+# Run parameters that must agree for runs to be merged into one EVA file,
+# besides the list of frequencies (see MidasToEva.genFreqList)
+MERGE_SETTINGS = ['mass', 'charge', 'amplitude', 'trf', 'startfreq',
+                  'stopfreq', 'numfreqsteps']
+
+
+class MergeError(Exception):
+    def __init__(self, filename, reason):
+        Exception.__init__(self, filename, reason)
+        self.filename = filename
+        self.reason = reason
+
+    def __str__(self):
+        return 'Cannot merge ' + self.filename + ': ' + self.reason
+
+
+def mergedPath(filenames, path):
+    '''
+    mergedPath(filenames, path) returns the name of the EVA file in 'path'
+    that the runs in 'filenames' are merged into, e.g. 187070-187073_eva.dat
+    for runs 187070 to 187073.
+    '''
+    names = sorted(basename(filename)[:-4] for filename in filenames)
+    name = names[0]
+    if len(names) > 1:
+        name += '-' + names[-1]
+    return os.path.join(path, name + '_eva.dat')
+
+
+def readMergeRuns(filenames, metrics):
+    '''
+    readMergeRuns(filenames, metrics) reads the run parameters of every run
+    from its ODB dumps and checks that they can be merged. Returns the
+    MidasToEva objects in run order, i.e. by start time. Raises MergeError
+    for a run that is not a MIDAS file or whose settings differ from those
+    of the first run.
+    '''
+    runs = []
+    for filename in filenames:
+        m2e = MidasToEva(filename, metrics)
+        if not m2e.status:
+            raise MergeError(filename, 'not a valid MIDAS file')
+        m2e.extractXML(keys=ODB_KEYS)
+        m2e.readRunParameters()
+        runs.append(m2e)
+    runs.sort(key=lambda m2e: m2e.starttime)
+
+    first = runs[0]
+    freqlist = first.genFreqList()
+    for m2e in runs[1:]:
+        for name in MERGE_SETTINGS:
+            if getattr(m2e, name) != getattr(first, name):
+                raise MergeError(m2e.filename, name + ' is ' +
+                                 str(getattr(m2e, name)) + ' but ' +
+                                 str(getattr(first, name)) + ' in ' +
+                                 first.filename)
+        if m2e.genFreqList() != freqlist:
+            raise MergeError(m2e.filename, 'the frequency list differs '
+                             'from that of ' + first.filename)
+    return runs
+
+
+def mergeRuns(filenames, path, binwidth=0.1, maxtof=100, onerror='raise',
+              output=None, metrics=None):
+    '''
+    mergeRuns(filenames, path, binwidth, maxtof, onerror, output, metrics)
+    converts several runs of one measurement into a single EVA file, by
+    default named by mergedPath in the 'path' directory, or 'output'.
+    Returns the name of the file.
+
+    The runs must have the same species, charge, excitation and frequency
+    scan (see readMergeRuns); they are all binned with the same 'binwidth' and
+    'maxtof'. Their cycle records are streamed into the file in run order,
+    one run at a time as by MidasToEva.streamEvaFile, and the cycles of
+    each run are spread between its own start and stop times. A run that
+    stops part way through a scan is padded with empty cycles, stamped
+    with its stop time, so that every run starts at the first frequency.
+    'onerror' is handled as by MidasToEva.binMdumpData.
+
+    The file is written under a temporary name and only renamed once all
+    runs are in, so a failed merge leaves no partial file behind.
+    '''
+    if not filenames:
+        raise ValueError('No runs to merge.')
+    if output is None:
+        output = mergedPath(filenames, path)
+    if metrics is None:
+        metrics = RunMetrics(output)
+    runs = readMergeRuns(filenames, metrics)
+    numsteps = runs[0].freqStepCount()
+
+    tmpname = output + '.tmp'
+    datafile = open(tmpname, 'w+b')
+    try:
+        with metrics.stage('mergeRuns'):
+            for index, m2e in enumerate(runs):
+                last = index == len(runs) - 1
+                mergeRun(m2e, datafile, binwidth, maxtof, onerror,
+                         None if last else numsteps, index == 0)
+            metrics.count('runs', len(runs))
+            metrics.count('byteswritten', datafile.tell())
+        datafile.close()
+        os.rename(tmpname, output)
+    except:
+        datafile.close()
+        os.remove(tmpname)
+        raise
+    return output
+
+
+def mergeRun(m2e, datafile, binwidth, maxtof, onerror, numsteps, header):
+    '''
+    mergeRun(m2e, datafile, binwidth, maxtof, onerror, numsteps, header)
+    appends the cycle records of one run to the merged EVA file, after the
+    EVA header if 'header' is set, and pads them to a whole number of
+    'numsteps' cycles unless it is None. The padding goes by the cycles
+    binned, so cycles dropped for bad gates still count towards the scan.
+    See mergeRuns.
+    '''
+    m2e.numchannels = int(maxtof / binwidth)
+    m2e.binwidth = binwidth
+    m2e.maxtof = maxtof
+    if header:
+        m2e.writeEvaHeader(datafile)
+
+    runstart = datafile.tell()
+    numcycles = 0
+    for hist in m2e.iterCycleHistograms(binwidth, maxtof, onerror=onerror):
+        writeCycleRecords(datafile, hist, np.zeros(len(hist)))
+        numcycles += len(hist)
+    if numcycles:
+        dtime = (m2e.endtime - m2e.starttime) / float(numcycles)
+        patchTimestamps(datafile, runstart,
+                        (m2e.starttime + i * dtime
+                         for i in xrange(numcycles)))
+
+    padding = -m2e.cyclesbinned % numsteps if numsteps else 0
+    if padding:
+        print ('Padding ' + m2e.filename + ' with ' + str(padding) +
+               ' empty cycles to finish its scan.')
+        writeCycleRecords(datafile,
+                          np.zeros((padding, m2e.numchannels), np.uint32),
+                          np.repeat(float(m2e.endtime), padding))
+        m2e.metrics.count('cyclespadded', padding)
+    m2e.metrics.info.setdefault('runs', []).append(
+        {'filename': m2e.filename, 'cycles': numcycles, 'padding': padding})
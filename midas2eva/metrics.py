@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import cProfile
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class RunMetrics:
+    '''
+    RunMetrics records, for every stage of a conversion, the wall and CPU
+    time spent in it, how often it ran, and counters such as bytes read and
+    written, events decoded or ions binned.
+
+    Stages can nest; counters added with count() go to the innermost stage
+    that is running, and the time of a nested stage is also part of the
+    time of the stages around it. 'hooks' are called as hook(stagename,
+    stage) each time a stage finishes. With 'profile' set each outermost
+    stage also runs under cProfile, which covers the stages nested in it,
+    and its Profile object is kept in 'profiles'. Anything put in 'info' is
+    written with the record.
+    '''
+
+    def __init__(self, filename=None, hooks=None, profile=False):
+        self.filename = filename
+        self.hooks = list(hooks or [])
+        self.profile = profile
+        self.profiles = {}
+        self.stages = OrderedDict()
+        self.running = []
+        self.toplevel = OrderedDict([('calls', 0), ('wall', 0.0),
+                                     ('cpu', 0.0)])
+        self.info = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        stage(name) is a context manager that times the code inside it as
+        stage 'name'. Repeated stages add up.
+        '''
+        record = self.stages.setdefault(name, OrderedDict(
+            [('calls', 0), ('wall', 0.0), ('cpu', 0.0)]))
+        toplevel = not self.running
+        self.running.append(record)
+        profiler = None
+        # only one profiler can run at a time
+        if self.profile and toplevel:
+            profiler = self.profiles.setdefault(name, cProfile.Profile())
+            profiler.enable()
+        wall = time.time()
+        cpu = os.times()
+        try:
+            yield record
+        finally:
+            elapsed = OrderedDict(
+                [('calls', 1), ('wall', time.time() - wall),
+                 ('cpu', sum(os.times()[:2]) - sum(cpu[:2]))])
+            for key, value in elapsed.items():
+                record[key] += value
+                if toplevel:
+                    self.toplevel[key] += value
+            if profiler is not None:
+                profiler.disable()
+            self.running.pop()
+            for hook in self.hooks:
+                hook(name, record)
+
+    def count(self, key, value=1):
+        '''
+        count(key, value) adds 'value' to counter 'key' of the stage that is
+        running. Outside of any stage the call is ignored.
+        '''
+        if self.running:
+            record = self.running[-1]
+            record[key] = record.get(key, 0) + value
+
+    def record(self, **extra):
+        '''
+        record(**extra) returns the metrics of the run as a dict that can
+        be written as JSON: the stages in the order they first ran, the
+        totals of every counter over all stages, 'info' and any 'extra'
+        fields. The calls and times in the totals are those of the
+        outermost stages only, so nested stages are not counted twice.
+        '''
+        totals = OrderedDict(self.toplevel)
+        for stage in self.stages.values():
+            for key, value in stage.items():
+                if key not in self.toplevel:
+                    totals[key] = totals.get(key, 0) + value
+        result = OrderedDict([('filename', self.filename),
+                              ('stages', self.stages),
+                              ('totals', totals)])
+        result.update(self.info)
+        result.update(extra)
+        return result
+
+    def toJson(self, **extra):
+        return json.dumps(self.record(**extra))
+
+    def dumpProfiles(self, prefix):
+        '''
+        dumpProfiles(prefix) writes the cProfile statistics of each stage to
+        prefix + '.' + stagename + '.prof', to be read with pstats.
+        '''
+        for name, profiler in self.profiles.items():
+            profiler.dump_stats(prefix + '.' + name + '.prof')
+
+
+def timedStage(name):
+    '''
+    timedStage(name) decorates a MidasToEva method so each call is timed as
+    stage 'name' in the object's 'metrics'.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.stage(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,13 +1,49 @@
 #import sys
 import os
-import commands
+import time
 from struct import pack
-from math import floor
 from os.path import basename
-from collections import Counter
 import xml.etree.cElementTree as ET
-import re
 import ast
+from io import BytesIO
+from collections import OrderedDict
+
+import numpy as np
+
+from midasfile import MidasFile, EVENT_HEADER
+from events import decodeEvents, errorWords, eventTypes, EVENT_CLOSE
+from binning import (CycleBinner, gateCounters, findGateDefects,
+                     foldCycles, stepSummary, completeGates, unwrapCounters)
+from eva import (writeCycleRecords, patchTimestamps, verifyEvaFile,
+                 appendCycleRecords, setRecordTimestamps)
+from odb import OdbIndex, parseOdb, loadOdbIndex
+from metrics import RunMetrics, timedStage
+from parallel import binRunParallel
+from columnar import writeColumnar, compactCounts
+from positions import decodePositions, positionCycles, accumulateImages
+from textout import formatIntLines
+from incremental import loadCheckpoint, checkpointKey, appendRows
+
+# ODB keys read by the get* functions, for extractXML(keys=ODB_KEYS)
+ODB_KEYS = ['/*/Variables/*',
+            '/Runinfo/*',
+            '/*/*/*/begin_ramp/*',
+            '/*/*/*/begin_scan/*',
+            '/*/*/*/transition_QUAD*/*',
+            '/*/*/*/pul_TDCGate/*']
+
+# What binMdumpData and friends do about bad TDC gates: raise on the first
+# one, or carry on and drop or only flag the cycles they end
+GATE_ERROR_MODES = ('raise', 'drop', 'flag')
+
+# Run parameters reported with the metrics, see recordParameters
+RUN_PARAMETERS = ['mass', 'charge', 'amplitude', 'trf', 'startfreq',
+                  'stopfreq', 'numfreqsteps', 'starttime', 'endtime',
+                  'binwidth', 'maxtof', 'numchannels']
+
+# What writePosImage accumulates an MCP image for: the whole run, each
+# cycle or each frequency step
+POSITION_IMAGE_MODES = ('run', 'cycle', 'step')
 
 # ATG October 2013:
 # changed the 'l's in writeEVAFile to 'i's. This should allow us to
@@ -43,7 +79,11 @@ class MissingTDCClose(Exception):
 
 class MidasToEva:
 
-    def __init__(self, filename):
+    def __init__(self, filename, metrics=None):
+        self.odbindexes = {}
+        if metrics is None:
+            metrics = RunMetrics(filename)
+        self.metrics = metrics
         if os.path.isfile(filename) and filename.endswith('.mid'):
             self.status = 1
             self.filename = filename
@@ -51,20 +91,31 @@ class MidasToEva:
             print(filename + " is not a valid MIDAS file.")
             self.status = 0
 
-    def extractXML(self):
+    @timedStage('extractXML')
+    def extractXML(self, keys=None):
+        '''
+        extractXML parses the begin-of-run ODB dump into 'domag' and the
+        end-of-run dump into 'dom2ag'. Only the ends of the file are read
+        (see MidasFile.readOdbDumps).
+
+        With 'keys', a list of ODB path patterns such as ODB_KEYS, the
+        dumps are streamed instead and only the matching keys are kept:
+        'domag' and 'dom2ag' are then OdbIndex objects, not trees, and
+        parsing stops once all of the keys have been seen.
+        '''
         if self.status:
             try:
-                datafile = open(self.filename, 'r')
-                data = datafile.read()
-                datafile.close()
-
-                startindex = data.find('<odb')
-                endindex = data.find('</odb>') + 6
-                self.domag = ET.fromstring(data[startindex:endindex])
-
-                secstartindex = data.rfind('<odb')
-                secendindex = data.rfind('</odb>') + 6
-                self.dom2ag = ET.fromstring(data[secstartindex:secendindex])
+                reader = MidasFile(self.filename)
+                first, last = reader.readOdbDumps()
+                self.metrics.count('bytesread', reader.bytesread)
+                if keys is not None:
+                    self.domag = parseOdb(first, keys)
+                    self.dom2ag = parseOdb(last, keys)
+                    return
+                self.domag = ET.fromstring(first)
+                self.dom2ag = ET.fromstring(last)
+                self.odbindexes = {self.domag: OdbIndex(self.domag),
+                                   self.dom2ag: OdbIndex(self.dom2ag)}
             except IOError:
                 print("Could not open " + self.filename)
                 self.status = 0
@@ -76,6 +127,9 @@ class MidasToEva:
         the specified level 'dirpath'. 'castfunc' casts the returned result
         into the specified type. Default is to cast into a str.
 
+        ODB dumps read by extractXML are looked up in their OdbIndex
+        instead of searching the tree.
+
         Example:
             /Experiment/Variables/Center Frequency
             dirpath = './dir/dir'        - Variables is 2 dirs from '/'
@@ -83,12 +137,29 @@ class MidasToEva:
             keyname = 'Center Frequency' - name of key to extract value from
         '''
         try:
+            index = self.getOdbIndex(xml)
+            if index is not None:
+                path = index.find(dirpath.count('dir'), dirname, keyname)
+                return castfunc(index.texts[path])
             return castfunc(xml.find(dirpath + "/[@name='" + dirname + "']")
                             .find("key/[@name='" + keyname + "']").text)
         except:
             raise Exception("readmidas: Error accessing odb element: " +
                             dirpath + " " + dirname + " " + keyname)
 
+    def getOdbIndex(self, xml):
+        '''
+        getOdbIndex(xml) returns the OdbIndex of an ODB dump read by
+        extractXML, or None for any other tree.
+        '''
+        if isinstance(xml, OdbIndex):
+            return xml
+        try:
+            return self.odbindexes.get(xml)
+        except TypeError:
+            # unhashable, so not one of ours
+            return None
+
     def getOdbVariable(self, xml, dirpath, dirname, keyname, castfunc,
                        var, varcastfunc):
         if var is not None:
@@ -157,6 +228,21 @@ class MidasToEva:
     def getCycleTime(self):
         pass
 
+    def readRunParameters(self):
+        '''
+        readRunParameters() reads every run parameter that goes into the
+        EVA header from the ODB dumps, with the get* functions.
+        '''
+        self.getElem()
+        self.getZ()
+        self.getAmplitude()
+        self.getRFTime()
+        self.getStartFreq()
+        self.getStopFreq()
+        self.getNumFreqSteps()
+        self.getStartTime()
+        self.getEndTime()
+
     def getStartTime(self, startt=None):
         self.starttime = self.getOdbVariable(self.domag, './dir', 'Runinfo',
                                              'Start time binary', float,
@@ -198,18 +284,25 @@ class MidasToEva:
             # loop over even multiples of 'transition_QUAD' to get all of the
             # rf times.
             self.trf = 0
+            index = self.getOdbIndex(self.domag)
             while True:
-                try:
-                    self.trf += self.getAttribute(self.domag,
-                                                  "./dir/dir/dir/dir",
-                                                  "transition_QUAD" +
-                                                  str(transNum),
-                                                  "time offset (ms)",
-                                                  float)
-                except:
-                    # No more 'transition_QUAD's were found,
-                    # so return the rftime
-                    break
+                dirname = "transition_QUAD" + str(transNum)
+                if index is not None:
+                    path = index.find(4, dirname, "time offset (ms)")
+                    if path is None:
+                        break
+                    self.trf += float(index.texts[path])
+                else:
+                    try:
+                        self.trf += self.getAttribute(self.domag,
+                                                      "./dir/dir/dir/dir",
+                                                      dirname,
+                                                      "time offset (ms)",
+                                                      float)
+                    except:
+                        # No more 'transition_QUAD's were found,
+                        # so return the rftime
+                        break
                 transNum += 2
 
         # Convert from ms to sec
@@ -224,91 +317,91 @@ class MidasToEva:
                                            tdcTime, float)
         print 'TDC Gate Width = ' + str(self.tdcTime) + ' us'
 
+    @timedStage('collectMdumpData')
     def collectMdumpData(self):
         '''
-        collectMdumpData stores the output from the mdump program after a
-        coarse pass through the data.
+        collectMdumpData reads the MPET event banks and any MCPP position
+        banks straight from the MIDAS file.
 
-        The data is passed through twice. Once to extract the data for the
-        MPET event bank, the second to extract any position data.
+        Both are stored as arrays of 32-bit words, the same words the mdump
+        program prints in hex. The number of MPET and MCPP words in each
+        MIDAS event is kept in 'wordcounts' and 'poscounts', which
+        writePosImage needs to assign the positions to cycles.
         '''
-        comstring = 'mdump -b MPET -x ' + self.filename
-        status, data = commands.getstatusoutput(comstring)
-
-        self.mdumpdata = self.extractBankData('Bank:MPET', data)
-
-        self.posdata = self.extractBankData('Bank:MCPP', data)
-
-    def extractBankData(self, BankName, data):
-        mdumpdata = []
-
-        if BankName in data:
-            for match in re.finditer(BankName, data):
-                leftindex = match.end()
-                tempindex = data.find('Length: ', leftindex)
-                tempstring = data[tempindex + 8: tempindex + 18]
-                temp = tempstring.split('(')
-                numentries = int(temp[0]) / 4
-
-                for counter in xrange(numentries):
-                    midindex = data.find('0x', leftindex)
-                    mdumpdata.append(data[midindex:midindex + 10])
-                    leftindex = midindex + 1
-        else:
-            print 'No valid ' + BankName + ' banks found in file.'
+        reader = MidasFile(self.filename)
+        banks, counts = reader.readEventBanks(('MPET', 'MCPP'))
+        self.wordcounts = counts['MPET']
+        self.poscounts = counts['MCPP']
+        self.metrics.count('bytesread', reader.bytesread)
+        self.metrics.count('words', len(banks['MPET']))
+        self.metrics.count('positions', len(banks['MCPP']))
+
+        self.mdumpdata = banks['MPET']
+        if len(self.mdumpdata) == 0:
+            print 'No valid Bank:MPET banks found in file.'
 
-        return mdumpdata
+        self.posdata = banks['MCPP']
+        if len(self.posdata) == 0:
+            print 'No valid Bank:MCPP banks found in file.'
 
-    def reorganizeMdumpData(self):
+    @timedStage('reorganizeMdumpData')
+    def reorganizeMdumpData(self, eventfilter=None):
         '''
-        reorganizeMdumpData() takes the raw mdump data and generates an array
-        of tuples. Each tupole contains the 'event type', 'secondary type' and
-        'tof' for each detected ion.
+        reorganizeMdumpData() takes the raw MPET words and generates an event
+        table. Each row holds the 'event type', the 'cycle' counter and the
+        'tof' (in TDC ticks of 0.01 us) for each detected ion.
+
+        With an events.EventFilter, e.g. for the TOF window of binMdumpData
+        (see events.tofTicks), the ions it rejects are dropped while the
+        words are decoded and never enter the table; the number dropped
+        is added to the metrics.
 
         event type = type of event. 8 or a = Start of TDC Gate, 1 or 3 = End
             of TDC Gate, 4 or 6 = Out of TDC Gate ion, 2 = In TDC Gate ion,
             0 = Timestamp.
 
         Event types 8, 1, and 4 are followed by timestamp events.
+
+        The first word of every event flagged with an error type (a, 6 or 3)
+        is kept in errarray.
         '''
         if len(self.mdumpdata) == 0:
             print 'No mdump data available.  Run collectMdumpData().'
             return
 
-        mdumparray = []
-        errarray = []
-        mdumpdata = self.mdumpdata
-
-        arraylen = len(mdumpdata)
-
-        # Extract Event type and timestamp
-        for i in xrange(0, arraylen, 2):
-            firsthex = mdumpdata[i]
-            sechex = mdumpdata[i + 1]
-            evtype = firsthex[2]
-            if(evtype == 'a'):
-                errarray.append(firsthex)
-                evtype = '8'
-            elif(evtype == '6'):
-                errarray.append(firsthex)
-                evtype = '4'
-            elif(evtype == '3'):
-                errarray.append(firsthex)
-                evtype = '1'
-            cyclenum = int(firsthex[3:6], 16)
-            tof = float(int(sechex[2:], 16)) * 0.01
-            temp = (int(evtype), cyclenum, tof)
-            mdumparray.append(temp)
-        self.mdumparray = mdumparray
-        self.errarray = errarray
-
-    def binMdumpData(self, binwidth=0.1, maxtof=100):
-        '''
-        binMdumpData bins the data collected from mdump.
-
-        The binned data is saved as in array for each cycle.
-        This array is then appended to a 'master' tof array
-        that contains the tof info for each type of event.
+        self.eventfilter = eventfilter
+        self.mdumparray, self.errarray = self.decodeWords(self.mdumpdata,
+                                                          eventfilter)
+        numevents = len(self.mdumparray)
+        self.metrics.count('events', numevents)
+        self.metrics.count('errors', len(self.errarray))
+
+    def decodeWords(self, words, eventfilter=None):
+        '''
+        decodeWords(words, eventfilter) decodes MPET words with decodeEvents
+        and adds what 'eventfilter' rejected to the metrics. Returns (table,
+        errwords), where 'errwords' holds the first word of every event
+        flagged with an error type, including those the filter dropped.
+        '''
+        if eventfilter is None:
+            table, errmask = decodeEvents(words)
+            return table, words[0:2 * len(table):2][errmask]
+
+        rejected = dict(eventfilter.rejected)
+        table, errmask = decodeEvents(words, eventfilter)
+        for reason, count in eventfilter.rejected.items():
+            self.metrics.count('rejected' + reason, count - rejected[reason])
+        return table, errorWords(words)
+
+    @timedStage('binMdumpData')
+    def binMdumpData(self, binwidth=0.1, maxtof=100, onerror='raise'):
+        '''
+        binMdumpData bins the data collected from the MPET banks.
+
+        The binned data is saved as a cycles x numchannels
+        count matrix in 'bindata', one row per TDC gate.
+        Ions are assigned to the gate that closes after
+        them; ions after the last TDCClose are dropped.
 
         We also check to ensure that the event cycle counter
         is updated correctly through the MIDAS file. This
@@ -317,47 +410,419 @@ class MidasToEva:
         If a missing gate or event is detected, an
         exception will be thrown, and any further file
         conversion will be aborted.
+
+        With onerror='drop' or 'flag' the conversion
+        carries on instead: every bad gate is listed in
+        'gatedefects' and the rows of the cycles they end
+        in 'badcycles'. 'drop' also removes those rows
+        from 'bindata'.
+
+        If the frequency steps are known the counts are
+        also summed by step, see foldStepSpectra.
         '''
         # binwidth and maxtof are in units of us
 
-        cyclecounter = 0
         self.numchannels = int(maxtof / binwidth)
-        self.bindata = []
-        #tofbin=self.numchannels*[0]
-        tofbin = []
         self.binwidth = binwidth
+        self.maxtof = maxtof
+
+        binner = self.makeBinner(binwidth, maxtof, onerror)
+        self.resetStepSpectra()
+        bindata = binner.feed(self.mdumparray)
+        self.setGateDefects(binner.defects)
+        self.foldStepSpectra(bindata, 0, self.gatedefects, onerror)
+        self.bindata = self.keepCycles(bindata, 0, self.gatedefects,
+                                       onerror)
+        self.countBinned(binner)
+
+    def makeBinner(self, binwidth, maxtof, onerror):
+        '''
+        makeBinner(binwidth, maxtof, onerror) returns a CycleBinner that
+        raises on a bad gate, or one that lists them for onerror='drop' or
+        'flag' (see GATE_ERROR_MODES).
+        '''
+        if onerror not in GATE_ERROR_MODES:
+            raise ValueError('onerror must be one of ' +
+                             ', '.join(GATE_ERROR_MODES))
+        checkgates = self.checkGates if onerror == 'raise' else None
+        return CycleBinner(int(maxtof / binwidth), binwidth, maxtof,
+                           checkgates)
+
+    def setGateDefects(self, defects):
+        '''
+        setGateDefects(defects) stores the bad gates found while binning in
+        'gatedefects' and the rows of their cycles in 'badcycles', and
+        reports them.
+        '''
+        self.gatedefects = list(defects)
+        self.badcycles = np.unique([defect.cycle for defect in defects]
+                                   ).astype(np.int64)
+        self.metrics.count('gatedefects', len(self.gatedefects))
+        if self.gatedefects:
+            print ('WARNING: ' + str(len(self.gatedefects)) +
+                   ' bad TDC gates, first at cycle ' +
+                   str(self.gatedefects[0].cycle))
+
+    def keepCycles(self, hist, firstcycle, defects, onerror):
+        '''
+        keepCycles(hist, firstcycle, defects, onerror) removes the rows of
+        the cycles ended by bad gates in 'defects' from 'hist', whose first
+        row is cycle 'firstcycle', if onerror is 'drop'.
+        '''
+        if onerror != 'drop':
+            return hist
+        rows = np.unique([defect.cycle - firstcycle for defect in defects
+                          if 0 <= defect.cycle - firstcycle < len(hist)])
+        self.metrics.count('cyclesdropped', len(rows))
+        return np.delete(hist, rows.astype(np.int64), axis=0)
+
+    def freqStepCount(self):
+        '''
+        freqStepCount() returns the number of frequency steps in one scan,
+        i.e. the length of genFreqList, which covers every segment of a
+        'Quad FreqList'. Returns None if the run parameters it needs have
+        not been read.
+        '''
+        try:
+            return len(self.genFreqList()) or None
+        except (AttributeError, TypeError, ValueError, ZeroDivisionError):
+            return None
 
-        for entry in self.mdumparray:
-            if entry[0] == 8:
-                startTdcGateCounter = entry[1]
-                continue
-            elif entry[0] == 1:
-                endTdcGateCounter = entry[1]
-                # Check that the start and end GateCounters are correct
-                self.checkStartEndGateCounters(startTdcGateCounter,
-                                               endTdcGateCounter,
-                                               cyclecounter)
-
-                #print endTdcGateCounter, (startTdcGateCounter % 1024)
-                # Increment cycle counter
-                cyclecounter = cyclecounter + 1
-
-                # Check that cycle counter is updating correctly
-                self.checkCycleCounter(startTdcGateCounter, cyclecounter)
+    def resetStepSpectra(self):
+        '''
+        resetStepSpectra() starts new per-step sums for foldStepSpectra:
+        'stepdata' becomes a zero freqsteps x numchannels matrix, or None if
+        the frequency steps are not known (see freqStepCount).
+        '''
+        numsteps = self.freqStepCount()
+        self.stepdata = None
+        self.stepions = None
+        self.steptof = None
+        if numsteps:
+            self.stepdata = np.zeros((numsteps, self.numchannels),
+                                     dtype=np.int64)
+
+    def foldStepSpectra(self, hist, firstcycle, defects, onerror):
+        '''
+        foldStepSpectra(hist, firstcycle, defects, onerror) adds the cycles
+        of 'hist', whose first row is cycle 'firstcycle', to the per-step
+        sums in 'stepdata' (see binning.foldCycles). It updates 'stepions'
+        and 'steptof', the number of ions and their mean TOF in us for
+        each step. With onerror='drop' the cycles ended by the bad gates in
+        'defects' are left out, as they are from 'bindata'.
+        '''
+        if getattr(self, 'stepdata', None) is None:
+            return
+        skip = ()
+        if onerror == 'drop':
+            skip = [defect.cycle for defect in defects]
+        self.stepdata += foldCycles(hist, len(self.stepdata), firstcycle,
+                                    skip)
+        self.stepions, self.steptof = stepSummary(self.stepdata,
+                                                  self.binwidth)
+
+    def validateGates(self):
+        '''
+        validateGates() checks every TDC gate in the event table from
+        reorganizeMdumpData at once and returns the list of bad ones (see
+        findGateDefects), without binning anything.
+        '''
+        return findGateDefects(*gateCounters(self.mdumparray))
 
-                # Append tof bin data
-                self.bindata.append(tofbin)
+    def countBinned(self, binner):
+        '''
+        countBinned(binner) adds the cycles and ions binned by a CycleBinner
+        to the metrics of the running stage, and keeps the number of cycles
+        binned, before any are dropped, in 'cyclesbinned'.
+        '''
+        self.cyclesbinned = binner.cyclecounter
+        self.metrics.count('cycles', binner.cyclecounter)
+        self.metrics.count('ions', binner.numions)
+        self.metrics.count('ionsbinned', binner.numbinned)
+        self.metrics.count('ionscut', binner.numions - binner.numbinned)
+
+    @timedStage('binParallel')
+    def binParallel(self, binwidth=0.1, maxtof=100, jobs=2, onerror='raise'):
+        '''
+        binParallel bins the MPET banks of the MIDAS file with 'jobs'
+        worker processes, each decoding and binning a chunk of the file
+        (see binRunParallel). It replaces collectMdumpData,
+        reorganizeMdumpData and binMdumpData and gives the same 'bindata',
+        'stepdata' and 'errarray', including the checks of the gate counters
+        across the whole run. The event table itself is not kept. 'onerror'
+        is handled as by binMdumpData.
+        '''
+        self.numchannels = int(maxtof / binwidth)
+        self.binwidth = binwidth
+        self.maxtof = maxtof
+
+        checkgates = self.makeBinner(binwidth, maxtof, onerror).checkgates
+        bindata, self.errarray, defects, counts = binRunParallel(
+            self.filename, self.numchannels, binwidth, maxtof,
+            checkgates, jobs)
+        self.setGateDefects(defects)
+        self.resetStepSpectra()
+        self.foldStepSpectra(bindata, 0, self.gatedefects, onerror)
+        self.bindata = self.keepCycles(bindata, 0, self.gatedefects,
+                                       onerror)
+        self.numerrors = len(self.errarray)
+        for key in ('bytesread', 'words', 'events'):
+            self.metrics.count(key, counts[key])
+        self.metrics.count('errors', self.numerrors)
+        self.metrics.count('cycles', len(bindata))
+        self.metrics.count('ions', counts['ions'])
+        self.metrics.count('ionsbinned', counts['ionsbinned'])
+        self.metrics.count('ionscut', counts['ions'] - counts['ionsbinned'])
+
+    def iterCycleHistograms(self, binwidth=0.1, maxtof=100,
+                            chunkwords=1 << 18, onerror='raise',
+                            eventfilter=None):
+        '''
+        iterCycleHistograms streams the MPET banks from the MIDAS file
+        and yields the count matrix of the cycles that closed in each
+        batch of about 'chunkwords' words.
+
+        The words are decoded, checked and binned the same way as by
+        reorganizeMdumpData and binMdumpData, but only one batch is
+        held in memory at a time. The number of error words is kept
+        in 'numerrors'. The counters of the run are added to the metrics
+        once the whole file has been read. 'onerror' and the per-step
+        sums in 'stepdata' are handled as by binMdumpData, and
+        'eventfilter' as by reorganizeMdumpData.
+        '''
+        binner = self.makeBinner(binwidth, maxtof, onerror)
+        self.resetStepSpectra()
+        self.numerrors = 0
+        numwords = 0
+        numevents = 0
+        batch = []
+        batchwords = 0
+        reader = MidasFile(self.filename)
+        for name, words in reader.iterBankWords(('MPET',)):
+            batch.append(words)
+            batchwords += len(words)
+            numwords += len(words)
+            if batchwords < chunkwords:
+                continue
 
-                # reset tof bin
-                tofbin = []
+            words = np.concatenate(batch)
+            table, errwords = self.decodeWords(words, eventfilter)
+            self.numerrors += len(errwords)
+            numevents += len(table)
+            # an event split over two banks is finished in the next batch
+            batch = [words[len(words) // 2 * 2:]]
+            batchwords = len(batch[0])
+
+            firstcycle = binner.cyclecounter
+            hist = binner.feed(table)
+            self.foldStepSpectra(hist, firstcycle, binner.defects, onerror)
+            hist = self.keepCycles(hist, firstcycle, binner.defects,
+                                   onerror)
+            if len(hist):
+                yield hist
+
+        if not batch:
+            batch = [np.zeros(0, dtype=np.uint32)]
+        table, errwords = self.decodeWords(np.concatenate(batch),
+                                           eventfilter)
+        self.numerrors += len(errwords)
+        numevents += len(table)
+        firstcycle = binner.cyclecounter
+        hist = binner.feed(table)
+        self.foldStepSpectra(hist, firstcycle, binner.defects, onerror)
+        hist = self.keepCycles(hist, firstcycle, binner.defects, onerror)
+
+        self.setGateDefects(binner.defects)
+        self.metrics.count('bytesread', reader.bytesread)
+        self.metrics.count('words', numwords)
+        self.metrics.count('events', numevents)
+        self.metrics.count('errors', self.numerrors)
+        self.countBinned(binner)
+        if len(hist):
+            yield hist
+
+    @timedStage('quickLook')
+    def quickLook(self, binwidth=0.1, maxtof=100, maxcycles=None, stride=1,
+                  seconds=None):
+        '''
+        quickLook bins a bounded sample of the run for a first look at it
+        while the full conversion would take too long: the first
+        'maxcycles' cycles, the MPET banks of every 'stride'-th MIDAS event
+        only, and no more than about 'seconds' of wall time, for whichever
+        of these are given.
+
+        With a stride of 1 the events are binned in sequence, as by
+        iterCycleHistograms. With a larger stride each sampled event is
+        binned on its own, keeping only the gates that open and close in
+        it, and their cycles are found from the gate counters (see
+        unwrapCounters), so the sampled events must be fewer than 1024
+        cycles apart. Bad gates are not checked for.
+
+        The sampled cycles go to 'bindata' and their rows in the run to
+        'samplecycles'. If the frequency steps are known (see
+        freqStepCount) 'stepdata', 'stepions' and 'steptof' are summed as
+        by binMdumpData, 'stepcycles' counts the sampled cycles of each
+        step and 'steprate' is the ions per cycle of each step.
+
+        Returns a summary, also kept in 'quicklook' and in the metrics
+        info: the data events, cycles and ions sampled, 'fraction', the
+        share of the run's data events (by size) that was decoded, the
+        ions per cycle and, if the event timestamps allow it, the cycle
+        time and ions per second. 'complete' is False if the sample was
+        cut short by 'maxcycles' or 'seconds'.
+        '''
+        if stride < 1:
+            raise ValueError('stride must be at least 1')
+        self.numchannels = int(maxtof / binwidth)
+        self.binwidth = binwidth
+        self.maxtof = maxtof
+        self.resetStepSpectra()
+
+        started = time.time()
+        binner = self.makeBinner(binwidth, maxtof, 'flag')
+        reader = MidasFile(self.filename)
+        hists = []
+        cycles = []
+        numcycles = 0
+        numevents = 0
+        sampledbytes = 0
+        otherbytes = 0
+        # (timestamp, last cycle) of the first and last sampled events
+        first = last = None
+        lastcycle = -1
+        leftover = np.zeros(0, dtype=np.uint32)
+        complete = True
+        for offset, header, payload in reader.iterEvents(stride=stride):
+            if header.eventid & 0x8000:
+                otherbytes += EVENT_HEADER.size + header.datasize
                 continue
-            elif entry[0] == 4:
+            if payload is None:
                 continue
+            words = [leftover]
+            for bankname, data in reader.iterBanks(payload, offset):
+                if bankname == 'MPET':
+                    words.append(np.frombuffer(data, dtype='<u4',
+                                               count=len(data) // 4))
+            words = np.concatenate(words).astype(np.uint32)
+            table, errmask = decodeEvents(words)
+            if stride == 1:
+                # an event split over two banks is finished in the next one
+                leftover = words[2 * len(table):]
+                firstcycle = binner.cyclecounter
+                hist = binner.feed(table)
+                rows = firstcycle + np.arange(len(hist), dtype=np.int64)
             else:
-                if entry[2] < maxtof:
-                    bin = int(floor(entry[2] / binwidth))
-                    #tofbin[bin]=tofbin[bin]+1
-                    tofbin.append(bin)
+                hist, counters = completeGates(table, self.numchannels,
+                                               binwidth, maxtof)
+                rows = unwrapCounters(counters, lastcycle)
+            if maxcycles is not None:
+                hist = hist[:max(maxcycles - numcycles, 0)]
+                rows = rows[:len(hist)]
+
+            numevents += 1
+            sampledbytes += EVENT_HEADER.size + header.datasize
+            if len(rows):
+                lastcycle = int(rows[-1])
+                hists.append(hist)
+                cycles.append(rows)
+                numcycles += len(rows)
+                last = (header.timestamp, lastcycle)
+                if first is None:
+                    first = last
+            if ((maxcycles is not None and numcycles >= maxcycles) or
+                    (seconds is not None and
+                     time.time() - started >= seconds)):
+                complete = False
+                break
+
+        if hists:
+            self.bindata = np.concatenate(hists)
+            self.samplecycles = np.concatenate(cycles)
+        else:
+            self.bindata = np.zeros((0, self.numchannels), dtype=np.uint32)
+            self.samplecycles = np.zeros(0, dtype=np.int64)
+        self.stepcycles = None
+        self.steprate = None
+        if self.stepdata is not None:
+            self.foldStepSpectra(self.bindata, self.samplecycles, [], 'flag')
+            self.stepcycles = np.bincount(
+                self.samplecycles % len(self.stepdata),
+                minlength=len(self.stepdata))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self.steprate = self.stepions / self.stepcycles.astype(float)
+
+        numions = int(self.bindata.sum())
+        databytes = os.path.getsize(self.filename) - otherbytes
+        summary = OrderedDict([
+            ('events', numevents),
+            ('cycles', numcycles),
+            ('ions', numions),
+            ('fraction', sampledbytes / float(databytes) if databytes > 0
+             else 0.0),
+            ('complete', complete),
+            ('ionspercycle', numions / float(numcycles) if numcycles
+             else None),
+            ('cycletime', None),
+            ('ionspersecond', None)])
+        if first is not None and last[1] > first[1] and last[0] > first[0]:
+            summary['cycletime'] = ((last[0] - first[0]) /
+                                    float(last[1] - first[1]))
+            summary['ionspersecond'] = (summary['ionspercycle'] /
+                                        summary['cycletime'])
+        self.quicklook = summary
+        self.metrics.info['quicklook'] = summary
+        self.metrics.count('bytesread', reader.bytesread)
+        self.metrics.count('events', numevents)
+        self.metrics.count('cycles', numcycles)
+        self.metrics.count('ionsbinned', numions)
+
+        print ('Quick look: ' + str(numcycles) + ' cycles from ' +
+               '%.1f%%' % (100 * summary['fraction']) + ' of the run')
+        return summary
+
+    def checkGates(self, startTdcGateCounter, endTdcGateCounter,
+                   cyclecounter):
+        '''Run both gate checks for the gate that closes cycle
+           'cyclecounter' (counted from 0).'''
+        self.checkStartEndGateCounters(startTdcGateCounter,
+                                       endTdcGateCounter, cyclecounter)
+        self.checkCycleCounter(startTdcGateCounter, cyclecounter + 1)
+
+    def loadEventCache(self, cache):
+        '''
+        loadEventCache(cache) restores the decoded event table, the error and
+        position words and the ODB keys in ODB_KEYS from an EventCache.
+        Returns False if the run is not in the cache.
+
+        After a successful load the get* functions and binMdumpData can be
+        used straight away; extractXML, collectMdumpData and
+        reorganizeMdumpData are not needed.
+        '''
+        entry = cache.load(self.filename)
+        if entry is None:
+            return False
+        self.mdumparray = entry['events']
+        self.eventfilter = None
+        self.errarray = entry['errors']
+        self.posdata = entry['positions']
+        self.poscounts = None
+        self.domag = loadOdbIndex(entry['odb']['domag'])
+        self.dom2ag = loadOdbIndex(entry['odb']['dom2ag'])
+        return True
+
+    def storeEventCache(self, cache):
+        '''
+        storeEventCache(cache) saves the output of extractXML and
+        reorganizeMdumpData for this run in an EventCache. Event tables cut
+        down by an EventFilter are not cached.
+        '''
+        if getattr(self, 'eventfilter', None) is not None:
+            print 'Filtered event table not cached.'
+            return
+        odb = {'domag': self.getOdbIndex(self.domag).dump(ODB_KEYS),
+               'dom2ag': self.getOdbIndex(self.dom2ag).dump(ODB_KEYS)}
+        cache.store(self.filename, self.mdumparray, self.errarray,
+                    self.posdata, odb)
 
     def checkStartEndGateCounters(self, startTdcGateCounter,
                                   endTdcGateCounter, cyclecounter):
@@ -385,13 +850,15 @@ class MidasToEva:
             print "ERROR: Possible event missing in MIDAS banks"
             raise MissingEvent(cyclecounter)
 
+    @timedStage('writeEvaFile')
     def writeEvaFile(self, mass, charge, amp, extime,
                      path='/triumfcs/trshare/titan/MPET/Data/'):
         '''
         writeEVAFile writes the collected and binned mdump data to an EVA file.
 
         In order to determine the frequencies that were used the function
-        'genFreqList' is called.
+        'genFreqList' is called. Returns the name of the file written, or
+        None if it could not be opened.
         '''
 
         evafilename = self.filename[:-4] + '_eva.dat'
@@ -402,6 +869,31 @@ class MidasToEva:
             print 'Could not open ' + path + ' for writing.'
             return
 
+        self.writeEvaHeader(datafile)
+        writeCycleRecords(datafile, self.bindata, self.cycleTimestamps())
+        self.metrics.count('byteswritten', datafile.tell())
+        datafile.close()
+        return path
+
+    def verifyEvaFile(self, path='/triumfcs/trshare/titan/MPET/Data/'):
+        '''
+        verifyEvaFile checks the EVA file written by writeEvaFile or
+        streamEvaFile in 'path' against the event table of the run, binned
+        again with the same 'maxtof'. Returns the list of problems found
+        (see eva.verifyEvaFile); an empty list means the file is good.
+        Cycles dropped for bad gates show up as problems.
+        '''
+        evafilename = self.filename[:-4] + '_eva.dat'
+        return verifyEvaFile(path + basename(evafilename), self.mdumparray,
+                             self.starttime, self.endtime,
+                             getattr(self, 'maxtof', None))
+
+    def writeEvaHeader(self, datafile):
+        '''
+        writeEvaHeader writes the EVA text header and the frequency table
+        to 'datafile' and leaves it positioned at the start of the binary
+        cycle records.
+        '''
         # this will be the header length
         datafile.write(pack('i', 1))
         # this will be the start of the binary TOF data
@@ -447,35 +939,257 @@ class MidasToEva:
         datafile.write(pack('i', datastart))
         datafile.seek(datastart)
 
-        # Time that each frequncy point took
-        dtime = (self.endtime - self.starttime) / float(len(self.bindata))
+    @timedStage('streamEvaFile')
+    def streamEvaFile(self, binwidth=0.1, maxtof=100,
+                      path='/triumfcs/trshare/titan/MPET/Data/',
+                      onerror='raise', eventfilter=None):
+        '''
+        streamEvaFile converts the run to an EVA file in a single pass over
+        the MIDAS file, without holding the MPET words, the event table or
+        the binned data in memory.
+
+        Each cycle record is written as soon as its TDC gate has closed (see
+        iterCycleHistograms). The cycle timestamps depend on the total number
+        of cycles, so they are filled in once the whole run has been read.
+        The run parameters (getElem, getStartFreq, ...) have to be read
+        before calling this. 'onerror' is handled as by binMdumpData and
+        'eventfilter' as by reorganizeMdumpData. Returns the name of the file
+        written, or None if it could not be opened.
+        '''
+        self.numchannels = int(maxtof / binwidth)
+        self.binwidth = binwidth
+        self.maxtof = maxtof
 
-        # pack the data into a string to write later
-        datastring = ''
-        for i in xrange(len(self.bindata)):
-            hist = Counter(self.bindata[i])
-            numemptychan = self.numchannels - len(hist)
-            # if there is lots of tof data then don't pack the data
-            if numemptychan < self.numchannels / 2:
-                datastring += (pack('h', self.numchannels * 2 + 4))
-                datastring += (pack('i', self.starttime
-                                    + float(i) * dtime))
-                for j in hist:
-                    datastring += (pack('h', hist[j]))
-            # Not a lot of tof data, so pack the data
-            else:
-                datastring += (pack('h', (self.numchannels - numemptychan)
-                                    * 4 + 4))
-                datastring += (pack('i', self.starttime
-                                    + float(i) * dtime))
-                for j in hist:
-                    datastring += (pack('h', j))
-                    datastring += (pack('h', hist[j]))
-
-        datafile.write(datastring)
+        evafilename = self.filename[:-4] + '_eva.dat'
+        path = path + basename(evafilename)
+        try:
+            datafile = open(path, 'w+b')
+        except IOError:
+            print 'Could not open ' + path + ' for writing.'
+            return
+
+        self.writeEvaHeader(datafile)
+        datastart = datafile.tell()
+
+        numcycles = 0
+        for hist in self.iterCycleHistograms(binwidth, maxtof,
+                                             onerror=onerror,
+                                             eventfilter=eventfilter):
+            writeCycleRecords(datafile, hist, np.zeros(len(hist)))
+            numcycles += len(hist)
+
+        if numcycles:
+            dtime = (self.endtime - self.starttime) / float(numcycles)
+            patchTimestamps(datafile, datastart,
+                            (self.starttime + i * dtime
+                             for i in xrange(numcycles)))
+        datafile.seek(0, 2)
+        self.metrics.count('byteswritten', datafile.tell())
         datafile.close()
+        return path
 
+    @timedStage('convertIncremental')
+    def convertIncremental(self, binwidth=0.1, maxtof=100,
+                           path='/triumfcs/trshare/titan/MPET/Data/',
+                           onerror='raise'):
+        '''
+        convertIncremental converts a run that may still be growing. Every
+        call only decodes the events appended since the last call, adds the
+        cycles closed since then to the EVA file and spreads the cycle
+        timestamps again. Until the run has ended the EVA file is
+        provisional; after that it is the same as from writeEvaFile.
+
+        The state is kept next to the EVA file in a checkpoint named like
+        the run with '_checkpoint' (see columnar.writeColumnar): the file
+        offset reached, the open cycle and counters of the CycleBinner, the
+        error words, the per-step sums in 'stepdata', the offsets of the EVA
+        records and the ODB keys in ODB_KEYS. The count matrix is appended
+        to '_checkpoint.counts' and 'bindata' maps it from there. A
+        checkpoint taken with another 'binwidth', 'maxtof' or 'onerror' or
+        of another file is ignored and the run is converted from the start.
+
+        The run parameters are read with readRunParameters. Until the run
+        has ended only the begin-of-run ODB dump exists; the stop time it
+        lacks is then taken from the timestamp of the last data event.
+        'onerror' is handled as by binMdumpData.
+        '''
+        self.numchannels = int(maxtof / binwidth)
+        self.binwidth = binwidth
+        self.maxtof = maxtof
+
+        name = basename(self.filename[:-4])
+        evapath = path + name + '_eva.dat'
+        checkpath = path + name + '_checkpoint'
+        countspath = checkpath + '.counts'
+        settings = {'binwidth': binwidth, 'maxtof': maxtof,
+                    'onerror': onerror}
+        checkpoint = loadCheckpoint(checkpath, self.filename, settings,
+                                    {'eva': evapath, 'counts': countspath})
+
+        reader = MidasFile(self.filename)
+        ended = reader.hasEndOfRun()
+        binner = self.makeBinner(binwidth, maxtof, onerror)
+        if checkpoint is None:
+            offset = 0
+            numcycles = 0
+            evasize = 0
+            recordoffsets = np.zeros(0, dtype=np.int64)
+            errors = np.zeros(0, dtype=np.uint32)
+            words = [np.zeros(0, dtype=np.uint32)]
+            lasttimestamp = None
+            odb = None
+            stepdata = None
+        else:
+            arrays, metadata = checkpoint
+            offset = metadata['offset']
+            numcycles = metadata['numcycles']
+            evasize = metadata['sizes']['eva']
+            recordoffsets = arrays['offsets']
+            errors = arrays['errors']
+            words = [arrays['leftover']]
+            lasttimestamp = metadata['lasttimestamp']
+            odb = metadata['odb']
+            stepdata = arrays.get('stepdata')
+            binner.restore(metadata['binner'], arrays['pending'])
+
+        if ended or odb is None:
+            self.extractXML()
+            odb = {'domag': self.getOdbIndex(self.domag).dump(ODB_KEYS),
+                   'dom2ag': self.getOdbIndex(self.dom2ag).dump(ODB_KEYS)}
+        else:
+            self.domag = loadOdbIndex(odb['domag'])
+            self.dom2ag = loadOdbIndex(odb['dom2ag'])
+        self.readRunParameters()
+
+        for eventoffset, header, payload in reader.iterEvents(offset):
+            offset = eventoffset + EVENT_HEADER.size + header.datasize
+            if header.eventid & 0x8000:
+                continue
+            lasttimestamp = header.timestamp
+            for bankname, data in reader.iterBanks(payload, eventoffset):
+                if bankname == 'MPET':
+                    words.append(np.frombuffer(data, dtype='<u4',
+                                               count=len(data) // 4))
+        self.metrics.count('bytesread', reader.bytesread)
+
+        words = np.concatenate(words).astype(np.uint32)
+        table, errmask = decodeEvents(words)
+        # an event split over two banks is finished by the next call
+        leftover = words[2 * len(table):]
+        errors = np.concatenate((errors, words[0:2 * len(table):2][errmask]))
+        self.metrics.count('words', len(words))
+        self.metrics.count('events', len(table))
+
+        self.resetStepSpectra()
+        if self.stepdata is not None and stepdata is not None and \
+                stepdata.shape == self.stepdata.shape:
+            self.stepdata = stepdata.astype(np.int64)
+        elif self.stepdata is not None and numcycles:
+            # the scan is not the one folded so far, so fold again
+            counts = appendRows(countspath, np.zeros(
+                (0, self.numchannels), dtype=np.uint32), numcycles)
+            self.foldStepSpectra(counts, 0, [], onerror)
+
+        firstcycle = binner.cyclecounter
+        hist = binner.feed(table)
+        self.foldStepSpectra(hist, firstcycle, binner.defects, onerror)
+        hist = self.keepCycles(hist, firstcycle, binner.defects, onerror)
+        self.bindata = appendRows(countspath, hist, numcycles)
+        self.errarray = errors
+        self.setGateDefects(binner.defects)
+        self.countBinned(binner)
+
+        if not ended and lasttimestamp is not None and \
+                self.endtime <= self.starttime:
+            self.endtime = float(lasttimestamp)
+        evaheader = BytesIO()
+        self.writeEvaHeader(evaheader)
+        datastart, sizes = appendCycleRecords(evapath, evaheader.getvalue(),
+                                              hist, evasize)
+        recordoffsets = np.concatenate(
+            (recordoffsets, evasize + np.cumsum(sizes) - sizes))
+        evasize += int(sizes.sum())
+        if len(self.bindata):
+            setRecordTimestamps(evapath, datastart + recordoffsets,
+                                self.cycleTimestamps())
+        self.metrics.count('byteswritten', int(sizes.sum()))
+        if not ended:
+            print ('Run still open: ' + str(len(self.bindata)) +
+                   ' cycles so far.')
+
+        prefixsize, prefixdigest = checkpointKey(self.filename, offset)
+        metadata = dict(settings, offset=offset, prefixsize=prefixsize,
+                        prefixdigest=prefixdigest, ended=ended,
+                        numcycles=len(self.bindata),
+                        sizes={'eva': evasize,
+                               'counts': self.bindata.nbytes},
+                        lasttimestamp=lasttimestamp, odb=odb,
+                        binner=binner.state())
+        arrays = {'offsets': recordoffsets, 'pending': binner.pending,
+                  'errors': errors, 'leftover': leftover}
+        if self.stepdata is not None:
+            arrays['stepdata'] = self.stepdata
+        writeColumnar(checkpath, arrays, metadata)
+
+    def cycleTimestamps(self):
+        '''
+        cycleTimestamps() spreads the cycles evenly between the run start
+        and end times and returns the timestamp of each cycle.
+        '''
+        # Time that each frequncy point took
+        dtime = (self.endtime - self.starttime) / float(len(self.bindata))
+        return self.starttime + np.arange(len(self.bindata)) * dtime
+
+    @timedStage('writeColumnar')
+    def writeColumnar(self, path='/triumfcs/trshare/titan/MPET/Data/',
+                      npz=False, words=False):
+        '''
+        writeColumnar writes the binned data in a columnar form that NumPy
+        loads in one go (see columnar.loadColumnar): the cycles x channels
+        'counts' matrix, the 'frequencies' from genFreqList and the cycle
+        'timestamps', plus the run parameters as metadata. The per-step sums
+        from binning go in as 'stepcounts', 'stepions' and 'steptof'. With
+        'words' the raw MPET words are included too, instead of
+        writeMdumpData.
+
+        The export is a directory of memory-mappable .npy files named like
+        the run with '_bins', or with 'npz' a single compressed .npz file.
+        '''
+        name = basename(self.filename[:-4]) + '_bins'
+        if npz:
+            name += '.npz'
+        path = path + name
+
+        arrays = {'counts': compactCounts(self.bindata),
+                  'frequencies': np.array(self.genFreqList(),
+                                          dtype=np.float64),
+                  'timestamps': self.cycleTimestamps()}
+        if words:
+            arrays['words'] = self.mdumpdata
+        if getattr(self, 'stepdata', None) is not None:
+            arrays['stepcounts'] = compactCounts(self.stepdata)
+            arrays['stepions'] = self.stepions
+            arrays['steptof'] = self.steptof
+
+        metadata = dict((name, getattr(self, name))
+                        for name in RUN_PARAMETERS if hasattr(self, name))
+        metadata['filename'] = basename(self.filename)
+        metadata['numcycles'] = len(self.bindata)
+        if hasattr(self, 'badcycles'):
+            metadata['badcycles'] = [int(cycle) for cycle in self.badcycles]
+
+        writeColumnar(path, arrays, metadata)
+        self.metrics.count('byteswritten', sum(array.nbytes
+                                               for array in arrays.values()))
+
+    @timedStage('writePosData')
     def writePosData(self, path='/titan/data5/mpet/tmp/'):
+        '''
+        writePosData writes the x and y position of every MCP hit as a text
+        line 'x y' to a file named like the run with '_pos.dat'. Returns
+        the name of the file written, or None if there are no hits or the
+        file could not be opened.
+        '''
         if len(self.posdata) == 0:
             return
 
@@ -488,13 +1202,84 @@ class MidasToEva:
             print 'Could not open ' + path + ' for writing.'
             return
 
-        for num in self.posdata:
-            x = int(num[6:8], 16)
-            y = int(num[8:10], 16)
-            datafile.write(str(x) + ' ' + str(y) + '\n')
+        datafile.write(formatIntLines(decodePositions(self.posdata)))
 
+        self.metrics.count('byteswritten', datafile.tell())
         datafile.close()
+        return path
 
+    def positionImages(self, per='run'):
+        '''
+        positionImages(per) accumulates the MCP hits into 256 x 256 images,
+        indexed [image, y, x]: one image for the whole run, or with
+        per='cycle' or 'step' one per cycle or per frequency step (see
+        POSITION_IMAGE_MODES). Returns None if the positions cannot be
+        assigned to cycles.
+
+        Cycles are the rows of 'bindata' before any are dropped for bad
+        gates, and cycle k belongs to frequency step k % freqStepCount(),
+        as in 'stepdata'.
+        Hits after the last TDCClose are left out of the per-cycle and
+        per-step images.
+        '''
+        if per not in POSITION_IMAGE_MODES:
+            raise ValueError('per must be one of ' +
+                             ', '.join(POSITION_IMAGE_MODES))
+        x, y = decodePositions(self.posdata)
+        if per == 'run':
+            return accumulateImages(x, y)
+
+        if getattr(self, 'poscounts', None) is None:
+            print ('Positions cannot be assigned to cycles. '
+                   'Run collectMdumpData().')
+            return None
+        if getattr(self, 'eventfilter', None) is None:
+            types = self.mdumparray['type']
+        else:
+            # the positions are matched to the events before filtering
+            mdumpdata = self.mdumpdata[:len(self.mdumpdata) // 2 * 2]
+            types = eventTypes(mdumpdata[0::2])[0]
+        closeidx = np.flatnonzero(types == EVENT_CLOSE)
+        groups = positionCycles(self.poscounts, self.wordcounts, closeidx)
+        numgroups = len(closeidx)
+        if per == 'step':
+            numgroups = self.freqStepCount()
+            if numgroups is None:
+                print 'Frequency steps unknown. Read the run parameters.'
+                return None
+            groups = np.where(groups < len(closeidx), groups % numgroups, -1)
+        return accumulateImages(x, y, groups, numgroups)
+
+    @timedStage('writePosImage')
+    def writePosImage(self, path='/titan/data5/mpet/tmp/', per='run',
+                      npz=False):
+        '''
+        writePosImage writes the MCP hit images from positionImages(per) as
+        an 'image' count array with columnar.writeColumnar, named like the
+        run with '_posimage': a directory of .npy files, or with 'npz' a
+        single .npz file. Use writePosData for the hits as text.
+        '''
+        if len(self.posdata) == 0:
+            return
+
+        images = self.positionImages(per)
+        if images is None:
+            return
+
+        name = basename(self.filename[:-4]) + '_posimage'
+        if npz:
+            name += '.npz'
+        arrays = {'image': compactCounts(images)}
+        metadata = {'filename': basename(self.filename), 'per': per,
+                    'numhits': len(self.posdata)}
+        if per == 'step':
+            arrays['frequencies'] = np.array(self.genFreqList(),
+                                             dtype=np.float64)
+        writeColumnar(path + name, arrays, metadata)
+        self.metrics.count('byteswritten', sum(array.nbytes
+                                               for array in arrays.values()))
+
+    @timedStage('writeMdumpData')
     def writeMdumpData(self, path='/triumfcs/trshare/titan/MPET/Data/'):
         dumpfilename = self.filename[:-4] + '_dump.dat'
         path = path + basename(dumpfilename)
@@ -505,10 +1290,12 @@ class MidasToEva:
             print 'Could not open ' + path + ' for writing.'
             return
         for entry in self.mdumpdata:
-            datafile.write(str(entry) + '\n')
+            datafile.write('0x%08x\n' % entry)
 
+        self.metrics.count('byteswritten', datafile.tell())
         datafile.close()
 
+    @timedStage('writeErrorData')
     def writeErrorData(self, path='/triumfcs/trshare/titan/MPET/Data/'):
         if len(self.errarray) == 0:
             return
@@ -523,8 +1310,9 @@ class MidasToEva:
                 print 'Could not open ' + path + ' for writing.'
                 return
             for entry in self.errarray:
-                datafile.write(str(entry) + '\n')
+                datafile.write('0x%08x\n' % entry)
 
+            self.metrics.count('byteswritten', datafile.tell())
             datafile.close()
 
     def genFreqList(self):
@@ -543,11 +1331,8 @@ class MidasToEva:
         try:
             fl = self.getAttribute(self.dom2ag, './dir/dir', 'Variables',
                                    'Quad FreqList')
-            print fl
             fl = fl.split(';')
-            print fl
             fl = [ast.literal_eval(x.strip()) for x in fl]
-            print fl
             for x in fl:
                 df = 2. * float(x[1]) / (float(x[2]) - 1.)
                 for i in range(int(x[2])):
@@ -558,5 +1343,13 @@ class MidasToEva:
             for i in range(int(self.numfreqsteps)):
                 FreqList.append(float(self.startfreq) + i * dfreq)
 
-        print FreqList
         return FreqList
+
+    def recordParameters(self):
+        '''
+        recordParameters() adds the run parameters that have been read so
+        far to the metrics record of the run.
+        '''
+        self.metrics.info['parameters'] = dict(
+            (name, getattr(self, name))
+            for name in RUN_PARAMETERS if hasattr(self, name))
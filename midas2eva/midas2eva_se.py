@@ -2,9 +2,13 @@
 #sys.path.append("/home/mpet/rr/midastoeva/")
 
 from os.path import basename
-from collections import Counter
+import numpy as np
 #from MidasToEva7 import MidasToEva
 from midas2eva import MidasToEva
+from textout import formatIntLines
+
+# Cycles formatted into one write by sda_write
+SDA_CHUNK_CYCLES = 4096
 
 
 class SDA(MidasToEva):
@@ -18,27 +22,48 @@ class SDA(MidasToEva):
     def __init__(self, filename):
         MidasToEva.__init__(self, filename)
 
-    def sda_write(self, path='/triumfcs/trshare/titan/MPET/Data/'):
+    def sda_write(self, path='/triumfcs/trshare/titan/MPET/Data/',
+                  binary=False):
         '''
         sda_write writes the tof data to a file that can be read by stephan's
         simplified1Danalyis script.
+
+        The file has a 'data:<startfreq>' line and then a 'cycle channel
+        count' line for every nonzero bin, in cycle and channel order. The
+        lines are formatted a block of SDA_CHUNK_CYCLES cycles at a time.
+
+        With 'binary' set an .npz file is written instead, holding
+        'startfreq' and the 'cycle', 'channel' and 'count' arrays of the
+        nonzero bins, for np.load.
         '''
-        evafilename = self.filename[:-4] + '_se_test.dat'
+        if binary:
+            evafilename = self.filename[:-4] + '_se_test.npz'
+        else:
+            evafilename = self.filename[:-4] + '_se_test.dat'
         path2 = path + basename(evafilename)
 
         try:
-            datafile2 = open(path2, 'w')
+            datafile2 = open(path2, 'wb' if binary else 'w')
         except IOError:
             print 'Could not open ' + path2 + ' for writing.'
             return
 
+        if binary:
+            cycles, channels = np.nonzero(self.bindata)
+            np.savez(datafile2, startfreq=self.startfreq,
+                     cycle=cycles.astype(np.uint32),
+                     channel=channels.astype(np.uint32),
+                     count=self.bindata[cycles, channels])
+            datafile2.close()
+            return
+
         datafile2.write('data:' + str(self.startfreq) + '\n')
 
-        for i in xrange(len(self.bindata)):
-            hist = Counter(self.bindata[i])
-            for j in hist:
-                    datafile2.write(str(i) + ' ' + str(j) +
-                                    ' ' + str(hist[j]) + '\n')
+        for start in xrange(0, len(self.bindata), SDA_CHUNK_CYCLES):
+            hist = self.bindata[start:start + SDA_CHUNK_CYCLES]
+            cycles, channels = np.nonzero(hist)
+            datafile2.write(formatIntLines([cycles + start, channels,
+                                            hist[cycles, channels]]))
         datafile2.close()
 
     def getbindata(self):
@@ -0,0 +1,337 @@
+import mmap
+from struct import Struct
+from collections import namedtuple
+
+import numpy as np
+
+# MIDAS event ids for the special (non-data) events. The begin- and
+# end-of-run events carry the ODB dumps as their payload.
+EVENTID_BOR = 0x8000
+EVENTID_EOR = 0x8001
+EVENTID_MESSAGE = 0x8002
+# Trigger mask of the begin- and end-of-run events ('MI')
+MIDAS_MAGIC = 0x494d
+
+# Bank header flags
+BANK_FORMAT_32BIT = 1 << 4
+BANK_FORMAT_64BIT_ALIGNED = 1 << 5
+
+EVENT_HEADER = Struct('<HHIII')
+BANK_HEADER = Struct('<II')
+BANK16 = Struct('<4sHH')
+BANK32 = Struct('<4sII')
+BANK32A = Struct('<4sIII')
+
+# Bytes read from each end of the file when looking for the ODB dumps
+ODB_WINDOW = 1 << 22
+
+EventHeader = namedtuple('EventHeader', ['eventid', 'triggermask',
+                                         'serial', 'timestamp',
+                                         'datasize'])
+
+
+def sliceOdb(data, start, end):
+    '''
+    sliceOdb(data, start, end) cuts an ODB dump out of 'data' given the
+    positions of its '<odb' and '</odb>' tags, or returns '' if either is
+    missing.
+    '''
+    if start < 0 or end < 0:
+        return ''
+    return data[start:end + 6]
+
+
+class MidasFileError(Exception):
+    def __init__(self, filename, offset, reason):
+        self.filename = filename
+        self.offset = offset
+        self.reason = reason
+
+    def __str__(self):
+        return ("Corrupt MIDAS event in " + self.filename + " at byte "
+                + str(self.offset) + ": " + self.reason)
+
+
+class MidasFile:
+    '''
+    MidasFile reads MIDAS events and banks straight from a .mid file,
+    without going through the mdump program.
+
+    Bank payloads are returned as arrays of unsigned 32-bit words, the same
+    words that 'mdump -x' prints in hex.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        # bytes read from the file so far, for the run metrics
+        self.bytesread = 0
+
+    def readOdbDumps(self, window=ODB_WINDOW):
+        '''
+        readOdbDumps(window) returns the XML text of the first and the last
+        ODB dump in the file, i.e. the begin- and end-of-run dumps. If the
+        run has only one dump both are the same.
+
+        The first dump is searched for in the first 'window' bytes and the
+        last one in the last 'window' bytes. Only if a dump is not found
+        there is the whole file scanned, through an mmap. A missing dump
+        gives an empty string. A dump cut off by the end of the file, like
+        the end-of-run dump of a run that is still being written, is
+        skipped for the last complete one.
+        '''
+        datafile = open(self.filename, 'rb')
+        try:
+            datafile.seek(0, 2)
+            size = datafile.tell()
+
+            datafile.seek(0)
+            head = datafile.read(min(window, size))
+            start = head.find('<odb')
+            end = head.find('</odb>')
+            if start >= 0 and end >= 0:
+                first = head[start:end + 6]
+            else:
+                first = None
+
+            datafile.seek(max(size - window, 0))
+            tail = datafile.read()
+            self.bytesread += len(head) + len(tail)
+            end = tail.rfind('</odb>')
+            start = tail.rfind('<odb', 0, end) if end >= 0 else -1
+            if start >= 0 and end >= 0:
+                last = tail[start:end + 6]
+            else:
+                last = None
+
+            if (first is None or last is None) and size > 0:
+                data = mmap.mmap(datafile.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+                try:
+                    if first is None:
+                        first = sliceOdb(data, data.find('<odb'),
+                                         data.find('</odb>'))
+                    if last is None:
+                        end = data.rfind('</odb>')
+                        last = sliceOdb(data, data.rfind('<odb', 0, end)
+                                        if end >= 0 else -1, end)
+                finally:
+                    data.close()
+        finally:
+            datafile.close()
+        return first or '', last or ''
+
+    def hasEndOfRun(self, window=ODB_WINDOW):
+        '''
+        hasEndOfRun(window) tells whether the file ends with a complete
+        end-of-run event, i.e. the run has stopped and the closing ODB dump
+        has been written. Only the last 'window' bytes are read.
+        '''
+        signature = EVENT_HEADER.pack(EVENTID_EOR, MIDAS_MAGIC, 0, 0, 0)[:4]
+        datafile = open(self.filename, 'rb')
+        try:
+            datafile.seek(0, 2)
+            size = datafile.tell()
+            tailstart = max(size - window, 0)
+            datafile.seek(tailstart)
+            tail = datafile.read()
+        finally:
+            datafile.close()
+        self.bytesread += len(tail)
+
+        position = tail.rfind(signature)
+        while position >= 0:
+            if position + EVENT_HEADER.size <= len(tail):
+                header = EventHeader(*EVENT_HEADER.unpack_from(tail,
+                                                               position))
+                if (tailstart + position + EVENT_HEADER.size +
+                        header.datasize == size):
+                    return True
+            position = tail.rfind(signature, 0, position)
+        return False
+
+    def iterEvents(self, start=0, end=None, stride=1):
+        '''
+        iterEvents(start, end, stride) yields (offset, header, payload) for
+        each event in the file, beginning at byte offset 'start' and
+        stopping before the event at byte offset 'end', if given. With
+        'stride' above 1 only the payload of every stride-th event is read,
+        starting with the first; the others are skipped over and yielded
+        with a payload of None.
+
+        An event that is cut short at the end of the file (i.e. a file that
+        is still being written) ends the iteration.
+        '''
+        datafile = open(self.filename, 'rb')
+        try:
+            datafile.seek(start)
+            offset = start
+            count = 0
+            while end is None or offset < end:
+                rawheader = datafile.read(EVENT_HEADER.size)
+                if len(rawheader) < EVENT_HEADER.size:
+                    return
+                header = EventHeader(*EVENT_HEADER.unpack(rawheader))
+                self.bytesread += len(rawheader)
+                if count % stride:
+                    datafile.seek(header.datasize, 1)
+                    yield offset, header, None
+                else:
+                    payload = datafile.read(header.datasize)
+                    self.bytesread += len(payload)
+                    if len(payload) < header.datasize:
+                        return
+                    yield offset, header, payload
+                count += 1
+                offset += EVENT_HEADER.size + header.datasize
+        finally:
+            datafile.close()
+
+    def iterBankSizes(self, names=('MPET',), start=0):
+        '''
+        iterBankSizes(names, start) yields (offset, numwords) for every data
+        event from byte offset 'start' on: the offset of the event and the
+        number of 32-bit words in its banks in 'names'.
+
+        Only the event and bank headers are read, the bank data is skipped.
+        '''
+        wanted = set(name.encode('ascii') for name in names)
+        datafile = open(self.filename, 'rb')
+        try:
+            datafile.seek(0, 2)
+            size = datafile.tell()
+            offset = start
+            while offset + EVENT_HEADER.size <= size:
+                datafile.seek(offset)
+                header = EventHeader(*EVENT_HEADER.unpack(
+                    datafile.read(EVENT_HEADER.size)))
+                payloadstart = offset + EVENT_HEADER.size
+                payloadend = payloadstart + header.datasize
+                if payloadend > size:
+                    return
+                self.bytesread += EVENT_HEADER.size
+                if header.eventid & 0x8000:
+                    offset = payloadend
+                    continue
+
+                numwords = 0
+                rawheader = datafile.read(BANK_HEADER.size)
+                self.bytesread += len(rawheader)
+                if len(rawheader) == BANK_HEADER.size:
+                    allbanksize, flags = BANK_HEADER.unpack(rawheader)
+                    if flags & BANK_FORMAT_64BIT_ALIGNED:
+                        bank = BANK32A
+                    elif flags & BANK_FORMAT_32BIT:
+                        bank = BANK32
+                    else:
+                        bank = BANK16
+                    end = payloadstart + BANK_HEADER.size + allbanksize
+                    if end > payloadend:
+                        raise MidasFileError(self.filename, offset,
+                                             'bank area larger than event')
+                    position = payloadstart + BANK_HEADER.size
+                    while position + bank.size <= end:
+                        datafile.seek(position)
+                        fields = bank.unpack(datafile.read(bank.size))
+                        self.bytesread += bank.size
+                        name, datasize = fields[0], fields[2]
+                        datastart = position + bank.size
+                        if datastart + datasize > end:
+                            raise MidasFileError(self.filename, offset,
+                                                 'bank ' + repr(name) +
+                                                 ' overruns its event')
+                        if name in wanted:
+                            numwords += datasize // 4
+                        position = datastart + ((datasize + 7) & ~7)
+                yield offset, numwords
+                offset = payloadend
+        finally:
+            datafile.close()
+
+    def iterBanks(self, payload, offset=0):
+        '''
+        iterBanks(payload) yields (name, data) for each bank in the payload
+        of a data event. 'data' is a buffer slice of the payload; 'offset'
+        is only used for error reporting.
+        '''
+        if len(payload) < BANK_HEADER.size:
+            return
+        allbanksize, flags = BANK_HEADER.unpack_from(payload)
+        if flags & BANK_FORMAT_64BIT_ALIGNED:
+            bank = BANK32A
+        elif flags & BANK_FORMAT_32BIT:
+            bank = BANK32
+        else:
+            bank = BANK16
+
+        end = BANK_HEADER.size + allbanksize
+        if end > len(payload):
+            raise MidasFileError(self.filename, offset,
+                                 'bank area larger than event')
+
+        position = BANK_HEADER.size
+        while position + bank.size <= end:
+            fields = bank.unpack_from(payload, position)
+            name, datasize = fields[0], fields[2]
+            datastart = position + bank.size
+            if datastart + datasize > end:
+                raise MidasFileError(self.filename, offset,
+                                     'bank ' + repr(name) +
+                                     ' overruns its event')
+            yield name, payload[datastart:datastart + datasize]
+            # banks are padded to 8 byte boundaries
+            position = datastart + ((datasize + 7) & ~7)
+
+    def iterBankWords(self, names=('MPET', 'MCPP'), start=0, end=None):
+        '''
+        iterBankWords(names, start, end) yields (name, words) for every bank
+        in 'names' in the data events between byte offsets 'start' and
+        'end', in file order. 'words' is a uint32 array view of the bank
+        payload.
+        '''
+        wanted = set(name.encode('ascii') for name in names)
+        for offset, header, payload in self.iterEvents(start, end):
+            if header.eventid & 0x8000:
+                # begin/end of run and message events carry no banks
+                continue
+            for name, data in self.iterBanks(payload, offset):
+                if name in wanted:
+                    yield name.decode('ascii'), np.frombuffer(
+                        data, dtype='<u4', count=len(data) // 4)
+
+    def readBanks(self, names=('MPET', 'MCPP')):
+        '''
+        readBanks(names) collects the payloads of every bank in 'names' from
+        all data events, in file order. Returns a dict mapping each bank name
+        to a uint32 array of its words.
+        '''
+        return self.readEventBanks(names)[0]
+
+    def readEventBanks(self, names=('MPET', 'MCPP')):
+        '''
+        readEventBanks(names) works like readBanks but also returns how the
+        words are spread over the data events: (banks, counts) where
+        counts[name] holds the number of words of 'name' in each data event.
+        '''
+        chunks = dict((name, []) for name in names)
+        counts = dict((name, []) for name in names)
+        for offset, header, payload in self.iterEvents():
+            if header.eventid & 0x8000:
+                continue
+            for name in names:
+                counts[name].append(0)
+            for name, data in self.iterBanks(payload, offset):
+                name = name.decode('ascii')
+                if name in chunks:
+                    words = np.frombuffer(data, dtype='<u4',
+                                          count=len(data) // 4)
+                    chunks[name].append(words)
+                    counts[name][-1] += len(words)
+
+        banks = {}
+        for name in names:
+            if chunks[name]:
+                banks[name] = np.concatenate(chunks[name]).astype(np.uint32)
+            else:
+                banks[name] = np.zeros(0, dtype=np.uint32)
+            counts[name] = np.array(counts[name], dtype=np.int64)
+        return banks, counts
@@ -0,0 +1,276 @@
+from fnmatch import fnmatchcase
+from cStringIO import StringIO
+import xml.etree.cElementTree as ET
+
+# How the text of each ODB key type is turned into a value
+ODB_TYPES = {'BYTE': int, 'SBYTE': int, 'CHAR': str,
+             'WORD': int, 'SHORT': int, 'DWORD': int, 'INT': int,
+             'UINT8': int, 'INT8': int, 'UINT16': int, 'INT16': int,
+             'UINT32': int, 'INT32': int, 'UINT64': int, 'INT64': int,
+             'FLOAT': float, 'DOUBLE': float,
+             'BOOL': lambda text: text.strip().lower() in ('y', '1', 'true'),
+             'STRING': str, 'LINK': str}
+
+
+def castOdbValue(odbtype, text):
+    '''
+    castOdbValue(odbtype, text) converts the text of an ODB key of type
+    'odbtype' into a python value. Unknown types and values that do not
+    parse are returned as the text itself.
+    '''
+    text = text or ''
+    try:
+        return ODB_TYPES.get(odbtype, str)(text)
+    except ValueError:
+        return text
+
+
+def matchPath(pattern, path):
+    '''
+    matchPath(pattern, path) matches an ODB path against a glob pattern one
+    path component at a time, so '*' never matches across a '/'.
+
+    Example:
+        matchPath('/*/*/*/transition_QUAD*/time offset (ms)', path)
+    '''
+    patternparts = pattern.strip('/').split('/')
+    pathparts = path.strip('/').split('/')
+    if len(patternparts) != len(pathparts):
+        return False
+    for patternpart, pathpart in zip(patternparts, pathparts):
+        if not fnmatchcase(pathpart, patternpart):
+            return False
+    return True
+
+
+class OdbIndex:
+    '''
+    OdbIndex flattens an ODB dump into dicts keyed by the full ODB path of
+    each key, e.g. '/Experiment/Variables/StartFreq (MHz)'.
+
+    'values' holds the typed value of every key (a list for key arrays) and
+    'texts' the raw text of every single-valued key. Keys are also indexed
+    the way getAttribute addresses them: by the depth and name of their
+    directory and the key name.
+    '''
+
+    def __init__(self, xml=None):
+        self.values = {}
+        self.texts = {}
+        self.types = {}
+        self.arraytexts = {}
+        self.paths = []
+        self.dirs = {}
+        if xml is not None:
+            self.addTree(xml)
+
+    def addTree(self, xml):
+        '''
+        addTree(xml) adds every key below the <odb> element 'xml'.
+        '''
+        stack = [(xml, '')]
+        while stack:
+            element, path = stack.pop()
+            if path:
+                self.addDir(path)
+            subdirs = []
+            for child in element:
+                name = child.get('name')
+                if child.tag == 'dir':
+                    subdirs.append((child, path + '/' + name))
+                elif child.tag == 'key':
+                    self.addKey(path, name, child.get('type'), child.text)
+                elif child.tag == 'keyarray':
+                    self.addKeyArray(path, name, child.get('type'),
+                                     [value.text for value in child])
+            # push in reverse so the tree is walked in document order
+            stack.extend(reversed(subdirs))
+
+    def addDir(self, dirpath):
+        parts = dirpath.strip('/').split('/')
+        # the first directory of a given name and depth wins, like find()
+        self.dirs.setdefault((len(parts), parts[-1]), dirpath)
+
+    def addKey(self, dirpath, name, odbtype, text):
+        path = dirpath + '/' + name
+        if path in self.values:
+            return
+        if dirpath:
+            self.addDir(dirpath)
+        self.paths.append(path)
+        self.types[path] = odbtype
+        self.texts[path] = text
+        self.values[path] = castOdbValue(odbtype, text)
+
+    def addKeyArray(self, dirpath, name, odbtype, texts):
+        path = dirpath + '/' + name
+        if path in self.values:
+            return
+        if dirpath:
+            self.addDir(dirpath)
+        self.paths.append(path)
+        self.types[path] = odbtype
+        self.arraytexts[path] = list(texts)
+        self.values[path] = [castOdbValue(odbtype, text) for text in texts]
+
+    def __contains__(self, path):
+        return path in self.values
+
+    def __getitem__(self, path):
+        return self.values[path]
+
+    def __len__(self):
+        return len(self.paths)
+
+    def get(self, path, default=None):
+        return self.values.get(path, default)
+
+    def keys(self, pattern=None):
+        '''
+        keys(pattern) lists the paths of all keys that match the glob
+        'pattern' (see matchPath), or all keys if 'pattern' is None. Keys
+        are listed in dump order, directory by directory.
+        '''
+        if pattern is None:
+            return list(self.paths)
+        return [path for path in self.paths if matchPath(pattern, path)]
+
+    def dump(self, patterns=None):
+        '''
+        dump(patterns) lists (path, type, text) for every key, or for the
+        keys matching any of the glob 'patterns'. Key arrays have a list of
+        texts. The list can be stored (e.g. as JSON) and turned back into an
+        index with loadOdbIndex.
+        '''
+        entries = []
+        for path in self.paths:
+            if patterns is not None and not any(matchPath(pattern, path)
+                                                for pattern in patterns):
+                continue
+            if path in self.texts:
+                entries.append((path, self.types[path], self.texts[path]))
+            else:
+                entries.append((path, self.types[path],
+                                self.arraytexts[path]))
+        return entries
+
+    def find(self, depth, dirname, keyname):
+        '''
+        find(depth, dirname, keyname) returns the path of 'keyname' in the
+        first directory called 'dirname' that is 'depth' levels below the
+        root, or None. This is the key getAttribute reads with
+        dirpath = './dir' * depth.
+        '''
+        dirpath = self.dirs.get((depth, dirname))
+        if dirpath is None:
+            return None
+        path = dirpath + '/' + keyname
+        if path not in self.texts:
+            return None
+        return path
+
+
+def loadOdbIndex(entries):
+    '''
+    loadOdbIndex(entries) rebuilds an OdbIndex from the output of
+    OdbIndex.dump.
+    '''
+    index = OdbIndex()
+    for path, odbtype, text in entries:
+        dirpath, name = path.rsplit('/', 1)
+        if isinstance(text, list):
+            index.addKeyArray(dirpath, name, odbtype, text)
+        else:
+            index.addKey(dirpath, name, odbtype, text)
+    return index
+
+
+def hasWildcard(part):
+    return any(char in part for char in '*?[')
+
+
+class OdbPattern:
+    '''
+    OdbPattern tracks one requested path pattern while parseOdb streams an
+    ODB dump, and decides when no more matches can follow.
+
+    A pattern with a plain directory and key name is done at its first
+    match (the key getAttribute would read). A wildcard key name waits
+    until the matched directory closes, and a wildcard directory name
+    until the parent of the matched directory closes.
+    '''
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        parts = pattern.strip('/').split('/')
+        if hasWildcard(parts[-2] if len(parts) > 1 else ''):
+            self.closedepth = len(parts) - 2
+        elif hasWildcard(parts[-1]):
+            self.closedepth = len(parts) - 1
+        else:
+            self.closedepth = None
+        self.matched = False
+        self.done = False
+
+    def match(self, path):
+        if self.done or not matchPath(self.pattern, path):
+            return False
+        self.matched = True
+        if self.closedepth is None:
+            self.done = True
+        return True
+
+    def closeDir(self, depth):
+        '''
+        closeDir(depth) tells the pattern that a directory 'depth' levels
+        below the root (1 for a top-level directory) has closed.
+        '''
+        if self.matched and depth <= self.closedepth:
+            self.done = True
+
+
+def parseOdb(xmltext, patterns):
+    '''
+    parseOdb(xmltext, patterns) streams an ODB dump with iterparse and
+    returns an OdbIndex holding only the keys that match one of the glob
+    'patterns' (see matchPath). No element tree is built, and parsing stops
+    as soon as every pattern is done (see OdbPattern).
+
+    Example:
+        parseOdb(xml, ['/*/Variables/*', '/Runinfo/Start time binary'])
+    '''
+    index = OdbIndex()
+    pending = [OdbPattern(pattern) for pattern in patterns]
+    dirs = []
+    for event, element in ET.iterparse(StringIO(xmltext),
+                                       events=('start', 'end')):
+        if event == 'start':
+            if element.tag == 'dir':
+                dirs.append(element.get('name'))
+            continue
+
+        if element.tag == 'dir':
+            for pattern in pending:
+                pattern.closeDir(len(dirs))
+            dirs.pop()
+        elif element.tag in ('key', 'keyarray'):
+            dirpath = '/' + '/'.join(dirs) if dirs else ''
+            name = element.get('name')
+            # every pattern gets to see the key, so none of them miss it
+            matches = [pattern.match(dirpath + '/' + name)
+                       for pattern in pending]
+            if any(matches) and element.tag == 'key':
+                index.addKey(dirpath, name, element.get('type'),
+                             element.text)
+            elif any(matches):
+                index.addKeyArray(dirpath, name, element.get('type'),
+                                  [value.text for value in element])
+        else:
+            # <value> elements are read with their keyarray
+            continue
+
+        element.clear()
+        pending = [pattern for pattern in pending if not pattern.done]
+        if not pending:
+            break
+    return index
@@ -0,0 +1,158 @@
+from multiprocessing import Pool
+
+import numpy as np
+
+from midasfile import MidasFile
+from events import decodeEvents, EVENT_OPEN
+from binning import (histogramCycles, gateCounters, firstGateError,
+                     findGateDefects, ionMask)
+
+# Chunks per worker process, so a slow chunk does not hold up the pool
+CHUNKS_PER_JOB = 4
+
+
+def splitRun(filename, numchunks, names=('MPET',)):
+    '''
+    splitRun(filename, numchunks, names) splits a MIDAS file at event
+    boundaries into about 'numchunks' byte ranges holding similar numbers
+    of words of the 'names' banks. Returns a list of (start, end) offsets;
+    the last chunk ends at None, i.e. the end of the file.
+
+    An MPET event (a pair of words) may be split over two MIDAS events, so
+    a chunk only ever starts after an even number of words.
+    '''
+    sizes = list(MidasFile(filename).iterBankSizes(names))
+    totalwords = sum(numwords for offset, numwords in sizes)
+    if not sizes or numchunks <= 1 or totalwords == 0:
+        return [(0, None)]
+
+    chunkwords = totalwords / float(numchunks)
+    starts = [0]
+    words = 0
+    for offset, numwords in sizes:
+        if (words >= len(starts) * chunkwords and words % 2 == 0
+                and offset > starts[-1]):
+            starts.append(offset)
+        words += numwords
+    return zip(starts, starts[1:] + [None])
+
+
+def binChunk(args):
+    '''
+    binChunk(args) decodes and bins the MPET banks in one chunk of a MIDAS
+    file for binRunParallel; 'args' is (filename, start, end, numchannels,
+    binwidth, maxtof).
+
+    Returns a dict with the histogramCycles matrix of the chunk, the gate
+    counters of its closes (from gateCounters, -1 for a close whose open is
+    in an earlier chunk), the counter of its last TDCOpen (-1 for none),
+    the first word of every error event, and counts for the run metrics.
+    '''
+    filename, start, end, numchannels, binwidth, maxtof = args
+    reader = MidasFile(filename)
+    words = [words for name, words
+             in reader.iterBankWords(('MPET',), start, end)]
+    if words:
+        words = np.concatenate(words)
+    else:
+        words = np.zeros(0, dtype=np.uint32)
+
+    table, errmask = decodeEvents(words)
+    hist = histogramCycles(table, numchannels, binwidth, maxtof)
+    startcounters, endcounters = gateCounters(table)
+    opencounters = table['cycle'][table['type'] == EVENT_OPEN]
+    return {'hist': hist,
+            'startcounters': startcounters,
+            'endcounters': endcounters,
+            'lastopen': int(opencounters[-1]) if len(opencounters) else -1,
+            'errors': words[0:2 * len(table):2][errmask],
+            'bytesread': reader.bytesread,
+            'words': len(words),
+            'events': len(table),
+            'ions': int(np.count_nonzero(ionMask(table['type']))),
+            'ionsbinned': int(hist.sum())}
+
+
+def mergeChunks(chunks):
+    '''
+    mergeChunks(chunks) joins the binChunk results of consecutive chunks.
+
+    The ions of the cycle still open at the end of a chunk are added to the
+    first row of the next one, and every close whose TDCOpen is in an
+    earlier chunk gets the counter of that open, exactly as CycleBinner
+    carries them from one piece to the next. Returns (hist, startcounters,
+    endcounters); the ions after the last TDCClose are dropped.
+    '''
+    hists = []
+    starts = []
+    pending = None
+    lastopen = -1
+    for chunk in chunks:
+        hist = chunk['hist']
+        if pending is not None:
+            hist[0] += pending
+        pending = hist[-1]
+        hists.append(hist[:-1])
+
+        startcounters = chunk['startcounters']
+        starts.append(np.where(startcounters < 0, lastopen, startcounters))
+        if chunk['lastopen'] >= 0:
+            lastopen = chunk['lastopen']
+
+    numchannels = chunks[0]['hist'].shape[1]
+    hist = np.concatenate(hists or [np.zeros((0, numchannels),
+                                             dtype=np.uint32)])
+    ends = [chunk['endcounters'] for chunk in chunks]
+    return hist, np.concatenate(starts), np.concatenate(ends)
+
+
+def binRunParallel(filename, numchannels, binwidth, maxtof, checkgates,
+                   jobs, numchunks=None):
+    '''
+    binRunParallel(filename, numchannels, binwidth, maxtof, checkgates,
+    jobs, numchunks) bins the MPET banks of a whole run with 'jobs' worker
+    processes. The file is cut with splitRun into 'numchunks' chunks
+    (CHUNKS_PER_JOB per job by default), each chunk is decoded and binned
+    by binChunk and the results are joined by mergeChunks.
+
+    The gates of the whole run are checked after the merge, so the first
+    bad gate is passed to checkgates(startcounter, endcounter, cyclecounter)
+    just as CycleBinner would, across chunk seams and counter wraparounds.
+    If 'checkgates' is None all bad gates are listed instead.
+
+    Returns (hist, errors, defects, counts): the cycles x numchannels count
+    matrix, the first words of the error events, the list of bad gates
+    (see findGateDefects) and a dict of counts for the run metrics.
+    '''
+    if numchunks is None:
+        numchunks = jobs * CHUNKS_PER_JOB
+    tasks = [(filename, start, end, numchannels, binwidth, maxtof)
+             for start, end in splitRun(filename, numchunks)]
+
+    if jobs <= 1 or len(tasks) == 1:
+        chunks = [binChunk(task) for task in tasks]
+    else:
+        pool = Pool(processes=min(jobs, len(tasks)))
+        try:
+            chunks = pool.map(binChunk, tasks)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    hist, startcounters, endcounters = mergeChunks(chunks)
+    defects = []
+    if checkgates is None:
+        defects = findGateDefects(startcounters, endcounters)
+    else:
+        cycle = firstGateError(startcounters, endcounters)
+        if cycle is not None:
+            checkgates(startcounters[cycle], endcounters[cycle], cycle)
+
+    counts = {}
+    for key in ('bytesread', 'words', 'events', 'ions', 'ionsbinned'):
+        counts[key] = sum(chunk[key] for chunk in chunks)
+    errors = np.concatenate([chunk['errors'] for chunk in chunks])
+    return hist, errors, defects, counts
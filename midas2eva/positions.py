@@ -0,0 +1,50 @@
+import numpy as np
+
+# The MCP delay line readout gives 8 bits for each coordinate
+IMAGE_SIZE = 256
+
+
+def decodePositions(words):
+    '''
+    decodePositions(words) splits raw MCPP bank words into the x position
+    (bits 8-15) and the y position (bits 0-7) of each hit. Returns (x, y)
+    as uint8 arrays.
+    '''
+    words = np.asarray(words, dtype=np.uint32)
+    x = ((words >> 8) & 0xff).astype(np.uint8)
+    y = (words & 0xff).astype(np.uint8)
+    return x, y
+
+
+def positionCycles(poscounts, wordcounts, closeidx):
+    '''
+    positionCycles(poscounts, wordcounts, closeidx) assigns each MCPP word
+    to a cycle. 'poscounts' and 'wordcounts' hold the number of MCPP and
+    MPET words in each MIDAS event (see MidasFile.readEventBanks) and
+    'closeidx' the rows of the TDCClose events in the event table.
+
+    The MCPP words carry no cycle counter, so all words of a MIDAS event go
+    to the cycle of the last MPET event read with them: the cycle its
+    TDCClose ends, or the next one if the gate is still open. Returns the
+    cycle row of each word, counted from 0 like the rows of 'bindata'.
+    '''
+    lastevent = np.cumsum(np.asarray(wordcounts, dtype=np.int64)) // 2 - 1
+    rows = np.searchsorted(closeidx, lastevent)
+    return np.repeat(rows, poscounts)
+
+
+def accumulateImages(x, y, groups=None, numgroups=1):
+    '''
+    accumulateImages(x, y, groups, numgroups) counts the hits at (x, y)
+    into 'numgroups' IMAGE_SIZE x IMAGE_SIZE images, indexed [group, y, x].
+    'groups' gives the image of each hit (all go to image 0 without it);
+    hits whose group is outside 0..numgroups-1 are dropped.
+    '''
+    pixels = (np.asarray(y, dtype=np.int64) * IMAGE_SIZE
+              + np.asarray(x, dtype=np.int64))
+    if groups is not None:
+        groups = np.asarray(groups, dtype=np.int64)
+        keep = (groups >= 0) & (groups < numgroups)
+        pixels = groups[keep] * IMAGE_SIZE ** 2 + pixels[keep]
+    hist = np.bincount(pixels, minlength=numgroups * IMAGE_SIZE ** 2)
+    return hist.astype(np.uint32).reshape(numgroups, IMAGE_SIZE, IMAGE_SIZE)
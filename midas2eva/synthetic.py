@@ -0,0 +1,172 @@
+from struct import pack
+
+import numpy as np
+
+from midasfile import (EVENTID_BOR, EVENTID_EOR, MIDAS_MAGIC,
+                       BANK_FORMAT_32BIT)
+from events import EVENT_OPEN, EVENT_CLOSE, EVENT_OUTOFGATE, TOF_TICK
+
+# MIDAS bank type of the MPET and MCPP banks
+TID_DWORD = 6
+# Event type of an ion inside the TDC gate
+EVENT_ION = 2
+
+ODB_TEMPLATE = '''<?xml version="1.0" encoding="ISO-8859-1"?>
+<odb root="/" filename="synthetic.xml">
+<dir name="Experiment">
+  <key name="Name" type="STRING" size="32">mpet</key>
+  <dir name="Variables">
+    <key name="Species" type="STRING" size="32">%(species)s</key>
+    <key name="Charge" type="STRING" size="32">%(charge)d</key>
+    <key name="MPETRFAmp" type="DOUBLE">%(amplitude)r</key>
+    <key name="StartFreq (MHz)" type="DOUBLE">%(startfreq)r</key>
+    <key name="EndFreq (MHz)" type="DOUBLE">%(stopfreq)r</key>
+%(freqlist)s  </dir>
+</dir>
+<dir name="Runinfo">
+  <key name="State" type="INT">%(state)d</key>
+  <key name="Run number" type="INT">%(runnumber)d</key>
+  <key name="Start time binary" type="DWORD">%(starttime)d</key>
+  <key name="Stop time binary" type="DWORD">%(stoptime)d</key>
+</dir>
+<dir name="Equipment">
+  <dir name="TITAN_ACQ">
+    <dir name="ppg cycle">
+      <dir name="begin_scan">
+        <key name="loop count" type="INT">%(numscans)d</key>
+      </dir>
+      <dir name="begin_ramp">
+        <key name="loop count" type="INT">%(numfreqsteps)d</key>
+      </dir>
+%(transitions)s      <dir name="pul_TDCGate">
+        <key name="pulse width (ms)" type="DOUBLE">%(tdcgate)r</key>
+      </dir>
+    </dir>
+  </dir>
+</dir>
+</odb>
+'''
+
+TRANSITION_TEMPLATE = '''      <dir name="transition_QUAD%d">
+        <key name="time offset (ms)" type="DOUBLE">%r</key>
+      </dir>
+'''
+
+
+def makeOdb(params, end=False):
+    '''
+    makeOdb(params, end) renders the begin-of-run (or, with 'end', the
+    end-of-run) ODB dump of a synthetic run.
+    '''
+    values = dict(params)
+    values['state'] = 1 if end else 3
+    if not end:
+        values['stoptime'] = 0
+    values['freqlist'] = ''
+    if params['freqlist']:
+        values['freqlist'] = ('    <key name="Quad FreqList" type="STRING" '
+                              'size="256">%s</key>\n' % params['freqlist'])
+    transitions = ''
+    for i, rftime in enumerate(params['rftimes']):
+        transitions += TRANSITION_TEMPLATE % (2 * i + 2, rftime)
+    values['transitions'] = transitions
+    return ODB_TEMPLATE % values
+
+
+def makeEvent(eventid, payload, serial=0, timestamp=0, triggermask=0):
+    return pack('<HHIII', eventid, triggermask, serial, timestamp,
+                len(payload)) + payload
+
+
+def makeBanks(banks):
+    '''
+    makeBanks(banks) packs a list of (name, uint32 words) into the payload
+    of a MIDAS data event, using 32-bit bank headers.
+    '''
+    data = []
+    for name, words in banks:
+        words = np.asarray(words, dtype='<u4').tobytes()
+        data.append(name + pack('<II', TID_DWORD, len(words)) + words +
+                    '\x00' * (-len(words) % 8))
+    data = ''.join(data)
+    return pack('<II', len(data), BANK_FORMAT_32BIT | 1) + data
+
+
+def makeCycleWords(rng, cycle, numions, outofgate, maxticks):
+    '''
+    makeCycleWords(rng, cycle, numions, outofgate, maxticks) returns the
+    MPET words of one extraction cycle: the gate-open event, the ions inside
+    the gate, the out-of-gate ions and the gate-close event, each followed
+    by its timestamp or TOF word.
+    '''
+    counter = (cycle % 1024) << 16
+    ions = np.empty((numions + outofgate + 2, 2), dtype=np.uint32)
+    ions[0] = ((EVENT_OPEN << 28) | counter, rng.randint(0, 1 << 24))
+    ions[1:numions + 1, 0] = ((EVENT_ION << 28) | counter
+                              | rng.randint(0, 1 << 16, numions))
+    ions[1:numions + 1, 1] = rng.randint(0, maxticks, numions)
+    ions[numions + 1:-1, 0] = (EVENT_OUTOFGATE << 28) | counter
+    ions[numions + 1:-1, 1] = rng.randint(0, maxticks, outofgate)
+    ions[-1] = ((EVENT_CLOSE << 28) | counter, rng.randint(0, 1 << 24))
+    return ions.ravel()
+
+
+def writeSyntheticRun(filename, numcycles=1000, ionspercycle=20,
+                      outofgate=2, cyclesperevent=10, mcpp=False,
+                      numfreqsteps=41, freqlist=None, maxtof=100.0,
+                      starttime=1381000000, cycletime=0.5,
+                      rftimes=(100.0, 50.0, 25.0), seed=0):
+    '''
+    writeSyntheticRun(filename, ...) writes a realistic .mid file for tests
+    and benchmarks.
+
+    The run has begin- and end-of-run ODB dumps holding every key the get*
+    functions read, and 'numcycles' extraction cycles of MPET words packed
+    'cyclesperevent' cycles to a MIDAS event. Ion counts are Poisson with
+    mean 'ionspercycle', TOFs are uniform below 'maxtof' us. With 'mcpp' set
+    every event also gets an MCPP bank with one position word per ion.
+    'freqlist' is an optional Quad FreqList string, e.g. '(1000000, 20, 3)'.
+    'rftimes' are the time offsets in ms of the transition_QUAD2, QUAD4, ...
+    directories, which getRFTime adds up.
+
+    Returns the number of ions inside the TDC gate.
+    '''
+    rng = np.random.RandomState(seed)
+    stoptime = starttime + int(numcycles * cycletime)
+    params = {'species': '1K39', 'charge': 1, 'amplitude': 0.35,
+              'startfreq': 1.0, 'stopfreq': 1.0001,
+              'freqlist': freqlist, 'runnumber': 1,
+              'starttime': starttime, 'stoptime': stoptime,
+              'numscans': max(numcycles // numfreqsteps, 1),
+              'numfreqsteps': numfreqsteps, 'rftimes': list(rftimes),
+              'tdcgate': maxtof / 1000.0}
+    maxticks = int(maxtof / TOF_TICK)
+
+    numions = 0
+    datafile = open(filename, 'wb')
+    try:
+        datafile.write(makeEvent(EVENTID_BOR, makeOdb(params), 0,
+                                 starttime, MIDAS_MAGIC))
+        serial = 1
+        for first in xrange(1, numcycles + 1, cyclesperevent):
+            last = min(first + cyclesperevent, numcycles + 1)
+            words = []
+            positions = []
+            for cycle in xrange(first, last):
+                ions = rng.poisson(ionspercycle)
+                numions += ions
+                words.append(makeCycleWords(rng, cycle, ions, outofgate,
+                                            maxticks))
+                if mcpp:
+                    positions.append(rng.randint(0, 1 << 16, ions))
+            banks = [('MPET', np.concatenate(words))]
+            if mcpp:
+                banks.append(('MCPP', np.concatenate(positions)))
+            timestamp = starttime + int((last - 1) * cycletime)
+            datafile.write(makeEvent(1, makeBanks(banks), serial, timestamp))
+            serial += 1
+        datafile.write(makeEvent(EVENTID_EOR, makeOdb(params, end=True),
+                                 serial, stoptime, MIDAS_MAGIC))
+    finally:
+        datafile.close()
+    return numions
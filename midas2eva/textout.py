@@ -0,0 +1,57 @@
+import numpy as np
+
+DIGITS = np.frombuffer('0123456789', dtype=np.uint8)
+
+
+def numDigits(values):
+    '''
+    numDigits(values) returns the number of decimal digits of each
+    non-negative integer in 'values' (1 for zero).
+    '''
+    digits = np.ones(len(values), dtype=np.int64)
+    power = 10
+    while True:
+        more = values >= power
+        if not more.any():
+            return digits
+        digits += more
+        if power > np.iinfo(np.int64).max // 10:
+            return digits
+        power *= 10
+
+
+def formatIntLines(columns, separator=' '):
+    '''
+    formatIntLines(columns, separator) formats equally long columns of
+    non-negative integers as text lines, one line per row with the values
+    separated by 'separator', each line ending in a newline. It gives the
+    same text as '%d %d\\n' % row for every row, without a Python level
+    loop over the rows.
+    '''
+    columns = [np.asarray(column, dtype=np.int64) for column in columns]
+    numrows = len(columns[0])
+    if numrows == 0:
+        return ''
+
+    widths = [numDigits(column) for column in columns]
+    linelengths = sum(widths) + len(columns)
+    linestarts = np.cumsum(linelengths) - linelengths
+    text = np.empty(int(linelengths.sum()), dtype=np.uint8)
+
+    position = linestarts.copy()
+    for number, (column, width) in enumerate(zip(columns, widths)):
+        # write the digits from the last one backwards
+        values = column.copy()
+        last = position + width - 1
+        for k in xrange(int(width.max())):
+            rows = np.flatnonzero(width > k)
+            text[last[rows] - k] = DIGITS[values[rows] % 10]
+            values[rows] //= 10
+        position += width
+        if number < len(columns) - 1:
+            text[position] = ord(separator)
+        else:
+            text[position] = ord('\n')
+        position += 1
+    return text.tobytes()
+
@@ -0,0 +1,235 @@
+import os
+import sys
+import json
+import time
+import argparse
+from multiprocessing import Pool
+
+from midas2eva import GATE_ERROR_MODES
+from midasfile import MidasFile
+from batch import convertWorker, writeMetrics
+
+# Settings of the watch daemon. A JSON config file can override any of
+# them, and the command line overrides the config file.
+DEFAULT_CONFIG = {'datadir': '.',
+                  'output': '/triumfcs/trshare/titan/MPET/Data/',
+                  'posoutput': None,
+                  'binwidth': 0.1,
+                  'maxtof': 100,
+                  'onerror': 'raise',
+                  'columnar': None,
+                  'cachedir': None,
+                  'jobs': 2,
+                  'interval': 2.0,
+                  'metrics': None}
+
+
+def loadConfig(filename=None, **overrides):
+    '''
+    loadConfig(filename, **overrides) returns the daemon settings: the
+    DEFAULT_CONFIG, updated from the JSON file 'filename' if given and then
+    from the 'overrides' that are not None.
+    '''
+    config = dict(DEFAULT_CONFIG)
+    if filename is not None:
+        with open(filename) as configfile:
+            settings = json.load(configfile)
+        unknown = sorted(set(settings) - set(DEFAULT_CONFIG))
+        if unknown:
+            raise ValueError('Unknown settings in ' + filename + ': ' +
+                             ', '.join(unknown))
+        config.update(settings)
+    config.update((key, value) for key, value in overrides.items()
+                  if value is not None)
+    return config
+
+
+def evaPath(filename, output):
+    '''
+    evaPath(filename, output) returns the path of the EVA file that a run
+    is converted to in the 'output' directory.
+    '''
+    return os.path.join(output, os.path.basename(filename)[:-4] + '_eva.dat')
+
+
+class RunWatcher:
+    '''
+    RunWatcher polls the 'datadir' of a config from loadConfig for MIDAS
+    runs that have finished, i.e. end with the end-of-run event and its ODB
+    dump (see MidasFile.hasEndOfRun), and converts them with a pool of
+    'jobs' worker processes, as batch.runBatch does.
+
+    Every run is converted once. Runs whose EVA file in 'output' is newer
+    than the run are taken as already converted, so a restarted daemon
+    skips them. A run still being written is only looked at again once its
+    size has changed.
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.seen = set()
+        self.sizes = {}
+        self.numconverted = 0
+        self.numfailed = 0
+
+    def isConverted(self, filename):
+        evafilename = evaPath(filename, self.config['output'])
+        return (os.path.isfile(evafilename) and
+                os.path.getmtime(evafilename) >= os.path.getmtime(filename))
+
+    def poll(self):
+        '''
+        poll() returns the runs in 'datadir' that have finished since the
+        last poll and still need converting, in name order.
+        '''
+        datadir = self.config['datadir']
+        try:
+            names = sorted(os.listdir(datadir))
+        except OSError:
+            return []
+
+        finished = []
+        for name in names:
+            filename = os.path.join(datadir, name)
+            if not name.endswith('.mid') or filename in self.seen:
+                continue
+            try:
+                size = os.path.getsize(filename)
+                if self.sizes.get(filename) == size:
+                    continue
+                self.sizes[filename] = size
+                if not MidasFile(filename).hasEndOfRun():
+                    continue
+                converted = self.isConverted(filename)
+            except (IOError, OSError):
+                continue
+            self.seen.add(filename)
+            del self.sizes[filename]
+            if not converted:
+                finished.append(filename)
+        return finished
+
+    def task(self, filename):
+        '''
+        task(filename) returns the batch.convertWorker arguments that
+        convert 'filename' with the settings of the config.
+        '''
+        config = self.config
+        return (filename, config['output'], config['binwidth'],
+                config['maxtof'], False, config['cachedir'], 1,
+                config['onerror'], config['columnar'], config['posoutput'],
+                False, None)
+
+    def report(self, result, out=sys.stdout):
+        '''
+        report(result) prints the outcome of one convertWorker result and
+        appends its metrics to the 'metrics' file of the config, if set.
+        '''
+        filename, error, seconds = result[:3]
+        if error is None:
+            self.numconverted += 1
+            out.write('Converted %s in %.1f s\n' % (filename, seconds))
+        else:
+            self.numfailed += 1
+            out.write('FAILED ' + filename + ': ' + error.rstrip() + '\n')
+        out.flush()
+        if self.config['metrics'] is not None:
+            writeMetrics([result], self.config['metrics'])
+
+    def run(self, once=False, out=sys.stdout):
+        '''
+        run(once) polls 'datadir' every 'interval' seconds and queues each
+        finished run on the worker pool, until interrupted. With 'once' the
+        runs that have finished by the first poll are converted and run
+        returns when they are done.
+        '''
+        for directory in (self.config['output'], self.config['posoutput']):
+            if directory is not None and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+        pool = Pool(processes=max(int(self.config['jobs']), 1))
+        pending = []
+        try:
+            while True:
+                for filename in self.poll():
+                    out.write('Queued ' + filename + '\n')
+                    pending.append(pool.apply_async(
+                        convertWorker, (self.task(filename),)))
+                if once:
+                    for result in pending:
+                        result.wait()
+                for result in [result for result in pending
+                               if result.ready()]:
+                    pending.remove(result)
+                    self.report(result.get(), out)
+                if once:
+                    break
+                time.sleep(self.config['interval'])
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Watch a directory and convert MIDAS runs into EVA '
+                    'files as soon as they finish.')
+    parser.add_argument('datadir', nargs='?', default=None,
+                        help='directory the .mid files are written to')
+    parser.add_argument('-c', '--config', default=None,
+                        help='JSON file with any of the settings; options '
+                             'given here override it')
+    parser.add_argument('-o', '--output', default=None,
+                        help='directory for the EVA files')
+    parser.add_argument('--pos-output', dest='posoutput', default=None,
+                        help='also write the MCP positions as text to this '
+                             'directory')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of runs converted at the same time')
+    parser.add_argument('--interval', type=float, default=None,
+                        help='seconds between polls of the directory')
+    parser.add_argument('--binwidth', type=float, default=None,
+                        help='TOF bin width in us')
+    parser.add_argument('--maxtof', type=float, default=None,
+                        help='largest TOF in us')
+    parser.add_argument('--on-gate-error', dest='onerror', default=None,
+                        choices=GATE_ERROR_MODES,
+                        help='what to do about bad TDC gates, see '
+                             'midas2eva --help')
+    parser.add_argument('--columnar', choices=('npy', 'npz'), default=None,
+                        help='also export the binned data as a directory of '
+                             '.npy files or as one .npz file')
+    parser.add_argument('--cache-dir', dest='cachedir', default=None,
+                        help='keep the decoded events in a cache there')
+    parser.add_argument('--metrics', default=None,
+                        help='append a JSON line with the stage timings '
+                             'and counters of each run to this file')
+    parser.add_argument('--once', action='store_true',
+                        help='convert the runs that have finished and exit')
+    args = parser.parse_args(argv)
+
+    overrides = dict(vars(args))
+    configfile = overrides.pop('config')
+    once = overrides.pop('once')
+    try:
+        config = loadConfig(configfile, **overrides)
+    except (IOError, ValueError) as err:
+        parser.error(str(err))
+
+    watcher = RunWatcher(config)
+    print('Watching ' + config['datadir'] + ', writing to ' +
+          config['output'])
+    try:
+        watcher.run(once=once)
+    except KeyboardInterrupt:
+        pass
+    if watcher.numfailed:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
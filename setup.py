@@ -4,6 +4,13 @@ from setuptools import setup, find_packages
 setup(name='MidasToEva',
       version='1.0',
       packages=find_packages(),
+      install_requires=['numpy'],
+      entry_points={
+          'console_scripts': ['midas2eva = midas2eva.batch:main',
+                              'midas2eva-watch = midas2eva.watch:main',
+                              'midas2eva-catalogue = '
+                              'midas2eva.catalogue:main'],
+      },
       author="Aaron Gallant",
       author_email="agallant@triumf.ca",
       description="Module to convert MIDAS files into EVA files",
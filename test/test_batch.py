@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import os
+import json
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase
+
+import mock
+from midas2eva import batch
+from midas2eva.midas2eva import MissingEvent
+from midas2eva.synthetic import writeSyntheticRun
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for name in ['1.mid', '2.mid', 'notes.txt']:
+            open(os.path.join(self.tmpdir, name), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_collectRuns(self):
+        expected = [os.path.join(self.tmpdir, '1.mid'),
+                    os.path.join(self.tmpdir, '2.mid')]
+        self.assertEqual(batch.collectRuns([self.tmpdir]), expected)
+        self.assertEqual(batch.collectRuns([self.tmpdir + '/*',
+                                            expected[0]]), expected)
+        self.assertEqual(batch.collectRuns([self.tmpdir + '/3.mid']), [])
+
+    def test_convertRun_unwritable(self):
+        run = os.path.join(self.tmpdir, '1.mid')
+        writeSyntheticRun(run, numcycles=20, mcpp=True)
+        missing = os.path.join(self.tmpdir, 'missing')
+        self.assertRaises(IOError, batch.convertRun, run, missing)
+        self.assertRaises(IOError, batch.convertRun, run, missing,
+                          stream=True)
+        self.assertRaises(IOError, batch.convertRun, run, self.tmpdir,
+                          pospath=missing)
+        batch.convertRun(run, self.tmpdir, stream=True)
+        self.assertTrue(os.path.isfile(os.path.join(self.tmpdir,
+                                                    '1_eva.dat')))
+
+    @mock.patch('midas2eva.batch.convertRun')
+    def test_runBatch(self, m_convertRun):
+        m_convertRun.side_effect = [None, MissingEvent(12)]
+        results = batch.runBatch(['1.mid', '2.mid'], 'out', 0.2, 50)
+
+        self.assertEqual(m_convertRun.call_count, 2)
+        m_convertRun.assert_called_with('2.mid', 'out', 0.2, 50, False, None,
+                                        1, 'raise', None, None, False,
+                                        metrics=mock.ANY)
+        self.assertEqual(results[0][:2], ('1.mid', None))
+        self.assertEqual(results[0][3]['filename'], '1.mid')
+        self.assertEqual(results[1][3]['error'], results[1][1])
+        self.assertEqual(results[1][0], '2.mid')
+        self.assertTrue(results[1][1].startswith(
+            'MissingEvent: Possible missing event near cycle number 12'))
+
+        out = StringIO()
+        batch.printSummary(results, 1.0, out)
+        self.assertTrue('Converted 1 of 2 runs' in out.getvalue())
+        self.assertTrue('FAILED 2.mid' in out.getvalue())
+
+    @mock.patch('midas2eva.batch.runBatch')
+    def test_main(self, m_runBatch):
+        m_runBatch.return_value = [('1.mid', None, 0.1, {'seconds': 0.1})]
+        metricsfile = os.path.join(self.tmpdir, 'metrics.json')
+        self.assertEqual(batch.main([self.tmpdir, '-j', '4',
+                                     '--metrics', metricsfile]), 0)
+        m_runBatch.assert_called_once_with(
+            [os.path.join(self.tmpdir, '1.mid'),
+             os.path.join(self.tmpdir, '2.mid')], '.', 0.1, 100, False, 4,
+            None, None, 1, 'raise', None, None, False)
+        with open(metricsfile) as lines:
+            self.assertEqual([json.loads(line) for line in lines],
+                             [{'seconds': 0.1}])
+
+        self.assertEqual(batch.main([self.tmpdir + '/none*']), 1)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+
+import numpy as np
+from midas2eva.events import EVENT_DTYPE
+from midas2eva.binning import (histogramCycles, gateCounters,
+                               firstGateError, findGateDefects, tofBins,
+                               CycleBinner, GateDefect, foldCycles,
+                               stepSummary, completeGates, unwrapCounters)
+
+
+def makeTable(rows):
+    return np.array(rows, dtype=EVENT_DTYPE)
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.table = makeTable([(2, 0, 10),      # before the first gate
+                                (8, 1, 0),
+                                (2, 1, 25),
+                                (4, 1, 30),      # out of gate, skipped
+                                (2, 1, 9999),    # above maxtof
+                                (1, 1, 0),
+                                (8, 2, 0),
+                                (2, 2, 39),
+                                (2, 2, 31),
+                                (1, 2, 0),
+                                (2, 3, 5)])      # cycle still open
+
+    def test_tofBins(self):
+        bins, keep = tofBins(np.array([0, 9, 10, 99, 100]), 0.1, 1.0, 10)
+        self.assertEqual(list(bins[keep]), [0, 0, 1, 9])
+
+    def test_histogramCycles(self):
+        hist = histogramCycles(self.table, 5, 0.1, 0.5)
+        self.assertEqual(hist.shape, (3, 5))
+        self.assertEqual(list(hist[0]), [0, 1, 1, 0, 0])
+        self.assertEqual(list(hist[1]), [0, 0, 0, 2, 0])
+        self.assertEqual(list(hist[2]), [1, 0, 0, 0, 0])
+
+    def test_gateCounters(self):
+        starts, ends = gateCounters(self.table)
+        self.assertEqual(list(starts), [1, 2])
+        self.assertEqual(list(ends), [1, 2])
+        self.assertEqual(firstGateError(starts, ends), None)
+        self.assertEqual(firstGateError(starts, ends, cyclecounter=1), 0)
+
+        # a close with no open before it uses the carried counter
+        starts, ends = gateCounters(makeTable([(1, 5, 0)]), startcounter=5)
+        self.assertEqual(list(starts), [5])
+        starts, ends = gateCounters(makeTable([(1, 5, 0)]))
+        self.assertEqual(list(starts), [-1])
+
+    def test_firstGateError(self):
+        # missing open for the second gate
+        table = makeTable([(8, 1, 0), (1, 1, 0), (1, 2, 0)])
+        starts, ends = gateCounters(table)
+        self.assertEqual(firstGateError(starts, ends), 1)
+
+        # cycle 2 skipped
+        table = makeTable([(8, 1, 0), (1, 1, 0), (8, 3, 0), (1, 3, 0)])
+        starts, ends = gateCounters(table)
+        self.assertEqual(firstGateError(starts, ends), 1)
+
+        # counter wraps at 1024
+        table = makeTable([(8, 1023, 0), (1, 1023, 0), (8, 0, 0), (1, 0, 0)])
+        starts, ends = gateCounters(table)
+        self.assertEqual(firstGateError(starts, ends, 1022), None)
+
+    def test_findGateDefects(self):
+        # cycle 3 skipped, missing open for cycle 6, stale close for cycle 8
+        table = makeTable([(8, 1, 0), (1, 1, 0), (8, 2, 0), (1, 2, 0),
+                           (8, 4, 0), (1, 4, 0), (8, 5, 0), (1, 5, 0),
+                           (1, 6, 0), (8, 7, 0), (1, 7, 0), (8, 8, 0),
+                           (1, 7, 0), (8, 9, 0), (1, 9, 0)])
+        defects = findGateDefects(*gateCounters(table))
+        self.assertEqual(defects,
+                         [GateDefect(2, 'MissingEvent', 4, 4),
+                          GateDefect(4, 'MissingTDCOpen', 5, 6),
+                          GateDefect(6, 'MissingTDCClose', 8, 7)])
+
+        # the first defect is the one the gate checks raise for
+        self.assertEqual(firstGateError(*gateCounters(table)), 2)
+        self.assertEqual(findGateDefects(*gateCounters(table[:4])), [])
+
+        # counter wraps at 1024
+        table = makeTable([(8, 1023, 0), (1, 1023, 0), (8, 0, 0), (1, 0, 0)])
+        self.assertEqual(findGateDefects(*gateCounters(table),
+                                         lastcounter=1022), [])
+
+    def test_CycleBinner_defects(self):
+        table = makeTable([(8, 1, 0), (2, 1, 1), (1, 1, 0),
+                           (8, 3, 0), (2, 3, 1), (1, 3, 0),
+                           (8, 4, 0), (2, 4, 1), (1, 4, 0)])
+        binner = CycleBinner(2, 0.01, 0.02, None)
+        hist = np.concatenate([binner.feed(table[:4]), binner.feed(table[4:])])
+        self.assertEqual(binner.defects, [GateDefect(1, 'MissingEvent', 3, 3)])
+        self.assertEqual(list(hist[:, 1]), [1, 1, 1])
+
+
+    def test_CycleBinner_split(self):
+        # the open of cycle 3 is missing; the defects found do not depend
+        # on where the table is split
+        table = makeTable([(8, 1, 0), (1, 1, 0), (8, 2, 0), (1, 2, 0),
+                           (1, 3, 0), (8, 4, 0), (1, 4, 0),
+                           (8, 5, 0), (1, 5, 0)])
+        for size in range(1, len(table) + 1):
+            binner = CycleBinner(2, 0.01, 0.02, None)
+            for start in range(0, len(table), size):
+                binner.feed(table[start:start + size])
+            self.assertEqual(binner.defects,
+                             [GateDefect(2, 'MissingTDCOpen', 2, 3)])
+
+    def test_foldCycles(self):
+        hist = np.random.RandomState(0).poisson(2, (23, 6))
+        for numsteps, firstcycle, skip in [(5, 0, ()), (5, 3, ()),
+                                           (4, 7, [8, 29, 40]),
+                                           (30, 2, ()), (1, 0, [0])]:
+            expected = np.zeros((numsteps, 6), dtype=np.int64)
+            for row, counts in enumerate(hist):
+                if firstcycle + row not in skip:
+                    expected[(firstcycle + row) % numsteps] += counts
+            self.assertTrue((foldCycles(hist, numsteps, firstcycle, skip)
+                             == expected).all())
+        self.assertEqual(foldCycles(hist[:0], 3, 1).shape, (3, 6))
+
+    def test_completeGates(self):
+        # the first gate lost its open, the second is whole
+        hist, counters = completeGates(self.table[2:], 5, 0.1, 0.5)
+        self.assertEqual(list(counters), [2])
+        self.assertEqual(hist.tolist(), [[0, 0, 0, 2, 0]])
+
+    def test_unwrapCounters(self):
+        self.assertEqual(list(unwrapCounters([1, 2, 5])), [0, 1, 4])
+        self.assertEqual(list(unwrapCounters([1023, 0, 3], 1000)),
+                         [1022, 1023, 1026])
+        self.assertEqual(list(unwrapCounters([7, 7], 5)), [6, 1030])
+        self.assertEqual(len(unwrapCounters([], 5)), 0)
+
+    def test_foldCycles_rows(self):
+        hist = np.random.RandomState(0).poisson(2, (6, 3))
+        cycles = np.array([0, 4, 5, 9, 20, 21])
+        expected = np.zeros((4, 3), dtype=np.int64)
+        for cycle, counts in zip(cycles, hist):
+            if cycle != 9:
+                expected[cycle % 4] += counts
+        self.assertTrue((foldCycles(hist, 4, cycles, [9]) == expected).all())
+
+    def test_stepSummary(self):
+        ions, meantof = stepSummary([[1, 0, 3], [0, 0, 0]], 0.5)
+        self.assertEqual(list(ions), [4, 0])
+        self.assertEqual(meantof[0], (0.25 + 3 * 1.25) / 4)
+        self.assertTrue(np.isnan(meantof[1]))
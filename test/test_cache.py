@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+import os
+import time
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import midas2eva
+from midas2eva.cache import EventCache, fileFingerprint
+from midas2eva.events import EVENT_DTYPE
+from midas2eva.odb import parseOdb
+
+ODB = ('<odb root="/"><dir name="Experiment"><dir name="Variables">' +
+       '<key name="Species" type="STRING">1K39</key>' +
+       '<key name="Quad FreqList" type="STRING">(1000000, 20, 3)</key>' +
+       '</dir></dir></odb>')
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.tmpdir, 'cache')
+        self.filename = os.path.join(self.tmpdir, 'run.mid')
+        with open(self.filename, 'w') as datafile:
+            datafile.write(ODB)
+        self.events = np.array([(8, 1, 0), (2, 1, 50), (1, 1, 0)],
+                               dtype=EVENT_DTYPE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_fileFingerprint(self):
+        fingerprint = fileFingerprint(self.filename, blocksize=8)
+        self.assertEqual(fingerprint, fileFingerprint(self.filename, 8))
+        with open(self.filename, 'a') as datafile:
+            datafile.write('more')
+        self.assertNotEqual(fingerprint, fileFingerprint(self.filename, 8))
+
+    def test_store_load(self):
+        cache = EventCache(self.cachedir)
+        self.assertEqual(cache.load(self.filename), None)
+
+        cache.store(self.filename, self.events, np.array([3], np.uint32),
+                    np.zeros(0, np.uint32), {'domag': [], 'dom2ag': []})
+        entry = cache.load(self.filename)
+        self.assertTrue(isinstance(entry['events'], np.memmap))
+        self.assertEqual(entry['events'].tolist(), self.events.tolist())
+        self.assertEqual(list(entry['errors']), [3])
+        self.assertEqual(entry['odb'], {'domag': [], 'dom2ag': []})
+
+        # a changed file misses the cache
+        with open(self.filename, 'a') as datafile:
+            datafile.write('more')
+        self.assertEqual(cache.load(self.filename), None)
+
+    def test_evict(self):
+        cache = EventCache(self.cachedir, maxbytes=0)
+        cache.store(self.filename, self.events, np.zeros(0, np.uint32),
+                    np.zeros(0, np.uint32), {})
+        self.assertEqual(cache.entries(), [])
+
+        cache.maxbytes = 10 ** 6
+        cache.store(self.filename, self.events, np.zeros(0, np.uint32),
+                    np.zeros(0, np.uint32), {})
+        oldest = cache.entries()[0][2]
+        os.utime(oldest, (time.time() - 100, time.time() - 100))
+        with open(self.filename, 'a') as datafile:
+            datafile.write('more')
+        cache.store(self.filename, self.events, np.zeros(0, np.uint32),
+                    np.zeros(0, np.uint32), {})
+        self.assertEqual(len(cache.entries()), 2)
+
+        cache.maxbytes = cache.entries()[-1][1]
+        cache.evict()
+        entries = cache.entries()
+        self.assertEqual(len(entries), 1)
+        self.assertNotEqual(entries[0][2], oldest)
+
+    def test_MidasToEva_cache(self):
+        cache = EventCache(self.cachedir)
+        m2e = midas2eva.MidasToEva(self.filename)
+        m2e.domag = m2e.dom2ag = parseOdb(ODB, ['/*/Variables/*'])
+        m2e.mdumparray = self.events
+        m2e.errarray = np.zeros(0, np.uint32)
+        m2e.posdata = np.zeros(0, np.uint32)
+        m2e.storeEventCache(cache)
+
+        m2e = midas2eva.MidasToEva(self.filename)
+        self.assertTrue(m2e.loadEventCache(cache))
+        m2e.getElem()
+        self.assertEqual(m2e.mass, '1K39')
+        self.assertEqual(m2e.genFreqList(), [999980.0, 1000000.0, 1000020.0])
+        m2e.binMdumpData(binwidth=0.1, maxtof=1)
+        self.assertEqual(list(m2e.bindata[0]), [0, 0, 0, 0, 0, 1, 0, 0, 0, 0])
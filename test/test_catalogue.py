@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase
+
+from midas2eva import catalogue
+from midas2eva.catalogue import RunCatalogue, readRunMetadata
+from midas2eva.synthetic import writeSyntheticRun
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.database = os.path.join(self.tmpdir, 'runs.sqlite')
+        self.runs = [os.path.join(self.tmpdir, name)
+                     for name in ('1.mid', '2.mid')]
+        writeSyntheticRun(self.runs[0], numcycles=20, cyclesperevent=10,
+                          numfreqsteps=5)
+        writeSyntheticRun(self.runs[1], numcycles=30, cyclesperevent=10,
+                          numfreqsteps=3, starttime=1381001000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_readRunMetadata(self):
+        row = readRunMetadata(self.runs[0])
+        self.assertEqual(row['filename'], os.path.abspath(self.runs[0]))
+        self.assertEqual(row['size'], os.path.getsize(self.runs[0]))
+        self.assertEqual(row['ended'], 1)
+        self.assertEqual(row['events'], 2)
+        self.assertEqual(row['mass'], '1K39')
+        self.assertEqual(row['charge'], 1)
+        self.assertEqual(row['trf'], 0.175)
+        self.assertEqual(row['numfreqsteps'], 5)
+        self.assertEqual(row['starttime'], 1381000000)
+        self.assertEqual(row['tdctime'], 100.0)
+
+    def test_readRunMetadata_rftimes(self):
+        # every transition_QUAD is summed, not just the first two
+        writeSyntheticRun(self.runs[0], numcycles=20, cyclesperevent=10,
+                          rftimes=(100.0, 50.0, 25.0, 10.0))
+        self.assertAlmostEqual(readRunMetadata(self.runs[0])['trf'], 0.185)
+
+        with RunCatalogue(self.database) as runs:
+            runs.update(self.runs[:1])
+            self.assertAlmostEqual(runs.query()[0]['trf'], 0.185)
+
+    def test_update(self):
+        with RunCatalogue(self.database) as runs:
+            self.assertEqual(runs.update(self.runs), self.runs)
+            self.assertEqual(runs.update(self.runs), [])
+
+            rows = runs.query(mass='1K39')
+            self.assertEqual([row['filename'] for row in rows],
+                             [os.path.abspath(run) for run in self.runs])
+            rows = runs.query('starttime > ?', [1381000500], trf=0.175)
+            self.assertEqual(len(rows), 1)
+            self.assertEqual(rows[0]['numfreqsteps'], 3)
+            self.assertEqual(rows[0]['words'],
+                             readRunMetadata(self.runs[1])['words'])
+            self.assertRaises(ValueError, runs.query, species='1K39')
+
+            # a run that has changed is read again, one that is gone dropped
+            writeSyntheticRun(self.runs[0], numcycles=25, numfreqsteps=4)
+            self.assertEqual(runs.update(self.runs), self.runs[:1])
+            self.assertEqual(runs.query(numfreqsteps=4)[0]['filename'],
+                             os.path.abspath(self.runs[0]))
+            os.remove(self.runs[1])
+            self.assertEqual(runs.prune(), [os.path.abspath(self.runs[1])])
+            self.assertEqual(len(runs.query()), 1)
+
+    def test_main(self):
+        out = StringIO()
+        self.assertEqual(catalogue.main([self.database, 'update',
+                                         self.tmpdir], out), 0)
+        self.assertTrue('Catalogued 2 of 2 runs' in out.getvalue())
+
+        out = StringIO()
+        self.assertEqual(catalogue.main([self.database, 'query',
+                                         'numfreqsteps=3', '--columns',
+                                         'filename,events'], out), 0)
+        self.assertEqual(out.getvalue(),
+                         os.path.abspath(self.runs[1]) + '\t3\n')
+        self.assertRaises(SystemExit, catalogue.main,
+                          [self.database, 'query', 'species=1K39'], out)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+from midas2eva.columnar import compactCounts, writeColumnar, loadColumnar
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.arrays = {'counts': np.array([[0, 3], [300, 1]],
+                                          dtype=np.uint32),
+                       'timestamps': np.array([10.0, 10.5])}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_compactCounts(self):
+        self.assertEqual(compactCounts(np.array([[0, 255]])).dtype, np.uint8)
+        self.assertEqual(compactCounts(self.arrays['counts']).dtype,
+                         np.uint16)
+        self.assertEqual(compactCounts(np.zeros((0, 4))).dtype, np.uint8)
+
+    def test_columnar(self):
+        for name in ('run_bins', 'run_bins.npz'):
+            path = os.path.join(self.tmpdir, name)
+            writeColumnar(path, self.arrays, {'mass': '1K39'})
+            # a second export replaces the first
+            writeColumnar(path, self.arrays, {'mass': '1K39'})
+            arrays, metadata = loadColumnar(path)
+            self.assertEqual(sorted(arrays), ['counts', 'timestamps'])
+            for key in arrays:
+                self.assertTrue((arrays[key] == self.arrays[key]).all())
+            self.assertEqual(metadata, {'mass': '1K39', 'version': 1})
+
+        arrays, metadata = loadColumnar(os.path.join(self.tmpdir,
+                                                     'run_bins'))
+        self.assertTrue(isinstance(arrays['counts'], np.memmap))
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['run_bins', 'run_bins.npz'])
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+from struct import pack
+from StringIO import StringIO
+from unittest import TestCase
+
+import numpy as np
+from midas2eva.events import EVENT_DTYPE
+from midas2eva.eva import (packCycleRecords, writeCycleRecords, EvaFile,
+                           EvaFileError, parseHeaderSections, verifyEvaFile,
+                           recordSizes, appendCycleRecords,
+                           setRecordTimestamps)
+
+
+def referenceRecords(hist, timestamps):
+    data = ''
+    numchannels = hist.shape[1]
+    for row, timestamp in zip(hist, timestamps):
+        channels = np.flatnonzero(row)
+        if numchannels - len(channels) < numchannels // 2:
+            data += pack('h', numchannels * 2 + 4) + pack('i', timestamp)
+            for count in row:
+                data += pack('h', count)
+        else:
+            data += pack('h', len(channels) * 4 + 4) + pack('i', timestamp)
+            for j in channels:
+                data += pack('h', j) + pack('h', row[j])
+    return data
+
+
+def makeEvaFile(hist, timestamps, frequencies, binwidth=0.1):
+    header = ('\n\n[Mass]\n Mass=1K39 ,Charge= 1\n\n'
+              '[MCA]\n MCA=sim,TimePerChannel=' + str(binwidth) +
+              '\xb5s,Channels= ' + str(hist.shape[1]) + ',Pipse=   0\n\n'
+              '[SCAN0]\n Dev=AFG, Fct=SetFrequency, Spec=,\n'
+              ' Start=1.0, Stop=2.0, Step=0.5, Unit=Hz\n\n')
+    scans = (pack('i', 3) + ''.join(pack('d', f) for f in frequencies)
+             + pack('i', 1) + pack('d', 0))
+    datastart = 8 + len(header) + len(scans)
+    return (pack('ii', len(header), datastart) + header + scans
+            + packCycleRecords(hist, timestamps))
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.hist = np.array([[0, 0, 0, 0, 0],
+                              [1, 2, 3, 0, 4],
+                              [0, 7, 0, 0, 1],
+                              [5, 5, 5, 5, 5]], dtype=np.uint32)
+        self.timestamps = np.array([100.0, 101.7, 103.4, -2.5])
+
+    def test_packCycleRecords(self):
+        result = packCycleRecords(self.hist, self.timestamps)
+        expected = referenceRecords(self.hist, [100, 101, 103, -2])
+        self.assertEqual(result, expected)
+
+        hist = np.random.RandomState(0).poisson(0.7, (50, 12))
+        timestamps = np.arange(50) * 3.3
+        self.assertEqual(packCycleRecords(hist, timestamps),
+                         referenceRecords(hist, timestamps.astype(int)))
+
+        self.assertEqual(packCycleRecords(np.zeros((0, 5)), []), '')
+        self.assertRaises(ValueError, packCycleRecords,
+                          np.array([[40000]]), [0])
+
+    def test_writeCycleRecords(self):
+        datafile = StringIO()
+        written = writeCycleRecords(datafile, self.hist, self.timestamps,
+                                    chunkcycles=3)
+        self.assertEqual(written, len(datafile.getvalue()))
+        self.assertEqual(datafile.getvalue(),
+                         packCycleRecords(self.hist, self.timestamps))
+
+
+class ReaderTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'run_eva.dat')
+        # rows 1 and 4 have exactly half of the channels set, so their packed
+        # records are as long as dense ones
+        self.hist = np.array([[0, 0, 0, 0],
+                              [0, 1, 0, 1],
+                              [1, 2, 3, 0],
+                              [5, 5, 5, 5],
+                              [1, 0, 1, 0],
+                              [0, 0, 9, 0]], dtype=np.uint32)
+        self.timestamps = np.array([10, 20, 30, 40, 50, -60])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, data):
+        with open(self.filename, 'wb') as datafile:
+            datafile.write(data)
+
+    def test_appendCycleRecords(self):
+        header = makeEvaFile(self.hist[:0], [], [1.0, 1.5, 2.0])
+        datastart, sizes = appendCycleRecords(self.filename, header,
+                                              self.hist[:2])
+        self.assertEqual(datastart, len(header))
+        # anything after the records kept is cut off
+        with open(self.filename, 'ab') as datafile:
+            datafile.write('partial')
+        datastart, more = appendCycleRecords(self.filename, header,
+                                             self.hist[2:], sizes.sum())
+        sizes = np.concatenate((sizes, more))
+        self.assertEqual(list(sizes), list(recordSizes(self.hist)))
+
+        offsets = datastart + np.cumsum(sizes) - sizes
+        setRecordTimestamps(self.filename, offsets, self.timestamps)
+        with open(self.filename, 'rb') as datafile:
+            self.assertEqual(datafile.read(),
+                             makeEvaFile(self.hist, self.timestamps,
+                                         [1.0, 1.5, 2.0]))
+
+        # a new header is put in front of the records
+        header = makeEvaFile(self.hist[:0], [], [1.0, 1.5, 2.0, 2.5])
+        appendCycleRecords(self.filename, header, self.hist[:0], sizes.sum())
+        with open(self.filename, 'rb') as datafile:
+            self.assertEqual(datafile.read(),
+                             makeEvaFile(self.hist, self.timestamps,
+                                         [1.0, 1.5, 2.0, 2.5]))
+
+    def test_EvaFile(self):
+        # a 'Quad FreqList' table longer than the number of steps
+        self.write(makeEvaFile(self.hist, self.timestamps,
+                               [1.0, 1.5, 2.0, 2.5]))
+        with EvaFile(self.filename) as evafile:
+            self.assertEqual(evafile.sections['Mass']['Charge'], '1')
+            self.assertEqual(evafile.sections['SCAN0']['Unit'], 'Hz')
+            self.assertEqual(evafile.numchannels, 4)
+            self.assertEqual(evafile.binwidth, 0.1)
+            self.assertEqual(evafile.numfreqsteps, 3)
+            self.assertEqual(list(evafile.frequencies), [1.0, 1.5, 2.0, 2.5])
+            self.assertEqual(list(evafile.scan1), [0.0])
+
+            self.assertEqual(len(evafile), 6)
+            self.assertEqual(list(evafile.dense),
+                             [False, False, True, True, False, False])
+            self.assertEqual(list(evafile.timestamps()),
+                             list(self.timestamps))
+            self.assertTrue((evafile.countMatrix() == self.hist).all())
+            timestamp, channels, counts = evafile.record(1)
+            self.assertEqual(timestamp, 20)
+            self.assertEqual(list(channels), [1, 3])
+            self.assertEqual(list(counts), [1, 1])
+
+    def test_EvaFile_corrupt(self):
+        data = makeEvaFile(self.hist, self.timestamps, [1.0, 1.5, 2.0])
+        self.write(data[:-2])
+        self.assertRaises(EvaFileError, EvaFile, self.filename)
+        self.write(pack('ii', 1000, 2000) + data[8:])
+        self.assertRaises(EvaFileError, EvaFile, self.filename)
+
+    def test_parseHeaderSections(self):
+        sections = parseHeaderSections('[Excit]\n Mass=1K39 ,Charge= 1,'
+                                       'Freq =50.0, Amp= 0.35\n')
+        self.assertEqual(sections['Excit'].items(),
+                         [('Mass', '1K39'), ('Charge', '1'),
+                          ('Freq', '50.0'), ('Amp', '0.35')])
+
+    def test_verifyEvaFile(self):
+        table = np.array([(8, 1, 0), (2, 1, 15), (1, 1, 0),
+                          (8, 2, 0), (2, 2, 35), (2, 2, 99), (1, 2, 0),
+                          (2, 3, 5)], dtype=EVENT_DTYPE)
+        hist = np.array([[0, 1, 0, 0], [0, 0, 0, 1]])
+        self.write(makeEvaFile(hist, [100, 150], [1.0, 1.5, 2.0]))
+        self.assertEqual(verifyEvaFile(self.filename, table, 100, 200), [])
+        self.assertEqual(verifyEvaFile(self.filename, table, 100, 300),
+                         ['cycle 1 timestamp differs'])
+        self.assertEqual(verifyEvaFile(self.filename, table, maxtof=0.3),
+                         ['cycle 1 counts differ'])
+        self.assertEqual(verifyEvaFile(self.filename, table[:3]),
+                         ['2 cycle records, expected 1'])
+
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import midas2eva
+from midas2eva.incremental import checkpointKey, loadCheckpoint
+from midas2eva.synthetic import writeSyntheticRun
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.outdir = os.path.join(self.tmpdir, 'out') + '/'
+        os.mkdir(self.outdir)
+        self.full = os.path.join(self.tmpdir, 'full.mid')
+        self.filename = os.path.join(self.tmpdir, 'run.mid')
+        writeSyntheticRun(self.full, numcycles=60, cyclesperevent=4,
+                          numfreqsteps=6)
+        with open(self.full, 'rb') as datafile:
+            self.data = datafile.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def grow(self, size):
+        with open(self.filename, 'ab') as datafile:
+            datafile.write(self.data[datafile.tell():size])
+
+    def convert(self, binwidth=0.1):
+        m2e = midas2eva.MidasToEva(self.filename)
+        m2e.convertIncremental(binwidth, 100, self.outdir)
+        return m2e
+
+    def test_convertIncremental(self):
+        size = len(self.data)
+        for part in (size // 3, size // 3 + 5, 2 * size // 3):
+            self.grow(part)
+            m2e = self.convert()
+            stages = m2e.metrics.stages
+            self.assertTrue(0 < len(m2e.bindata) < 60)
+            self.assertTrue(m2e.endtime > m2e.starttime)
+            self.assertEqual(sorted(os.listdir(self.outdir)),
+                             ['run_checkpoint', 'run_checkpoint.counts',
+                              'run_eva.dat'])
+
+        # nothing new to decode
+        m2e = self.convert()
+        self.assertEqual(m2e.metrics.stages['convertIncremental']['events'],
+                         0)
+        self.assertTrue(stages['convertIncremental']['events'] > 0)
+
+        self.grow(size)
+        m2e = self.convert()
+        with open(os.path.join(self.outdir, 'run_eva.dat'), 'rb') as evafile:
+            incremental = evafile.read()
+
+        reference = midas2eva.MidasToEva(self.full)
+        reference.extractXML()
+        reference.readRunParameters()
+        reference.collectMdumpData()
+        reference.reorganizeMdumpData()
+        reference.binMdumpData(0.1, 100)
+        self.assertTrue((m2e.bindata == reference.bindata).all())
+        self.assertTrue((m2e.stepdata == reference.stepdata).all())
+        self.assertEqual(m2e.endtime, reference.endtime)
+        reference.writeEvaFile(reference.mass, reference.charge,
+                               reference.amplitude, reference.trf,
+                               self.tmpdir + '/')
+        with open(os.path.join(self.tmpdir, 'full_eva.dat'), 'rb') as evafile:
+            self.assertEqual(incremental, evafile.read())
+
+    def test_convertIncremental_partialEndOfRun(self):
+        # the end-of-run ODB dump has only been written in part
+        self.grow(self.data.rfind('</odb>') - 100)
+        m2e = self.convert()
+        self.assertEqual(len(m2e.bindata), 60)
+        self.assertEqual(m2e.trf, 0.175)
+        self.assertTrue(m2e.endtime > m2e.starttime)
+
+    def test_loadCheckpoint(self):
+        self.grow(len(self.data) // 2)
+        self.convert()
+        checkpath = os.path.join(self.outdir, 'run_checkpoint')
+        settings = {'binwidth': 0.1, 'maxtof': 100, 'onerror': 'raise'}
+        arrays, metadata = loadCheckpoint(checkpath, self.filename, settings)
+        self.assertEqual(metadata['ended'], False)
+        self.assertEqual([metadata['prefixsize'], metadata['prefixdigest']],
+                         list(checkpointKey(self.filename,
+                                            metadata['offset'])))
+
+        settings['binwidth'] = 0.2
+        self.assertEqual(loadCheckpoint(checkpath, self.filename, settings),
+                         None)
+        # a rewritten run starts over
+        with open(self.filename, 'r+b') as datafile:
+            datafile.write('\xff' * 64)
+        settings['binwidth'] = 0.1
+        self.assertEqual(loadCheckpoint(checkpath, self.filename, settings),
+                         None)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase
+
+import mock
+import numpy as np
+
+import midas2eva
+from midas2eva import batch
+from midas2eva.eva import EvaFile
+from midas2eva.merge import mergeRuns, mergeRun, mergedPath, MergeError
+from midas2eva.metrics import RunMetrics
+from midas2eva.synthetic import writeSyntheticRun
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.runs = [os.path.join(self.tmpdir, name)
+                     for name in ('187070.mid', '187071.mid')]
+        # the second run is given first but started later
+        writeSyntheticRun(self.runs[1], numcycles=20, numfreqsteps=5,
+                          starttime=1381001000, seed=1)
+        writeSyntheticRun(self.runs[0], numcycles=23, numfreqsteps=5)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def convert(self, filename):
+        m2e = midas2eva.MidasToEva(filename)
+        m2e.extractXML()
+        m2e.readRunParameters()
+        m2e.streamEvaFile(0.1, 100, self.tmpdir + '/')
+        with EvaFile(filename[:-4] + '_eva.dat') as evafile:
+            return evafile.countMatrix(), evafile.timestamps()
+
+    def test_mergedPath(self):
+        self.assertEqual(mergedPath(self.runs[::-1], '/eva'),
+                         '/eva/187070-187071_eva.dat')
+        self.assertEqual(mergedPath(self.runs[:1], '/eva'),
+                         '/eva/187070_eva.dat')
+
+    def test_mergeRuns(self):
+        output = mergeRuns(self.runs[::-1], self.tmpdir, 0.1, 100)
+        self.assertEqual(output, mergedPath(self.runs, self.tmpdir))
+        with EvaFile(output) as evafile:
+            counts = evafile.countMatrix()
+            timestamps = evafile.timestamps()
+
+        first, firsttimes = self.convert(self.runs[0])
+        second, secondtimes = self.convert(self.runs[1])
+        # the first run is padded to whole scans of 5 cycles
+        self.assertEqual(len(counts), 25 + 20)
+        self.assertTrue((counts[:23] == first).all())
+        self.assertEqual(counts[23:25].sum(), 0)
+        self.assertTrue((counts[25:] == second).all())
+        self.assertEqual(list(timestamps[:23]), list(firsttimes))
+        self.assertEqual(list(timestamps[23:25]), [1381000011] * 2)
+        self.assertEqual(list(timestamps[25:]), list(secondtimes))
+
+    def test_mergeRuns_incompatible(self):
+        other = os.path.join(self.tmpdir, '187072.mid')
+        writeSyntheticRun(other, numcycles=20, numfreqsteps=4,
+                          starttime=1381002000)
+        self.assertRaises(MergeError, mergeRuns, self.runs + [other],
+                          self.tmpdir)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['187070.mid', '187071.mid', '187072.mid'])
+
+    def test_mergeRuns_rftimes(self):
+        other = os.path.join(self.tmpdir, '187072.mid')
+        writeSyntheticRun(other, numcycles=20, numfreqsteps=5,
+                          starttime=1381002000, rftimes=(100.0, 50.0, 30.0))
+        try:
+            mergeRuns(self.runs + [other], self.tmpdir)
+        except MergeError as err:
+            self.assertEqual(err.filename, other)
+            self.assertTrue(err.reason.startswith('trf is'))
+        else:
+            self.fail('MergeError not raised')
+
+    def test_mergeRun_dropped(self):
+        # 7 cycles binned, 2 of them dropped: pad to 10, not to 5 + 5
+        def iterCycleHistograms(binwidth, maxtof, onerror):
+            run.cyclesbinned = 7
+            yield np.ones((5, 10), np.uint32)
+        run = mock.Mock(filename='187070.mid', starttime=1381000000,
+                        endtime=1381000010, metrics=RunMetrics('merged'),
+                        iterCycleHistograms=iterCycleHistograms)
+        with open(os.path.join(self.tmpdir, 'merged'), 'w+b') as datafile:
+            mergeRun(run, datafile, 0.1, 1, 'drop', 5, False)
+        self.assertEqual(run.metrics.info['runs'],
+                         [{'filename': '187070.mid', 'cycles': 5,
+                           'padding': 3}])
+
+    def test_main(self):
+        out = StringIO()
+        metricsfile = os.path.join(self.tmpdir, 'metrics.json')
+        self.assertEqual(batch.mergeBatch(self.runs, self.tmpdir, 0.1, 100,
+                                          metricsfile=metricsfile, out=out),
+                         0)
+        self.assertTrue('Merged 2 runs' in out.getvalue())
+        self.assertTrue(os.path.isfile(mergedPath(self.runs, self.tmpdir)))
+        self.assertTrue(os.path.isfile(metricsfile))
+
+        self.assertRaises(SystemExit, batch.main,
+                          [self.tmpdir, '--merge', '--stream'])
+        self.assertEqual(batch.main([self.tmpdir, '--merge', '-o',
+                                     self.tmpdir]), 0)
+        self.assertTrue(os.path.getsize(mergedPath(self.runs,
+                                                   self.tmpdir)) > 0)
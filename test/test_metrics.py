@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import os
+import json
+import pstats
+import shutil
+import tempfile
+from unittest import TestCase
+
+from midas2eva.metrics import RunMetrics, timedStage
+
+
+class Converter:
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    @timedStage('convert')
+    def convert(self, events):
+        self.metrics.count('events', events)
+        with self.metrics.stage('write'):
+            self.metrics.count('byteswritten', 100)
+        return events
+
+
+class Tests(TestCase):
+    def test_stage(self):
+        finished = []
+        metrics = RunMetrics('run.mid',
+                             hooks=[lambda name, stage:
+                                    finished.append(name)])
+        converter = Converter(metrics)
+        self.assertEqual(converter.convert(5), 5)
+        converter.convert(7)
+        metrics.count('ignored')
+
+        self.assertEqual(finished, ['write', 'convert'] * 2)
+        record = json.loads(metrics.toJson(error=None))
+        self.assertEqual(record['filename'], 'run.mid')
+        self.assertEqual(list(metrics.stages), ['convert', 'write'])
+        self.assertEqual(record['stages']['convert']['calls'], 2)
+        self.assertEqual(record['stages']['convert']['events'], 12)
+        self.assertFalse('byteswritten' in record['stages']['convert'])
+        self.assertEqual(record['totals']['byteswritten'], 200)
+        # the nested 'write' stage is not counted again in the totals
+        self.assertEqual(record['totals']['calls'], 2)
+        self.assertEqual(record['totals']['events'], 12)
+        self.assertEqual(record['totals']['wall'],
+                         record['stages']['convert']['wall'])
+        self.assertTrue(record['stages']['convert']['wall'] >= 0)
+        self.assertEqual(record['error'], None)
+
+    def test_stage_raises(self):
+        metrics = RunMetrics()
+
+        def fail():
+            with metrics.stage('fail'):
+                raise ValueError
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(metrics.stages['fail']['calls'], 1)
+        self.assertEqual(metrics.running, [])
+
+    def test_dumpProfiles(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            metrics = RunMetrics(profile=True)
+            Converter(metrics).convert(1)
+            # the nested 'write' stage is profiled as part of 'convert'
+            self.assertEqual(list(metrics.profiles), ['convert'])
+            with metrics.stage('write'):
+                pass
+            metrics.dumpProfiles(os.path.join(tmpdir, 'run'))
+            self.assertEqual(sorted(os.listdir(tmpdir)),
+                             ['run.convert.prof', 'run.write.prof'])
+            stats = pstats.Stats(os.path.join(tmpdir, 'run.convert.prof'))
+            self.assertEqual([stat[1] for func, stat in stats.stats.items()
+                              if func[2] == 'count'], [2])
+        finally:
+            shutil.rmtree(tmpdir)
@@ -1,8 +1,18 @@
 #!/usr/bin/env python
 
+import os
+import shutil
+import tempfile
 import mock
+import numpy as np
+from StringIO import StringIO
 from unittest import TestCase
 import midas2eva
+from midas2eva.events import EVENT_DTYPE, EventFilter, tofTicks
+from midas2eva.midasfile import MidasFile
+from midas2eva.eva import EvaFile
+from midas2eva.columnar import loadColumnar
+from test_midasfile import makeDataEvent
 
 
 class Tests(TestCase):
@@ -50,18 +60,26 @@ class Tests(TestCase):
                      '</dir>\n' +
                      '</odb>\n')
 
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, "afilename.mid")
+        with open(filename, 'w') as datafile:
+            datafile.write(simplexml.replace('34539', '1', 1))
+
         m_os.path.isfile.return_value = True
-        mym2e = midas2eva.MidasToEva("afilename.mid")
-        _open = mock.mock_open()
+        mym2e = midas2eva.MidasToEva(filename)
         # Test opening a file
-        with mock.patch("__builtin__.open", _open):
-            _open.return_value.read.return_value = simplexml
-            mym2e.extractXML()
+        mym2e.extractXML()
+        shutil.rmtree(tmpdir)
 
         result = mym2e.domag.find("./dir/dir/dir/[@name='12665']")\
             .find("key/[@name='Hardware type']").text
         expected = "44"
         self.assertEqual(result, expected)
+        result = mym2e.dom2ag.find("./dir/dir/dir/[@name='12665']")\
+            .find("key/[@name='Server Port']").text
+        self.assertEqual(result, "34539")
+
+        _open = mock.mock_open()
 
         # Test with fail on opening file
         with mock.patch("__builtin__.open", _open):
@@ -76,6 +94,29 @@ class Tests(TestCase):
             mym2e.extractXML()
         _open2.return_value.read.assert_not_called()
 
+    @mock.patch('midas2eva.midas2eva.os')
+    def test_extractXML_keys(self, m_os):
+        odb = ('<odb root="/"><dir name="Experiment">' +
+               '<dir name="Variables">' +
+               '<key name="Species" type="STRING">1K39</key>' +
+               '</dir><dir name="Big"><key name="x" type="INT">1</key>' +
+               '</dir></dir></odb>\n')
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, "afilename.mid")
+        with open(filename, 'w') as datafile:
+            datafile.write(odb + odb.replace('1K39', '1K41'))
+
+        m_os.path.isfile.return_value = True
+        mym2e = midas2eva.MidasToEva(filename)
+        mym2e.extractXML(keys=midas2eva.midas2eva.ODB_KEYS)
+        shutil.rmtree(tmpdir)
+
+        self.assertEqual(mym2e.domag.keys(), ['/Experiment/Variables/Species'])
+        mym2e.getElem()
+        self.assertEqual(mym2e.mass, '1K39')
+        self.assertEqual(mym2e.getAttribute(mym2e.dom2ag, './dir/dir',
+                                            'Variables', 'Species'), '1K41')
+
     def test_getAttribute(self):
         myxmlfind2 = mock.MagicMock()
         myxmlfind2.text = "a"
@@ -264,6 +305,27 @@ class Tests(TestCase):
         self.M2E.getRFTime(0.1)
         self.assertEqual(self.M2E.trf, 0.1)
 
+    def test_getRFTime_odbindex(self):
+        quad = ('<dir name="transition_QUAD%d">' +
+                '<key name="time offset (ms)" type="DOUBLE">%s</key></dir>')
+        odb = ('<odb root="/"><dir name="Equipment"><dir name="Sequencer">' +
+               '<dir name="Settings">' + quad % (2, '100') +
+               quad % (4, '50') + quad % (8, '1000') +
+               '</dir></dir></dir></odb>')
+        self.M2E.domag = midas2eva.midas2eva.ET.fromstring(odb)
+        self.M2E.odbindexes = {self.M2E.domag:
+                               midas2eva.midas2eva.OdbIndex(self.M2E.domag)}
+
+        self.M2E.getRFTime()
+        self.assertEqual(self.M2E.trf, 0.15)
+        result = self.M2E.getAttribute(self.M2E.domag, './dir/dir/dir/dir',
+                                       'transition_QUAD8', 'time offset (ms)',
+                                       float)
+        self.assertEqual(result, 1000.0)
+        self.assertRaises(Exception, self.M2E.getAttribute, self.M2E.domag,
+                          './dir/dir/dir', 'transition_QUAD8',
+                          'time offset (ms)')
+
     def test_setTdcGateWidth(self):
         self.M2E.getAttribute = mock.MagicMock(return_value=0.1)  # in ms
         self.M2E.domag = ""
@@ -283,7 +345,10 @@ class Tests(TestCase):
                                                "(1000000, 20, 3)")
         self.M2E.dom2ag = "dom2ag"
 
-        result = self.M2E.genFreqList()
+        # called for every binning, so it does not print the list
+        with mock.patch('sys.stdout', new_callable=StringIO) as m_stdout:
+            result = self.M2E.genFreqList()
+        self.assertEqual(m_stdout.getvalue(), '')
         expected = [999980.0, 1000000.0, 1000020.0]
         self.assertEqual(result, expected)
         self.M2E.getAttribute.assert_called_once_with(self.M2E.dom2ag,
@@ -299,3 +364,432 @@ class Tests(TestCase):
         result = self.M2E.genFreqList()
         expected = [999980.0, 1000000.0, 1000020.0]
         self.assertEqual(result, expected)
+
+    def test_reorganizeMdumpData(self):
+        self.M2E.mdumpdata = np.array([0x80010000, 0x00000000,
+                                       0x2001ffff, 0x00000457,
+                                       0x6001abcd, 0x00001000,
+                                       0x30010000, 0x00000000,
+                                       0x0002ffff], dtype=np.uint32)
+
+        self.M2E.reorganizeMdumpData()
+        table = self.M2E.mdumparray
+        self.assertEqual(list(table['type']), [8, 2, 4, 1])
+        self.assertEqual(list(table['cycle']), [1, 1, 1, 1])
+        self.assertEqual(list(table['tof']), [0, 0x457, 0x1000, 0])
+        self.assertEqual(list(self.M2E.errarray), [0x6001abcd, 0x30010000])
+
+    def test_reorganizeMdumpData_filter(self):
+        self.M2E.mdumpdata = np.array([0x80010000, 0x00000000,
+                                       0x2001ffff, 0x00000457,
+                                       0x2001ffff, 0x00000010,
+                                       0x6001abcd, 0x00001000,
+                                       0x30010000, 0x00000000,
+                                       0x0002ffff], dtype=np.uint32)
+
+        eventfilter = EventFilter(0x100, 0x1000)
+        self.M2E.reorganizeMdumpData(eventfilter)
+        table = self.M2E.mdumparray
+        self.assertEqual(list(table['type']), [8, 2, 1])
+        self.assertEqual(list(table['tof']), [0, 0x457, 0])
+        # the error word of the dropped out-of-gate ion is still kept
+        self.assertEqual(list(self.M2E.errarray), [0x6001abcd, 0x30010000])
+        self.assertEqual(eventfilter.rejected, {'tof': 1, 'outofgate': 1})
+
+        self.M2E.reorganizeMdumpData(EventFilter(outofgate=True))
+        self.assertEqual(list(self.M2E.mdumparray['type']), [8, 2, 2, 4, 1])
+        self.assertEqual(tofTicks(20.0, 0.5), (50, 2001))
+
+    def test_binMdumpData(self):
+        self.M2E.mdumparray = np.array([(8, 1, 0), (2, 1, 25), (1, 1, 0),
+                                        (8, 2, 0), (2, 2, 5), (2, 2, 6),
+                                        (1, 2, 0), (2, 3, 7)],
+                                       dtype=EVENT_DTYPE)
+        self.M2E.binMdumpData(binwidth=0.1, maxtof=1)
+        self.assertEqual(self.M2E.numchannels, 10)
+        self.assertEqual(self.M2E.bindata.shape, (2, 10))
+        self.assertEqual(list(self.M2E.bindata[0]),
+                         [0, 0, 1, 0, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(list(self.M2E.bindata[1]),
+                         [2, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+
+        # gate closed with an older counter
+        self.M2E.mdumparray['cycle'][2] = 0
+        self.assertRaises(midas2eva.midas2eva.MissingTDCClose,
+                          self.M2E.binMdumpData)
+
+        # missing TDCOpen for cycle 2
+        self.M2E.mdumparray['cycle'][2] = 1
+        self.M2E.mdumparray['type'][3] = 2
+        self.assertRaises(midas2eva.midas2eva.MissingTDCOpen,
+                          self.M2E.binMdumpData)
+
+        # cycle 2 never made it into the data
+        self.M2E.mdumparray['type'][3] = 8
+        self.M2E.mdumparray['cycle'][3:7] = 3
+        self.assertRaises(midas2eva.midas2eva.MissingEvent,
+                          self.M2E.binMdumpData)
+
+    def test_binMdumpData_onerror(self):
+        # the gate of cycle 2 closes with an older counter, cycle 4 is lost
+        self.M2E.mdumparray = np.array([(8, 1, 0), (2, 1, 25), (1, 1, 0),
+                                        (8, 2, 0), (2, 2, 55), (1, 1, 0),
+                                        (8, 3, 0), (2, 3, 65), (1, 3, 0),
+                                        (8, 5, 0), (2, 5, 75), (1, 5, 0)],
+                                       dtype=EVENT_DTYPE)
+        self.assertEqual([defect.kind for defect in self.M2E.validateGates()],
+                         ['MissingTDCClose', 'MissingEvent'])
+
+        self.M2E.binMdumpData(binwidth=0.1, maxtof=1, onerror='flag')
+        self.assertEqual(list(self.M2E.badcycles), [1, 3])
+        self.assertEqual(self.M2E.bindata.shape, (4, 10))
+
+        self.M2E.binMdumpData(binwidth=0.1, maxtof=1, onerror='drop')
+        self.assertEqual(list(self.M2E.badcycles), [1, 3])
+        self.assertEqual(list(self.M2E.bindata.argmax(axis=1)), [2, 6])
+        self.assertEqual(
+            self.M2E.metrics.stages['binMdumpData']['cyclesdropped'], 2)
+
+        self.assertRaises(ValueError, self.M2E.binMdumpData, 0.1, 1, 'skip')
+
+
+class StreamTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'run.mid')
+
+        rng = np.random.RandomState(1)
+        events = []
+        for cycle in range(1, 30):
+            words = [0x80000000 | (cycle << 16), 0]
+            for tof in rng.randint(0, 3000, rng.randint(0, 20)):
+                words += [0x20000000 | (cycle << 16), tof]
+            words += [0x10000000 | (cycle << 16), 0]
+            # split some events over two banks
+            events.append(makeDataEvent([('MPET', words[:3]),
+                                         ('MPET', words[3:])]))
+        with open(self.filename, 'wb') as datafile:
+            datafile.write(''.join(events))
+
+        self.M2E = midas2eva.MidasToEva(self.filename)
+        self.M2E.mass = '1K39'
+        self.M2E.charge = 1
+        self.M2E.amplitude = 0.5
+        self.M2E.trf = 0.1
+        self.M2E.startfreq = 1000000.0
+        self.M2E.stopfreq = 1000100.0
+        self.M2E.numfreqsteps = 5.0
+        self.M2E.starttime = 1000.0
+        self.M2E.endtime = 1057.0
+        self.M2E.genFreqList = mock.MagicMock(return_value=[1.0] * 5)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_iterCycleHistograms(self):
+        self.M2E.collectMdumpData()
+        self.M2E.reorganizeMdumpData()
+        self.M2E.binMdumpData(0.1, 20)
+
+        hists = list(self.M2E.iterCycleHistograms(0.1, 20, chunkwords=7))
+        self.assertTrue(len(hists) > 1)
+        self.assertTrue((np.concatenate(hists) == self.M2E.bindata).all())
+
+    def test_streamEvaFile(self):
+        self.M2E.collectMdumpData()
+        self.M2E.reorganizeMdumpData()
+        self.M2E.binMdumpData(0.1, 20)
+        os.mkdir(os.path.join(self.tmpdir, 'a'))
+        self.M2E.writeEvaFile(None, None, None, None,
+                              os.path.join(self.tmpdir, 'a/'))
+
+        os.mkdir(os.path.join(self.tmpdir, 'b'))
+        self.M2E.streamEvaFile(0.1, 20, os.path.join(self.tmpdir, 'b/'))
+
+        with open(os.path.join(self.tmpdir, 'a', 'run_eva.dat')) as a:
+            with open(os.path.join(self.tmpdir, 'b', 'run_eva.dat')) as b:
+                self.assertEqual(a.read(), b.read())
+
+    def test_metrics(self):
+        self.M2E.collectMdumpData()
+        self.M2E.reorganizeMdumpData()
+        self.M2E.binMdumpData(0.1, 20)
+        self.M2E.writeEvaFile(None, None, None, None, self.tmpdir + '/')
+        self.M2E.streamEvaFile(0.1, 20, self.tmpdir + '/')
+
+        stages = self.M2E.metrics.record()['stages']
+        self.assertEqual(stages['collectMdumpData']['bytesread'],
+                         os.path.getsize(self.filename))
+        self.assertEqual(stages['reorganizeMdumpData']['events'],
+                         len(self.M2E.mdumparray))
+        binned = stages['binMdumpData']
+        self.assertEqual(binned['cycles'], 29)
+        self.assertEqual(binned['ionsbinned'], self.M2E.bindata.sum())
+        self.assertEqual(binned['ions'],
+                         binned['ionsbinned'] + binned['ionscut'])
+        self.assertTrue(binned['ionscut'] > 0)
+
+        streamed = stages['streamEvaFile']
+        for key in ('bytesread', 'words', 'events', 'errors'):
+            self.assertEqual(streamed[key], sum(stage.get(key, 0)
+                                                for stage in stages.values()
+                                                if stage is not streamed))
+        for key in ('cycles', 'ions', 'ionsbinned', 'ionscut'):
+            self.assertEqual(streamed[key], binned[key])
+        self.assertEqual(streamed['byteswritten'],
+                         stages['writeEvaFile']['byteswritten'])
+
+    def test_streamEvaFile_onerror(self):
+        # drop two cycles from the run; the second is split over two banks
+        with open(self.filename, 'rb') as datafile:
+            data = datafile.read()
+        events = list(MidasFile(self.filename).iterEvents())
+        offset10, offset20 = events[10][0], events[20][0]
+        with open(self.filename, 'wb') as datafile:
+            datafile.write(data[:offset10] + data[events[11][0]:offset20]
+                           + data[events[21][0]:])
+
+        self.M2E.collectMdumpData()
+        self.M2E.reorganizeMdumpData()
+        self.M2E.binMdumpData(0.1, 20, onerror='drop')
+        self.assertEqual(list(self.M2E.badcycles), [10, 19])
+        self.M2E.writeEvaFile(None, None, None, None, self.tmpdir + '/')
+        with open(os.path.join(self.tmpdir, 'run_eva.dat')) as a:
+            expected = a.read()
+
+        hists = list(self.M2E.iterCycleHistograms(0.1, 20, chunkwords=7,
+                                                  onerror='drop'))
+        self.assertTrue((np.concatenate(hists) == self.M2E.bindata).all())
+
+        self.M2E.streamEvaFile(0.1, 20, self.tmpdir + '/', onerror='drop')
+        self.assertEqual(list(self.M2E.badcycles), [10, 19])
+        with open(os.path.join(self.tmpdir, 'run_eva.dat')) as b:
+            self.assertEqual(b.read(), expected)
+
+    def test_streamEvaFile_gateDefects(self):
+        # cycle 5 lost its TDCOpen and cycle 12 has a stale TDCClose
+        events = []
+        for cycle in range(1, 20):
+            words = [0x80000000 | (cycle << 16), 0,
+                     0x20000000 | (cycle << 16), 100 * cycle,
+                     0x10000000 | (cycle << 16), 0]
+            if cycle == 5:
+                words = words[2:]
+            elif cycle == 12:
+                words[4] = 0x10000000 | (11 << 16)
+            events.append(makeDataEvent([('MPET', words)]))
+        with open(self.filename, 'wb') as datafile:
+            datafile.write(''.join(events))
+
+        self.M2E.collectMdumpData()
+        self.M2E.reorganizeMdumpData()
+        self.M2E.binMdumpData(0.1, 20, onerror='drop')
+        self.assertEqual([(defect.cycle, defect.kind)
+                          for defect in self.M2E.gatedefects],
+                         [(4, 'MissingTDCOpen'), (11, 'MissingTDCClose')])
+        bindata = self.M2E.bindata
+
+        # the gate defects do not depend on where the batches end
+        for chunkwords in range(1, 13):
+            hists = list(self.M2E.iterCycleHistograms(
+                0.1, 20, chunkwords=chunkwords, onerror='drop'))
+            self.assertEqual(list(self.M2E.badcycles), [4, 11])
+            self.assertTrue((np.concatenate(hists) == bindata).all())
+
+    def test_stepSpectra(self):
+        self.M2E.collectMdumpData()
+        self.M2E.reorganizeMdumpData()
+        self.M2E.binMdumpData(0.1, 20)
+        self.assertEqual(self.M2E.stepdata.shape, (5, 200))
+        for step in range(5):
+            self.assertTrue((self.M2E.stepdata[step]
+                             == self.M2E.bindata[step::5].sum(axis=0)).all())
+        self.assertEqual(self.M2E.stepions.sum(), self.M2E.bindata.sum())
+        stepdata = self.M2E.stepdata
+
+        self.M2E.streamEvaFile(0.1, 20, self.tmpdir + '/')
+        self.assertTrue((self.M2E.stepdata == stepdata).all())
+        self.M2E.binParallel(0.1, 20, jobs=2)
+        self.assertTrue((self.M2E.stepdata == stepdata).all())
+
+        # dropped cycles stay on their own steps
+        self.M2E.resetStepSpectra()
+        self.M2E.foldStepSpectra(self.M2E.bindata, 0,
+                                 [mock.Mock(cycle=3)], 'drop')
+        self.assertTrue((self.M2E.stepdata[3]
+                         == stepdata[3] - self.M2E.bindata[3]).all())
+
+        # no run parameters, no frequency steps
+        self.M2E.genFreqList.side_effect = AttributeError
+        self.M2E.binMdumpData(0.1, 20)
+        self.assertEqual(self.M2E.stepdata, None)
+
+    def test_eventFilter(self):
+        self.M2E.collectMdumpData()
+        self.M2E.reorganizeMdumpData()
+        self.M2E.binMdumpData(0.1, 20)
+        bindata = self.M2E.bindata
+        errarray = self.M2E.errarray
+
+        self.M2E.reorganizeMdumpData(EventFilter(*tofTicks(20)))
+        self.M2E.binMdumpData(0.1, 20)
+        self.assertTrue((self.M2E.bindata == bindata).all())
+        self.assertTrue((self.M2E.errarray == errarray).all())
+        stage = self.M2E.metrics.stages['reorganizeMdumpData']
+        self.assertTrue(stage['rejectedtof'] > 0)
+        self.assertEqual(len(self.M2E.mdumparray) + stage['rejectedtof'],
+                         len(self.M2E.mdumpdata) // 2)
+
+        # a narrower window, pushed down into the streamed decoding
+        eventfilter = EventFilter(*tofTicks(15, 5))
+        hists = list(self.M2E.iterCycleHistograms(0.1, 20, chunkwords=7,
+                                                  eventfilter=eventfilter))
+        self.assertTrue((np.concatenate(hists)[:, 50:150]
+                         == bindata[:, 50:150]).all())
+        self.assertEqual(np.concatenate(hists).sum(),
+                         bindata[:, 50:150].sum())
+        self.assertEqual(self.M2E.numerrors, len(errarray))
+
+    def test_quickLook(self):
+        self.M2E.collectMdumpData()
+        self.M2E.reorganizeMdumpData()
+        self.M2E.binMdumpData(0.1, 20)
+        bindata = self.M2E.bindata
+        stepdata = self.M2E.stepdata
+
+        summary = self.M2E.quickLook(0.1, 20)
+        self.assertTrue((self.M2E.bindata == bindata).all())
+        self.assertTrue((self.M2E.stepdata == stepdata).all())
+        self.assertEqual(list(self.M2E.stepcycles), [6, 6, 6, 6, 5])
+        self.assertEqual(summary['cycles'], 29)
+        self.assertEqual(summary['fraction'], 1.0)
+        self.assertTrue(summary['complete'])
+        self.assertEqual(self.M2E.metrics.info['quicklook'], summary)
+
+        summary = self.M2E.quickLook(0.1, 20, maxcycles=10)
+        self.assertTrue((self.M2E.bindata == bindata[:10]).all())
+        self.assertEqual(summary['ions'], bindata[:10].sum())
+        self.assertFalse(summary['complete'])
+
+        # every third event, with the cycles found from the gate counters
+        summary = self.M2E.quickLook(0.1, 20, stride=3)
+        self.assertEqual(list(self.M2E.samplecycles), range(0, 29, 3))
+        self.assertTrue((self.M2E.bindata == bindata[::3]).all())
+        self.assertTrue((self.M2E.stepdata[0]
+                         == bindata[0:29:15].sum(axis=0)).all())
+        self.assertEqual(list(self.M2E.stepcycles), [2, 2, 2, 2, 2])
+        self.assertAlmostEqual(self.M2E.steprate[3],
+                               bindata[[3, 18]].sum() / 2.0)
+        self.assertTrue(0.3 < summary['fraction'] < 0.4)
+
+    def test_verifyEvaFile(self):
+        self.M2E.collectMdumpData()
+        self.M2E.reorganizeMdumpData()
+        self.M2E.binMdumpData(0.1, 20)
+        self.M2E.streamEvaFile(0.1, 20, self.tmpdir + '/')
+        self.assertEqual(self.M2E.verifyEvaFile(self.tmpdir + '/'), [])
+
+        evafilename = os.path.join(self.tmpdir, 'run_eva.dat')
+        with EvaFile(evafilename) as evafile:
+            self.assertEqual(evafile.sections['MCA']['Channels'], '200')
+            self.assertEqual(list(evafile.frequencies), [1.0] * 5)
+            self.assertTrue((evafile.countMatrix()
+                             == self.M2E.bindata).all())
+            offset = int(evafile.offsets[3])
+
+        # bump the timestamp of the fourth cycle
+        with open(evafilename, 'r+b') as datafile:
+            datafile.seek(offset + 2)
+            datafile.write('\xff')
+        self.assertEqual(self.M2E.verifyEvaFile(self.tmpdir + '/'),
+                         ['cycle 3 timestamp differs'])
+
+    def test_writeColumnar(self):
+        self.M2E.collectMdumpData()
+        self.M2E.reorganizeMdumpData()
+        self.M2E.binMdumpData(0.1, 20)
+        self.M2E.writeColumnar(self.tmpdir + '/', words=True)
+
+        arrays, metadata = loadColumnar(os.path.join(self.tmpdir,
+                                                     'run_bins'))
+        self.assertTrue((arrays['counts'] == self.M2E.bindata).all())
+        self.assertTrue((arrays['timestamps']
+                         == self.M2E.cycleTimestamps()).all())
+        self.assertEqual(list(arrays['frequencies']), [1.0] * 5)
+        self.assertEqual(len(arrays['words']), len(self.M2E.mdumpdata))
+        self.assertEqual(metadata['numcycles'], 29)
+        self.assertEqual(metadata['mass'], '1K39')
+        self.assertEqual(metadata['numchannels'], 200)
+
+
+
+class PositionTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'run.mid')
+
+        # one cycle per MIDAS event, cycle k has k + 1 hits at (k, 2k)
+        events = []
+        for cycle in range(1, 6):
+            words = [0x80000000 | (cycle << 16), 0,
+                     0x20000000 | (cycle << 16), 100,
+                     0x10000000 | (cycle << 16), 0]
+            hits = [((cycle - 1) << 8) | (2 * cycle - 2)] * cycle
+            events.append(makeDataEvent([('MPET', words), ('MCPP', hits)]))
+        with open(self.filename, 'wb') as datafile:
+            datafile.write(''.join(events))
+
+        self.M2E = midas2eva.MidasToEva(self.filename)
+        self.M2E.numfreqsteps = 2.0
+        self.M2E.genFreqList = mock.MagicMock(return_value=[1.0, 2.0])
+        self.M2E.collectMdumpData()
+        self.M2E.reorganizeMdumpData()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_writePosData(self):
+        self.M2E.writePosData(self.tmpdir + '/')
+        with open(os.path.join(self.tmpdir, 'run_pos.dat')) as posfile:
+            text = posfile.read()
+        expected = ''.join('%d %d\n' % ((int(num) >> 8) & 0xff,
+                                        int(num) & 0xff)
+                           for num in self.M2E.posdata)
+        self.assertEqual(text, expected)
+
+    def test_positionImages(self):
+        image = self.M2E.positionImages()
+        self.assertEqual(image.shape, (1, 256, 256))
+        self.assertEqual(image.sum(), 15)
+        self.assertEqual(image[0, 8, 4], 5)
+
+        images = self.M2E.positionImages('cycle')
+        self.assertEqual(images.shape, (5, 256, 256))
+        for row in range(5):
+            self.assertEqual(images[row].sum(), row + 1)
+            self.assertEqual(images[row, 2 * row, row], row + 1)
+
+        steps = self.M2E.positionImages('step')
+        self.assertEqual(steps.shape, (2, 256, 256))
+        self.assertTrue((steps[0] == images[0] + images[2] + images[4]).all())
+        self.assertTrue((steps[1] == images[1] + images[3]).all())
+
+        # hits go to the same cycles when the filter has dropped the ions
+        self.M2E.reorganizeMdumpData(EventFilter(maxtof=50))
+        self.assertEqual(len(self.M2E.mdumparray), 10)
+        self.assertTrue((self.M2E.positionImages('cycle') == images).all())
+
+        self.assertRaises(ValueError, self.M2E.positionImages, 'scan')
+        self.M2E.poscounts = None
+        self.assertEqual(self.M2E.positionImages('cycle'), None)
+
+    def test_writePosImage(self):
+        self.M2E.writePosImage(self.tmpdir + '/', per='step', npz=True)
+        arrays, metadata = loadColumnar(os.path.join(self.tmpdir,
+                                                     'run_posimage.npz'))
+        self.assertEqual(arrays['image'].dtype, np.uint8)
+        self.assertTrue((arrays['image']
+                         == self.M2E.positionImages('step')).all())
+        self.assertEqual(list(arrays['frequencies']), [1.0, 2.0])
+        self.assertEqual(metadata['per'], 'step')
+        self.assertEqual(metadata['numhits'], 15)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+from midas2eva import midas2eva_se
+from midas2eva.midas2eva_se import SDA
+
+
+def referenceSda(startfreq, bindata):
+    lines = ['data:' + str(startfreq) + '\n']
+    for i in xrange(len(bindata)):
+        hist = bindata[i]
+        for j in np.flatnonzero(hist):
+            lines.append(str(i) + ' ' + str(j) + ' ' + str(hist[j]) + '\n')
+    return ''.join(lines)
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(self.tmpdir, 'run.mid')
+        open(filename, 'w').close()
+        self.SDA = SDA(filename)
+        self.SDA.startfreq = 1000050.0
+        self.SDA.bindata = np.random.RandomState(0).poisson(
+            0.4, (50, 30)).astype(np.uint32)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_sda_write(self):
+        chunkcycles = midas2eva_se.SDA_CHUNK_CYCLES
+        midas2eva_se.SDA_CHUNK_CYCLES = 7
+        try:
+            self.SDA.sda_write(self.tmpdir + '/')
+        finally:
+            midas2eva_se.SDA_CHUNK_CYCLES = chunkcycles
+        with open(os.path.join(self.tmpdir, 'run_se_test.dat')) as sdafile:
+            self.assertEqual(sdafile.read(),
+                             referenceSda(1000050.0, self.SDA.bindata))
+
+    def test_sda_write_binary(self):
+        self.SDA.sda_write(self.tmpdir + '/', binary=True)
+        data = np.load(os.path.join(self.tmpdir, 'run_se_test.npz'))
+        self.assertEqual(data['startfreq'], 1000050.0)
+        hist = np.zeros_like(self.SDA.bindata)
+        hist[data['cycle'], data['channel']] = data['count']
+        self.assertTrue((hist == self.SDA.bindata).all())
+        self.assertTrue((data['count'] > 0).all())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+from struct import pack
+from unittest import TestCase
+
+import numpy as np
+from midas2eva.midasfile import (MidasFile, MidasFileError, EVENTID_BOR,
+                                 EVENTID_EOR, MIDAS_MAGIC)
+
+
+def makeBank(name, words):
+    data = pack('<%dI' % len(words), *words)
+    padding = '\x00' * (-len(data) % 8)
+    return name + pack('<II', 6, len(data)) + data + padding
+
+
+def makeEvent(eventid, payload, serial=0, timestamp=0, triggermask=0):
+    return pack('<HHIII', eventid, triggermask, serial, timestamp,
+                len(payload)) + payload
+
+
+def makeDataEvent(banks, serial=0):
+    body = ''.join(makeBank(name, words) for name, words in banks)
+    return makeEvent(1, pack('<II', len(body), 0x11) + body, serial)
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'run.mid')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def writeFile(self, data):
+        with open(self.filename, 'wb') as datafile:
+            datafile.write(data)
+
+    def test_readBanks(self):
+        self.writeFile(makeEvent(EVENTID_BOR, '<odb root="/"></odb>\n') +
+                       makeDataEvent([('MPET', [0x80010000, 5]),
+                                      ('MCPP', [0x1234])]) +
+                       makeDataEvent([('MPET', [0x10010000, 7, 0x2, 9])]) +
+                       makeEvent(EVENTID_BOR + 1, '<odb></odb>'))
+
+        banks = MidasFile(self.filename).readBanks()
+        self.assertEqual(banks['MPET'].dtype, np.uint32)
+        self.assertEqual(list(banks['MPET']),
+                         [0x80010000, 5, 0x10010000, 7, 0x2, 9])
+        self.assertEqual(list(banks['MCPP']), [0x1234])
+
+        banks = MidasFile(self.filename).readBanks(('XXXX',))
+        self.assertEqual(len(banks['XXXX']), 0)
+
+    def test_readEventBanks(self):
+        self.writeFile(makeDataEvent([('MPET', [1, 2, 3, 4]),
+                                      ('MCPP', [5]), ('MCPP', [6, 7])]) +
+                       makeDataEvent([('MCPP', [8])]) +
+                       makeEvent(EVENTID_BOR + 1, '<odb></odb>') +
+                       makeDataEvent([('MPET', [9, 10])]))
+
+        banks, counts = MidasFile(self.filename).readEventBanks()
+        self.assertEqual(list(banks['MPET']), [1, 2, 3, 4, 9, 10])
+        self.assertEqual(list(banks['MCPP']), [5, 6, 7, 8])
+        self.assertEqual(list(counts['MPET']), [4, 0, 2])
+        self.assertEqual(list(counts['MCPP']), [3, 1, 0])
+
+    def test_hasEndOfRun(self):
+        bor = makeEvent(EVENTID_BOR, '<odb></odb>', 0, 0, MIDAS_MAGIC)
+        eor = makeEvent(EVENTID_EOR, '<odb></odb>', 2, 0, MIDAS_MAGIC)
+        data = makeDataEvent([('MPET', [EVENTID_EOR | MIDAS_MAGIC << 16])])
+        midasfile = MidasFile(self.filename)
+
+        self.writeFile(bor + data)
+        self.assertFalse(midasfile.hasEndOfRun())
+        self.writeFile(bor + data + eor[:-2])
+        self.assertFalse(midasfile.hasEndOfRun())
+        self.writeFile(bor + data + eor)
+        self.assertTrue(midasfile.hasEndOfRun())
+        self.assertTrue(midasfile.hasEndOfRun(window=len(eor)))
+        self.writeFile('')
+        self.assertFalse(midasfile.hasEndOfRun())
+
+    def test_iterEvents_truncated(self):
+        event = makeDataEvent([('MPET', [1, 2])])
+        self.writeFile(event + event[:-3])
+
+        events = list(MidasFile(self.filename).iterEvents())
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0][0], 0)
+        self.assertEqual(events[0][1].datasize, len(event) - 16)
+
+    def test_iterEvents_stride(self):
+        events = [makeDataEvent([('MPET', [serial, 0])], serial)
+                  for serial in range(5)]
+        self.writeFile(''.join(events))
+
+        midasfile = MidasFile(self.filename)
+        events = list(midasfile.iterEvents(stride=2))
+        self.assertEqual([header.serial for offset, header, payload in events],
+                         range(5))
+        self.assertEqual([payload is None for offset, header, payload
+                          in events], [False, True, False, True, False])
+        self.assertEqual(events[3][0], 3 * (16 + events[0][1].datasize))
+        self.assertEqual(midasfile.bytesread,
+                         5 * 16 + 3 * events[0][1].datasize)
+
+    def test_iterBanks_corrupt(self):
+        payload = pack('<II', 64, 0x11) + makeBank('MPET', [1, 2])
+        self.writeFile('')
+        midasfile = MidasFile(self.filename)
+        self.assertRaises(MidasFileError, list,
+                          midasfile.iterBanks(payload))
+
+    def test_readOdbDumps(self):
+        bor = '<odb root="/"><key name="a">1</key></odb>\n'
+        eor = '<odb root="/"><key name="a">2</key></odb>\n'
+        data = (makeEvent(EVENTID_BOR, bor) +
+                makeDataEvent([('MPET', [1, 2] * 100)]) +
+                makeEvent(EVENTID_BOR + 1, eor))
+        self.writeFile(data)
+        midasfile = MidasFile(self.filename)
+
+        expected = (bor.strip(), eor.strip())
+        self.assertEqual(midasfile.readOdbDumps(), expected)
+        # windows too small to hold the dumps fall back to a full scan
+        self.assertEqual(midasfile.readOdbDumps(window=30), expected)
+
+        self.writeFile(makeEvent(EVENTID_BOR, bor))
+        self.assertEqual(midasfile.readOdbDumps(window=30),
+                         (bor.strip(), bor.strip()))
+
+        # an end-of-run dump still being written is skipped
+        partial = data[:data.rfind('</odb>') - 5]
+        self.writeFile(partial)
+        self.assertEqual(midasfile.readOdbDumps(), (bor.strip(), bor.strip()))
+        self.assertEqual(midasfile.readOdbDumps(window=30),
+                         (bor.strip(), bor.strip()))
+
+        self.writeFile('')
+        self.assertEqual(midasfile.readOdbDumps(), ('', ''))
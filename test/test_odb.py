@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+import xml.etree.cElementTree as ET
+
+from midas2eva.odb import (OdbIndex, OdbPattern, matchPath, castOdbValue,
+                           parseOdb)
+
+ODB = '''<odb root="/">
+<dir name="Experiment">
+  <dir name="Variables">
+    <key name="Species" type="STRING" size="32">1K39</key>
+    <key name="StartFreq (MHz)" type="DOUBLE">1.5</key>
+    <key name="Enabled" type="BOOL">y</key>
+    <keyarray name="Gains" type="INT" num_values="2">
+      <value index="0">3</value>
+      <value index="1">4</value>
+    </keyarray>
+  </dir>
+</dir>
+<dir name="Other">
+  <dir name="Variables">
+    <key name="Species" type="STRING" size="32">2K39</key>
+    <key name="Extra" type="INT">7</key>
+  </dir>
+</dir>
+<dir name="Runinfo">
+  <key name="Start time binary" type="DWORD">1381000000</key>
+</dir>
+</odb>'''
+
+
+# several transitions, and a key after a subdirectory
+NESTED_ODB = '''<odb root="/">
+<dir name="Equipment">
+  <dir name="MPET">
+    <dir name="Settings">
+      <dir name="transition_QUAD2">
+        <key name="time offset (ms)" type="DOUBLE">100</key>
+      </dir>
+      <dir name="transition_QUAD4">
+        <key name="time offset (ms)" type="DOUBLE">50</key>
+      </dir>
+      <dir name="transition_QUAD6">
+        <dir name="extra">
+          <key name="unused" type="INT">1</key>
+        </dir>
+        <key name="time offset (ms)" type="DOUBLE">25</key>
+      </dir>
+    </dir>
+  </dir>
+  <dir name="Variables">
+    <dir name="Sub">
+      <key name="Inner" type="INT">1</key>
+    </dir>
+    <key name="Charge" type="STRING">1</key>
+  </dir>
+</dir>
+</odb>'''
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.index = OdbIndex(ET.fromstring(ODB))
+
+    def test_values(self):
+        self.assertEqual(self.index['/Experiment/Variables/Species'], '1K39')
+        self.assertEqual(self.index['/Experiment/Variables/StartFreq (MHz)'],
+                         1.5)
+        self.assertEqual(self.index['/Experiment/Variables/Enabled'], True)
+        self.assertEqual(self.index['/Experiment/Variables/Gains'], [3, 4])
+        self.assertEqual(self.index['/Runinfo/Start time binary'],
+                         1381000000)
+        self.assertEqual(self.index.texts['/Experiment/Variables/StartFreq '
+                                          '(MHz)'], '1.5')
+        self.assertTrue('/Other/Variables/Extra' in self.index)
+        self.assertEqual(self.index.get('/Nope'), None)
+        self.assertEqual(len(self.index), 7)
+
+    def test_keys(self):
+        self.assertEqual(self.index.keys('/*/Variables/Species'),
+                         ['/Experiment/Variables/Species',
+                          '/Other/Variables/Species'])
+        self.assertEqual(self.index.keys('/Runinfo/*'),
+                         ['/Runinfo/Start time binary'])
+        self.assertEqual(self.index.keys()[0], '/Experiment/Variables/Species')
+
+    def test_find(self):
+        # like find('./dir/dir/[@name='Variables']'), the first one wins
+        self.assertEqual(self.index.find(2, 'Variables', 'Species'),
+                         '/Experiment/Variables/Species')
+        self.assertEqual(self.index.find(2, 'Variables', 'Extra'), None)
+        self.assertEqual(self.index.find(2, 'Variables', 'Gains'), None)
+        self.assertEqual(self.index.find(1, 'Runinfo', 'Start time binary'),
+                         '/Runinfo/Start time binary')
+        self.assertEqual(self.index.find(1, 'Variables', 'Species'), None)
+
+    def test_matchPath(self):
+        self.assertTrue(matchPath('/a/*/c', '/a/b/c'))
+        self.assertFalse(matchPath('/a/*', '/a/b/c'))
+        self.assertTrue(matchPath('/a/transition_QUAD*/t',
+                                  '/a/transition_QUAD4/t'))
+
+    def test_castOdbValue(self):
+        self.assertEqual(castOdbValue('INT', '12'), 12)
+        self.assertEqual(castOdbValue('FLOAT', 'x'), 'x')
+        self.assertEqual(castOdbValue('BOOL', 'n'), False)
+        self.assertEqual(castOdbValue('UNKNOWN', None), '')
+
+    def test_parseOdb(self):
+        index = parseOdb(ODB, ['/*/Variables/*', '/Runinfo/*'])
+        self.assertEqual(index.keys(),
+                         ['/Experiment/Variables/Species',
+                          '/Experiment/Variables/StartFreq (MHz)',
+                          '/Experiment/Variables/Enabled',
+                          '/Experiment/Variables/Gains',
+                          '/Runinfo/Start time binary'])
+        self.assertEqual(index['/Experiment/Variables/Gains'], [3, 4])
+        self.assertEqual(index.find(2, 'Variables', 'Species'),
+                         '/Experiment/Variables/Species')
+
+    def test_parseOdb_stops_early(self):
+        # everything after the requested keys is never parsed
+        broken = ODB.replace('<dir name="Runinfo">', '<dir name="Runinfo"><')
+        index = parseOdb(broken, ['/Experiment/Variables/StartFreq (MHz)',
+                                  '/Experiment/Variables/*'])
+        self.assertEqual(len(index), 4)
+
+        index = parseOdb(broken, ['/*/Variables/Species'])
+        self.assertEqual(index.keys(), ['/Experiment/Variables/Species'])
+
+        self.assertRaises(SyntaxError, parseOdb, broken, ['/Runinfo/*'])
+
+    def test_parseOdb_nested(self):
+        index = parseOdb(NESTED_ODB, ['/*/*/*/transition_QUAD*/*',
+                                      '/*/Variables/*'])
+        self.assertEqual(index.keys('/*/*/*/*/time offset (ms)'),
+                         ['/Equipment/MPET/Settings/transition_QUAD%d/'
+                          'time offset (ms)' % num for num in (2, 4, 6)])
+        self.assertEqual(index['/Equipment/Variables/Charge'], '1')
+
+    def test_OdbPattern(self):
+        # closeDir gets the depth of the directory that closed
+        pattern = OdbPattern('/a/b*/c')
+        self.assertTrue(pattern.match('/a/b1/c'))
+        pattern.closeDir(2)
+        self.assertFalse(pattern.done)
+        self.assertTrue(pattern.match('/a/b2/c'))
+        pattern.closeDir(1)
+        self.assertTrue(pattern.done)
+        self.assertFalse(pattern.match('/a/b3/c'))
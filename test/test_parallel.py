@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import mock
+import numpy as np
+import midas2eva
+from midas2eva.midas2eva import MissingEvent
+from midas2eva.parallel import splitRun, binRunParallel
+from midas2eva.synthetic import writeSyntheticRun
+from test_midasfile import makeDataEvent
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'run.mid')
+        # enough cycles for the counters to wrap at 1024
+        writeSyntheticRun(self.filename, numcycles=1500, ionspercycle=4,
+                          cyclesperevent=7, maxtof=30.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def serial(self, binwidth=0.1, maxtof=20):
+        m2e = midas2eva.MidasToEva(self.filename)
+        m2e.collectMdumpData()
+        m2e.reorganizeMdumpData()
+        m2e.binMdumpData(binwidth, maxtof)
+        return m2e
+
+    def test_splitRun(self):
+        chunks = splitRun(self.filename, 10)
+        self.assertEqual(len(chunks), 10)
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], None)
+        for (start, end), (nextstart, nextend) in zip(chunks, chunks[1:]):
+            self.assertEqual(end, nextstart)
+        self.assertEqual(splitRun(self.filename, 1), [(0, None)])
+
+    def test_binRunParallel(self):
+        m2e = self.serial()
+        for numchunks in (1, 3, 64, 1000):
+            hist, errors, defects, counts = binRunParallel(
+                self.filename, 200, 0.1, 20, m2e.checkGates, 1, numchunks)
+            self.assertTrue((hist == m2e.bindata).all())
+            self.assertEqual(len(errors), 0)
+            self.assertEqual(counts['events'], len(m2e.mdumparray))
+
+    def test_binRunParallel_workerError(self):
+        # the error of a worker reaches the caller, not the pool's own
+        with mock.patch('midas2eva.parallel.MidasFile.iterBankWords',
+                        side_effect=ValueError('corrupt chunk')):
+            self.assertRaises(ValueError, binRunParallel, self.filename,
+                              200, 0.1, 20, None, 2)
+
+    def test_binParallel(self):
+        expected = self.serial().bindata
+        m2e = midas2eva.MidasToEva(self.filename)
+        m2e.binParallel(0.1, 20, jobs=3)
+        self.assertTrue((m2e.bindata == expected).all())
+        stages = m2e.metrics.record()['stages']
+        self.assertEqual(stages['binParallel']['cycles'], 1500)
+
+    def test_split_events(self):
+        # MPET events split over two MIDAS events, and a missing cycle
+        words = []
+        for cycle in range(1, 40):
+            if cycle == 30:
+                continue
+            words += [0x80000000 | (cycle << 16), 0,
+                      0x20000000 | (cycle << 16), cycle,
+                      0x30000000 | (cycle << 16), 0]
+        with open(self.filename, 'wb') as datafile:
+            for start in range(0, len(words), 5):
+                datafile.write(makeDataEvent([('MPET',
+                                               words[start:start + 5])]))
+
+        m2e = midas2eva.MidasToEva(self.filename)
+        m2e.collectMdumpData()
+        m2e.reorganizeMdumpData()
+        try:
+            m2e.binMdumpData(0.1, 20)
+        except MissingEvent as err:
+            expected = err.cycleNumber
+        for numchunks in (2, 5, 40):
+            try:
+                binRunParallel(self.filename, 200, 0.1, 20, m2e.checkGates,
+                               1, numchunks)
+            except MissingEvent as err:
+                self.assertEqual(err.cycleNumber, expected)
+            else:
+                self.fail('MissingEvent not raised')
+
+        m2e.binMdumpData(0.1, 20, onerror='drop')
+        hist, errors, defects, counts = binRunParallel(
+            self.filename, 200, 0.1, 20, None, 1, 5)
+        self.assertEqual(defects, m2e.gatedefects)
+        self.assertEqual(len(defects), 1)
+
+        # without the gap the error words and histograms match too
+        m2e.mdumparray = m2e.mdumparray[m2e.mdumparray['cycle'] < 30]
+        m2e.binMdumpData(0.1, 20)
+        words = np.array(words, dtype=np.uint32)
+        with open(self.filename, 'wb') as datafile:
+            for start in range(0, 29 * 6, 5):
+                datafile.write(makeDataEvent([('MPET',
+                                               words[start:start + 5])]))
+        hist, errors, defects, counts = binRunParallel(
+            self.filename, 200, 0.1, 20, m2e.checkGates, 1, 7)
+        self.assertTrue((hist == m2e.bindata).all())
+        self.assertEqual(len(errors), 29)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+
+import numpy as np
+from midas2eva.positions import (decodePositions, positionCycles,
+                                 accumulateImages)
+
+
+class Tests(TestCase):
+    def test_decodePositions(self):
+        x, y = decodePositions([0x1234, 0xffff, 0xab0000ff])
+        self.assertEqual(x.dtype, np.uint8)
+        self.assertEqual(list(x), [0x12, 0xff, 0x00])
+        self.assertEqual(list(y), [0x34, 0xff, 0xff])
+
+    def test_positionCycles(self):
+        # three MIDAS events: the first closes cycle 0, the second leaves
+        # cycle 1 open and the third closes cycles 1 and 2
+        closeidx = np.array([3, 9, 12])
+        rows = positionCycles([2, 1, 3], [8, 8, 10], closeidx)
+        self.assertEqual(list(rows), [0, 0, 1, 2, 2, 2])
+        self.assertEqual(len(positionCycles([0, 0], [4, 4], closeidx)), 0)
+
+    def test_accumulateImages(self):
+        x = np.array([1, 1, 255, 7])
+        y = np.array([2, 2, 0, 7])
+        image = accumulateImages(x, y)
+        self.assertEqual(image.shape, (1, 256, 256))
+        self.assertEqual(image[0, 2, 1], 2)
+        self.assertEqual(image[0, 0, 255], 1)
+        self.assertEqual(image.sum(), 4)
+
+        images = accumulateImages(x, y, [0, 1, 1, 5], numgroups=2)
+        self.assertEqual(images.shape, (2, 256, 256))
+        self.assertEqual(images[0, 2, 1], 1)
+        self.assertEqual(images[1, 2, 1], 1)
+        self.assertEqual(images[1, 0, 255], 1)
+        self.assertEqual(images.sum(), 3)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import midas2eva
+from midas2eva.synthetic import writeSyntheticRun
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'run.mid')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_writeSyntheticRun(self):
+        numions = writeSyntheticRun(self.filename, numcycles=1100,
+                                    ionspercycle=3, cyclesperevent=7,
+                                    mcpp=True, numfreqsteps=3,
+                                    freqlist='(1000000, 20, 3)')
+
+        m2e = midas2eva.MidasToEva(self.filename)
+        m2e.extractXML()
+        m2e.getElem()
+        m2e.getRFTime()
+        m2e.getStartTime()
+        m2e.getEndTime()
+        m2e.getNumFreqSteps()
+        self.assertEqual(m2e.mass, '1K39')
+        self.assertEqual(m2e.trf, 0.175)
+        self.assertEqual(m2e.endtime - m2e.starttime, 550)
+        self.assertEqual(m2e.numfreqsteps, 3)
+        self.assertEqual(m2e.genFreqList(), [999980.0, 1000000.0, 1000020.0])
+
+        # the streamed parse sees every transition too
+        streamed = midas2eva.MidasToEva(self.filename)
+        streamed.extractXML(keys=midas2eva.midas2eva.ODB_KEYS)
+        streamed.getRFTime()
+        self.assertEqual(streamed.trf, 0.175)
+
+        # cycle counters wrap at 1024 without tripping the gate checks
+        m2e.collectMdumpData()
+        m2e.reorganizeMdumpData()
+        m2e.binMdumpData(0.1, 100)
+        self.assertEqual(len(m2e.bindata), 1100)
+        self.assertEqual(m2e.bindata.sum(), numions)
+        self.assertEqual(len(m2e.posdata), numions)
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+
+import numpy as np
+from midas2eva.textout import numDigits, formatIntLines
+
+
+class Tests(TestCase):
+    def test_numDigits(self):
+        self.assertEqual(list(numDigits(np.array([0, 9, 10, 99, 100,
+                                                  2 ** 40]))),
+                         [1, 1, 2, 2, 3, 13])
+
+    def test_formatIntLines(self):
+        rows = np.random.RandomState(0).randint(0, 100000, (200, 3))
+        rows[:5] = [[0, 0, 0], [1, 10, 100], [9, 99, 999],
+                    [10 ** 9, 7, 0], [65535, 255, 1]]
+        expected = ''.join('%d %d %d\n' % tuple(row) for row in rows)
+        self.assertEqual(formatIntLines(rows.T), expected)
+        self.assertEqual(formatIntLines([[3, 4], [12, 0]], separator='\t'),
+                         '3\t12\n4\t0\n')
+        self.assertEqual(formatIntLines([[], []]), '')
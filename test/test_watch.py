@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import os
+import json
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase
+
+from midas2eva import watch
+from midas2eva.synthetic import writeSyntheticRun
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.datadir = os.path.join(self.tmpdir, 'data')
+        os.mkdir(self.datadir)
+        self.config = watch.loadConfig(
+            datadir=self.datadir, output=os.path.join(self.tmpdir, 'eva'),
+            posoutput=os.path.join(self.tmpdir, 'pos'), jobs=1,
+            metrics=os.path.join(self.tmpdir, 'metrics.json'))
+
+        writeSyntheticRun(os.path.join(self.datadir, '1.mid'), numcycles=20,
+                          mcpp=True, numfreqsteps=5)
+        # a run that is still being written has no end-of-run event yet
+        writeSyntheticRun(os.path.join(self.datadir, '2.mid'), numcycles=20)
+        with open(os.path.join(self.datadir, '2.mid'), 'r+b') as datafile:
+            datafile.truncate(os.path.getsize(datafile.name) - 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_loadConfig(self):
+        configfile = os.path.join(self.tmpdir, 'config.json')
+        with open(configfile, 'w') as outfile:
+            json.dump({'output': '/eva', 'jobs': 4}, outfile)
+        config = watch.loadConfig(configfile, jobs=None, interval=0.5)
+        self.assertEqual(config['output'], '/eva')
+        self.assertEqual(config['jobs'], 4)
+        self.assertEqual(config['interval'], 0.5)
+        self.assertEqual(config['binwidth'], 0.1)
+
+        with open(configfile, 'w') as outfile:
+            json.dump({'outptu': '/eva'}, outfile)
+        self.assertRaises(ValueError, watch.loadConfig, configfile)
+
+    def test_poll(self):
+        watcher = watch.RunWatcher(self.config)
+        self.assertEqual(watcher.poll(),
+                         [os.path.join(self.datadir, '1.mid')])
+        self.assertEqual(watcher.poll(), [])
+
+        writeSyntheticRun(os.path.join(self.datadir, '2.mid'), numcycles=20)
+        self.assertEqual(watcher.poll(),
+                         [os.path.join(self.datadir, '2.mid')])
+
+    def test_run(self):
+        out = StringIO()
+        watch.RunWatcher(self.config).run(once=True, out=out)
+        self.assertTrue('Converted ' + os.path.join(self.datadir, '1.mid')
+                        in out.getvalue())
+        self.assertEqual(os.listdir(self.config['output']), ['1_eva.dat'])
+        self.assertEqual(os.listdir(self.config['posoutput']), ['1_pos.dat'])
+        with open(self.config['metrics']) as lines:
+            self.assertEqual(len(lines.readlines()), 1)
+
+        # a restarted daemon leaves converted runs alone
+        watcher = watch.RunWatcher(self.config)
+        self.assertEqual(watcher.poll(), [])
+
+    def test_run_reportError(self):
+        # a metrics file that cannot be written stops the daemon with the
+        # IOError itself
+        self.config['metrics'] = self.tmpdir
+        self.assertRaises(IOError, watch.RunWatcher(self.config).run,
+                          once=True, out=StringIO())